@@ -0,0 +1,94 @@
+"""
+Measure badge requests per second with the previous handler, which queried
+the most recent report and rendered the SVG on every request, against the
+cached handler, with and without clients revalidating their ETag.
+
+Requires a running PostgreSQL database, see `benchmarks.utils.DSN`.
+
+    python -m benchmarks.badge
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+from async_asgi_testclient import TestClient
+from starlette.requests import Request
+from starlette.responses import Response
+
+from opencoverage.api.app import HTTPApplication
+from opencoverage.api.badge import render_badge
+from opencoverage.settings import Settings
+
+from .utils import DSN, report
+
+REPORTS = 200
+REQUESTS = 2_000
+CONCURRENCY = 10
+BADGE = "/benchmark/repos/benchmark/badge.svg"
+
+
+async def legacy_badge(request: Request, org: str, repo: str) -> Response:
+    # reference implementation: previous, uncached
+    _, reports = await request.app.db.get_reports(org, repo, limit=1)
+    svg, _ = render_badge.__wrapped__(round(reports[0].line_rate * 100))
+    return Response(svg, media_type="image/svg+xml")
+
+
+async def seed(app: HTTPApplication) -> None:
+    for idx in range(REPORTS):
+        await app.db.save_coverage(
+            organization="benchmark",
+            repo="benchmark",
+            branch=f"branch{idx % 10}",
+            commit_hash=f"badge{idx}",
+            coverage={
+                "lines_valid": 100,
+                "lines_covered": idx % 100,
+                "line_rate": (idx % 100) / 100,
+                "branches_valid": 0,
+                "branches_covered": 0,
+                "branch_rate": 0,
+                "complexity": 0,
+                "file_coverage": {},
+            },
+        )
+
+
+async def requests_per_second(
+    client: TestClient, path: str, headers: Optional[Dict[str, str]] = None
+) -> float:
+    async def worker(count: int) -> None:
+        for _ in range(count):
+            resp = await client.get(path, headers=headers)
+            assert resp.status_code in (200, 304)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(REQUESTS // CONCURRENCY) for _ in range(CONCURRENCY)])
+    return REQUESTS / (time.perf_counter() - start)
+
+
+async def run() -> None:
+    app = HTTPApplication(Settings(dsn=DSN, scm="dummy", consume_tasks=False))
+    app.add_api_route("/{org}/repos/{repo}/legacy-badge.svg", legacy_badge)
+    async with TestClient(app) as client:
+        await seed(app)
+        report(
+            "legacy",
+            rps=await requests_per_second(
+                client, "/benchmark/repos/benchmark/legacy-badge.svg"
+            ),
+        )
+        etag = (await client.get(BADGE)).headers["etag"]
+        report("cached", rps=await requests_per_second(client, BADGE))
+        report(
+            "cached, not modified",
+            rps=await requests_per_second(client, BADGE, {"If-None-Match": etag}),
+        )
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
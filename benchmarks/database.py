@@ -0,0 +1,118 @@
+"""
+Measure writing the coverage records of a report as the number of files grows,
+and uploading the same report for a commit again.
+
+Requires a running PostgreSQL database, see `benchmarks.utils.DSN`.
+
+    python -m benchmarks.database
+"""
+import asyncio
+import time
+from datetime import datetime
+
+from opencoverage import types
+from opencoverage.database import Database
+from opencoverage.models import ROOT_PROJECT, CoverageRecord
+from opencoverage.settings import Settings
+
+from .utils import DSN, report
+
+SIZES = (1_000, 10_000, 100_000)
+# one insert per row is slow, don't wait for it on the largest sizes
+MAX_INSERT_SIZE = 10_000
+LINES_PER_FILE = 50
+
+
+def build(size: int) -> types.CoverageData:
+    return {
+        "version": "1",
+        "timestamp": 0,
+        "lines_valid": size * LINES_PER_FILE,
+        "lines_covered": size * LINES_PER_FILE // 2,
+        "line_rate": 0.5,
+        "branches_covered": 0,
+        "branches_valid": 0,
+        "branch_rate": 0,
+        "complexity": 0,
+        "file_coverage": {
+            f"src/pkg{idx % 100}/module{idx}.py": {
+                "line_rate": 0.5,
+                "branch_rate": 0,
+                "complexity": 0,
+                "lines": {line: line % 2 for line in range(1, LINES_PER_FILE + 1)},
+            }
+            for idx in range(size)
+        },
+    }
+
+
+async def insert(db: Database, coverage: types.CoverageData, commit_hash: str) -> None:
+    # reference implementation: previous, one insert per record
+    async with db.db.transaction():
+        for filename, source in coverage["file_coverage"].items():
+            await db.db.add(
+                CoverageRecord(
+                    branch="master",
+                    organization="benchmark",
+                    repo="benchmark",
+                    commit_hash=commit_hash,
+                    filename=filename,
+                    project=ROOT_PROJECT,
+                    lines=source["lines"],
+                    line_rate=source["line_rate"],
+                    branch_rate=source["branch_rate"],
+                    complexity=source["complexity"],
+                    creation_date=datetime.utcnow(),
+                    modification_date=datetime.utcnow(),
+                )
+            )
+
+
+async def save(db: Database, coverage: types.CoverageData, commit_hash: str) -> None:
+    await db.save_coverage(
+        organization="benchmark",
+        repo="benchmark",
+        branch="master",
+        commit_hash=commit_hash,
+        coverage=coverage,
+    )
+
+
+async def run(size: int) -> None:
+    db = Database(Settings(dsn=DSN, scm="dummy"))
+    await db.initialize()
+    try:
+        coverage = build(size)
+        # make sure the reports exist, without records from previous runs
+        await save(db, build(0), f"insert-{size}")
+        await save(db, build(0), f"copy-{size}")
+        if size <= MAX_INSERT_SIZE:
+            start = time.perf_counter()
+            await insert(db, coverage, f"insert-{size}")
+            elapsed = time.perf_counter() - start
+            report(f"insert {size}", seconds=elapsed, rows_per_sec=size / elapsed)
+
+        start = time.perf_counter()
+        await save(db, coverage, f"copy-{size}")
+        elapsed = time.perf_counter() - start
+        report(f"copy {size}", seconds=elapsed, rows_per_sec=size / elapsed)
+
+        lsn = await db.db.fetch_val("SELECT pg_current_wal_lsn()")
+        start = time.perf_counter()
+        await save(db, coverage, f"copy-{size}")
+        elapsed = time.perf_counter() - start
+        wal = await db.db.fetch_val(
+            "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), :lsn)", {"lsn": lsn}
+        )
+        report(f"unchanged {size}", seconds=elapsed, wal_kb=float(wal) / 1024)
+    finally:
+        await db.finalize()
+
+
+def main():
+    for size in SIZES:
+        asyncio.run(run(size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Measure computing the diff coverage of a large pull request, a synthetic
+diff touching 50k covered lines, with the previous implementation that
+looked up every covered line in the list of diff lines.
+
+    python -m benchmarks.diff
+"""
+import copy
+from typing import List, Tuple
+from unittest.mock import Mock
+
+from opencoverage import types
+from opencoverage.reporter import CoverageReporter
+
+from .utils import report, timeit
+
+FILES = 50
+LINES_PER_FILE = 5_000
+DIFF_LINES_PER_FILE = 1_000
+
+
+def build() -> Tuple[List[types.DiffCoverage], types.CoverageData]:
+    diff_data: List[types.DiffCoverage] = [
+        {
+            "filename": f"src/module{idx}.py",
+            "lines": list(
+                range(1, LINES_PER_FILE + 1, LINES_PER_FILE // DIFF_LINES_PER_FILE)
+            ),
+            "line_rate": 0.0,
+            "hits": 0,
+            "misses": 0,
+        }
+        for idx in range(FILES)
+    ]
+    coverage = {
+        "line_rate": 0.5,
+        "file_coverage": {
+            f"src/module{idx}.py": {
+                "line_rate": 0.5,
+                "lines": {line: line % 3 for line in range(1, LINES_PER_FILE + 1)},
+            }
+            for idx in range(FILES)
+        },
+    }
+    return diff_data, coverage  # type: ignore
+
+
+def get_line_rate(
+    diff_data: List[types.DiffCoverage], coverage: types.CoverageData
+) -> Tuple[List[types.DiffCoverage], float]:
+    # reference implementation: previous, list lookups
+    total = 0
+    covered = 0
+    covered_diff_data = []
+    for ddata in diff_data:
+        try:
+            lines = coverage["file_coverage"][ddata["filename"]]["lines"]
+        except KeyError:
+            continue
+
+        file_total = 0
+        file_covered = 0
+        ddata["hits"] = ddata["misses"] = 0
+        for line_no, hits in lines.items():
+            if line_no in ddata["lines"]:
+                file_total += 1
+                if hits:
+                    file_covered += 1
+                    ddata["hits"] += 1
+                else:
+                    ddata["misses"] += 1
+
+        if file_total > 0:
+            ddata["line_rate"] = file_covered / file_total
+        else:
+            ddata["line_rate"] = 1.0
+        total += file_total
+        covered += file_covered
+        covered_diff_data.append(ddata)
+
+    if total > 0:
+        return covered_diff_data, covered / total
+    return covered_diff_data, 1.0
+
+
+def main():
+    diff_data, coverage = build()
+    reporter = CoverageReporter(
+        settings=Mock(),
+        db=Mock(),
+        scm=Mock(),
+        organization="benchmark",
+        repo="benchmark",
+        branch="branch",
+        commit="commit",
+    )
+    expected = get_line_rate(copy.deepcopy(diff_data), coverage)
+    assert reporter.get_line_rate(copy.deepcopy(diff_data), coverage) == expected
+    diff_lines = sum(len(ddata["lines"]) for ddata in diff_data)
+    for name, func in (("list", get_line_rate), ("set", reporter.get_line_rate)):
+        report(
+            f"diff coverage {name}",
+            diff_lines=diff_lines,
+            seconds=timeit(func, diff_data, coverage, number=3),
+        )
+
+
+if __name__ == "__main__":
+    main()
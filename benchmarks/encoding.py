@@ -0,0 +1,63 @@
+"""
+Compare storing line hits as JSONB with the binary encoding, in table size
+and in time to read and decode the files of the guillotina fixture.
+
+Requires a running PostgreSQL database, see `benchmarks.utils.DSN`.
+
+    python -m benchmarks.encoding
+"""
+import asyncio
+import json
+import time
+
+import asyncpg
+
+from opencoverage.encoding import decode_lines, encode_lines
+from opencoverage.parser import parse_raw_coverage_data
+
+from .utils import DSN, read_data, report
+
+READS = 5
+
+
+async def run() -> None:
+    coverage = parse_raw_coverage_data(read_data("guillotina.cov"))
+    files = coverage["file_coverage"]
+    conn = await asyncpg.connect(DSN)
+    try:
+        await conn.execute(
+            "CREATE TEMPORARY TABLE lines_benchmark "
+            "(filename VARCHAR PRIMARY KEY, lines JSONB, lines_data BYTEA)"
+        )
+        await conn.executemany(
+            "INSERT INTO lines_benchmark VALUES ($1, $2, $3)",
+            [
+                (filename, json.dumps(source["lines"]), encode_lines(source["lines"]))
+                for filename, source in files.items()
+            ],
+        )
+        for column, decode in (("lines", json.loads), ("lines_data", decode_lines)):
+            size = await conn.fetchval(
+                f"SELECT sum(pg_column_size({column})) FROM lines_benchmark"
+            )
+            start = time.perf_counter()
+            for _ in range(READS):
+                for filename in files:
+                    decode(
+                        await conn.fetchval(
+                            f"SELECT {column} FROM lines_benchmark WHERE filename = $1",
+                            filename,
+                        )
+                    )
+            elapsed = (time.perf_counter() - start) / (READS * len(files))
+            report(column, size_kb=size / 1024, read_ms=elapsed * 1000)
+    finally:
+        await conn.close()
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Compare insert and query timings of the report tables with the previous
+single column indexes and with the composite indexes in opencoverage.models.
+
+Tables are seeded in a scratch schema that is removed afterwards.
+Requires a running PostgreSQL database, see `benchmarks.utils.DSN`.
+
+    python -m benchmarks.indexes --reports 100000
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from typing import Any, Dict
+
+import asyncpg
+
+from opencoverage import models
+
+from .utils import DSN, report
+
+SCHEMA = "indexes_benchmark"
+TABLES = ("coveragereports", "coveragerecords", "coveragereportpullrequests")
+# previous indexes, one per primary key column
+SINGLE_COLUMN_INDEXES = {
+    table: ("organization", "repo", "branch", "commit_hash", "project")
+    for table in TABLES
+}
+FILES_PER_REPORT = 20
+# every nth report is for a pull request
+PULL_REPORTS = 10
+QUERIES = 50
+
+SEED = {
+    "coveragereports": f"""
+INSERT INTO {SCHEMA}.coveragereports
+(organization, repo, branch, commit_hash, project, line_rate,
+ creation_date, modification_date)
+SELECT 'org' || (i % 10), 'repo' || (i % 1000), 'branch' || (i % 5), md5(i::text), '',
+       random(), now() - i * interval '1 second', now() - i * interval '1 second'
+FROM generate_series(1, $1) i
+""",
+    "coveragerecords": f"""
+INSERT INTO {SCHEMA}.coveragerecords
+(organization, repo, branch, commit_hash, project, filename, lines_hash, line_rate,
+ creation_date, modification_date)
+SELECT 'org' || (i % 10), 'repo' || (i % 1000), 'branch' || (i % 5), md5(i::text), '',
+       'src/module' || f || '.py', md5(f::text), random(), now(), now()
+FROM generate_series(1, $1) i, generate_series(1, {FILES_PER_REPORT}) f
+""",
+    "coveragereportpullrequests": f"""
+INSERT INTO {SCHEMA}.coveragereportpullrequests
+(organization, repo, branch, commit_hash, project, pull, line_rate,
+ creation_date, modification_date)
+SELECT 'org' || (i % 10), 'repo' || (i % 1000), 'branch' || (i % 5), md5(i::text), '',
+       i % 500, random(), now() - i * interval '1 second', now() - i * interval '1 second'
+FROM generate_series(1, $1) i WHERE i % {PULL_REPORTS} = 0
+""",
+}
+
+# query shapes of opencoverage.database, with the sample values they use
+QUERIES_SQL = {
+    "repo reports": (
+        f"""
+SELECT * FROM {SCHEMA}.coveragereports WHERE organization = $1 AND repo = $2
+ORDER BY modification_date DESC, branch DESC, commit_hash DESC, project DESC LIMIT 10
+""",
+        ("organization", "repo"),
+    ),
+    "badge": (
+        f"""
+SELECT * FROM {SCHEMA}.coveragereports
+WHERE organization = $1 AND repo = $2 AND branch = $3 AND project = ''
+ORDER BY modification_date DESC, commit_hash DESC LIMIT 1
+""",
+        ("organization", "repo", "branch"),
+    ),
+    "report": (
+        f"""
+SELECT * FROM {SCHEMA}.coveragereports
+WHERE organization = $1 AND repo = $2 AND commit_hash = $3 AND project = ''
+""",
+        ("organization", "repo", "commit_hash"),
+    ),
+    "report files": (
+        f"""
+SELECT filename, line_rate FROM {SCHEMA}.coveragerecords
+WHERE organization = $1 AND repo = $2 AND commit_hash = $3 AND project = ''
+ORDER BY filename LIMIT 500
+""",
+        ("organization", "repo", "commit_hash"),
+    ),
+    "pr reports": (
+        f"""
+SELECT * FROM {SCHEMA}.coveragereportpullrequests
+WHERE organization = $1 AND repo = $2 AND pull = $3 AND commit_hash = $4
+ORDER BY modification_date DESC, branch DESC, project DESC LIMIT 10
+""",
+        ("organization", "repo", "pull", "commit_hash"),
+    ),
+}
+
+
+def sample(idx: int) -> Dict[str, Any]:
+    # values of the rows seeded for idx
+    return {
+        "organization": f"org{idx % 10}",
+        "repo": f"repo{idx % 1000}",
+        "branch": f"branch{idx % 5}",
+        "commit_hash": hashlib.md5(str(idx).encode()).hexdigest(),
+        "pull": idx % 500,
+    }
+
+
+async def create_tables(conn: asyncpg.Connection, composite: bool) -> None:
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    for table in TABLES:
+        if composite:
+            # indexes as defined in opencoverage.models
+            await conn.execute(
+                f"CREATE TABLE {SCHEMA}.{table} (LIKE public.{table} INCLUDING ALL)"
+            )
+            continue
+        await conn.execute(
+            f"CREATE TABLE {SCHEMA}.{table} (LIKE public.{table} INCLUDING DEFAULTS)"
+        )
+        primary_key = [
+            column.name for column in models.Base.metadata.tables[table].primary_key
+        ]
+        await conn.execute(
+            f"ALTER TABLE {SCHEMA}.{table} ADD PRIMARY KEY ({', '.join(primary_key)})"
+        )
+        for column in SINGLE_COLUMN_INDEXES[table]:
+            await conn.execute(f"CREATE INDEX ON {SCHEMA}.{table} ({column})")
+
+
+async def run(num_reports: int, composite: bool) -> Dict[str, float]:
+    conn = await asyncpg.connect(DSN)
+    timings: Dict[str, float] = {}
+    try:
+        await create_tables(conn, composite)
+        for table in TABLES:
+            start = time.perf_counter()
+            await conn.execute(SEED[table], num_reports)
+            timings[f"insert {table}"] = time.perf_counter() - start
+            await conn.execute(f"ANALYZE {SCHEMA}.{table}")
+
+        rand = random.Random(0)
+        samples = [
+            # pull reports are only seeded for every nth report
+            sample(rand.randrange(1, num_reports // PULL_REPORTS) * PULL_REPORTS)
+            for _ in range(QUERIES)
+        ]
+        for name, (sql, params) in QUERIES_SQL.items():
+            start = time.perf_counter()
+            for values in samples:
+                await conn.fetch(sql, *[values[param] for param in params])
+            timings[f"query {name}"] = (time.perf_counter() - start) / len(samples)
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reports", type=int, default=100_000)
+    arguments = parser.parse_args()
+    before = asyncio.run(run(arguments.reports, composite=False))
+    after = asyncio.run(run(arguments.reports, composite=True))
+    for name in before:
+        report(name, before=before[name], after=after[name])
+
+
+if __name__ == "__main__":
+    main()
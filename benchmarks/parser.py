@@ -0,0 +1,128 @@
+"""
+Compare the streaming cobertura parser with a full DOM parse and the
+native lcov reader with converting lcov to cobertura first.
+
+    python -m benchmarks.parser [--scale N]
+
+`--scale` repeats the packages of tests/data/guillotina.cov and the
+records of tests/data/lcov N times to simulate larger reports.
+"""
+import argparse
+import os
+from typing import List
+
+from lcov_cobertura import LcovCobertura
+from lxml import etree
+
+from opencoverage import parser
+
+from .utils import (
+    measure,
+    read_data,
+    report,
+    timeit,
+)
+
+
+def parse_xml_dom(cov_data: bytes, toc: List[str]):
+    # reference implementation: previous, DOM based, parser
+    dom = etree.fromstring(cov_data)
+    try:
+        base_report_path = parser.get_el(parser.get_el(dom, "sources"), "source").text
+    except parser.ParsingException:
+        base_report_path = ""
+    file_coverage = {}
+    for pel in parser.get_el(dom, "packages").findall("package"):
+        for classes in pel.findall("classes"):
+            for klass in classes.findall("class"):
+                lines = {}
+                for lel in parser.get_el(klass, "lines").findall("line"):
+                    lines[int(lel.attrib["number"])] = int(lel.attrib["hits"])
+                filename = klass.attrib["filename"]
+                if filename not in toc:
+                    for part in reversed(base_report_path.split(os.path.sep)):
+                        filename = f"{part}{os.path.sep}{filename}"
+                        if filename in toc:
+                            break
+                    else:
+                        continue
+                file_coverage[filename] = lines
+    return file_coverage
+
+
+def load(scale: int):
+    data = read_data("guillotina.cov")
+    toc_raw, _, files_data = data.partition(b"<<<<<< network")
+    toc = [li for li in toc_raw.decode("utf-8").splitlines() if li]
+    cov_data = [
+        value
+        for name, value in parser.parse_files(files_data.decode("utf-8")).items()
+        if name.endswith(".xml")
+    ][0]
+    if scale > 1:
+        head, _, rest = cov_data.partition("<packages>")
+        packages, _, tail = rest.partition("</packages>")
+        cov_data = head + "<packages>" + packages * scale + "</packages>" + tail
+    return cov_data.encode("utf-8"), toc
+
+
+def run_dom(scale: int):
+    cov_data, toc = load(scale)
+    parse_xml_dom(cov_data, toc)
+
+
+def run_streaming(scale: int):
+    cov_data, toc = load(scale)
+    parser.parse_xml_coverage_data(cov_data, toc)
+
+
+def run_baseline(scale: int):
+    load(scale)
+
+
+def load_lcov(scale: int):
+    toc_raw, _, files_data = read_data("lcov").decode("utf-8").partition("<<<<<< network")
+    toc = [li for li in toc_raw.splitlines() if li]
+    cov_data = [
+        value
+        for name, value in parser.parse_files(files_data).items()
+        if name.endswith(".lcov")
+    ][0]
+    records = []
+    scaled_toc = []
+    for idx in range(scale):
+        records.append(cov_data.replace("SF:", f"SF:{idx}/"))
+        scaled_toc.extend(f"{idx}/{name}" for name in toc)
+    return "\n".join(records), scaled_toc
+
+
+def parse_lcov_cobertura(cov_data: str, toc: List[str]):
+    return parser.parse_xml_coverage_data(LcovCobertura(cov_data).convert(), toc)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--scale", type=int, default=1)
+    arguments = arg_parser.parse_args()
+
+    baseline = measure(run_baseline, arguments.scale)
+    report("load data", **baseline)
+    for name, func in (("dom", run_dom), ("streaming", run_streaming)):
+        result = measure(func, arguments.scale)
+        report(
+            name,
+            parse_seconds=result["seconds"] - baseline["seconds"],
+            max_rss=result["max_rss"],
+            parse_rss=result["max_rss"] - baseline["max_rss"],
+        )
+
+    cov_data, toc = load_lcov(arguments.scale)
+    for name, func in (
+        ("lcov via cobertura", parse_lcov_cobertura),
+        ("lcov native", parser.parse_lcov_coverage_data),
+    ):
+        report(name, seconds=timeit(func, cov_data, toc, number=5))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Measure resolving report filenames against the upload toc as the number of
+files grows.
+
+    python -m benchmarks.paths
+"""
+import os
+from typing import List
+
+from opencoverage import parser
+
+from .utils import report, timeit
+
+SIZES = (1_000, 10_000, 100_000)
+# list membership is quadratic, don't wait for it on the largest sizes
+MAX_LIST_SIZE = 10_000
+BASE_PATH = "/home/runner/work/monorepo/monorepo/src"
+
+
+def build(size: int):
+    toc = [f"src/pkg{idx % 100}/module{idx}.py" for idx in range(size)]
+    filenames = [f"pkg{idx % 100}/module{idx}.py" for idx in range(size)]
+    return toc, filenames
+
+
+def resolve_list(toc: List[str], filenames: List[str]) -> None:
+    # reference implementation: previous, list based, resolution
+    for filename in filenames:
+        if filename not in toc:
+            for part in reversed(BASE_PATH.split(os.path.sep)):
+                filename = f"{part}{os.path.sep}{filename}"
+                if filename in toc:
+                    break
+
+
+def resolve_index(toc: List[str], filenames: List[str]) -> None:
+    index = parser.PathIndex(toc)
+    for filename in filenames:
+        index.resolve(filename, BASE_PATH)
+
+
+def main():
+    for size in SIZES:
+        toc, filenames = build(size)
+        if size <= MAX_LIST_SIZE:
+            report(f"list {size}", seconds=timeit(resolve_list, toc, filenames))
+        report(f"index {size}", seconds=timeit(resolve_index, toc, filenames))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Measure latency from adding a task to it starting to run, under bursty load,
+with the runner polling versus listening for task notifications, and coverage
+report throughput as the number of concurrent tasks grows.
+
+Requires a running PostgreSQL database, see `benchmarks.utils.DSN`.
+
+    python -m benchmarks.tasks
+"""
+import asyncio
+import statistics
+import time
+from typing import Dict, List
+from unittest.mock import patch
+
+import pydantic
+
+from opencoverage import taskrunner, tasks
+from opencoverage.database import Database
+from opencoverage.models import Task
+from opencoverage.settings import Settings
+from opencoverage.utils import shutdown_process_pool
+
+from .utils import DSN, read_data, report
+
+BURSTS = 10
+BURST_SIZE = 20
+# idle time between bursts
+BURST_INTERVAL = 0.3
+REPORTS = 20
+CONCURRENCY = (1, 2, 4, 8)
+# simulated round trip to the scm
+SCM_LATENCY = 0.1
+
+
+class Config(pydantic.BaseModel):
+    idx: int
+
+
+async def run(listen: bool) -> List[float]:
+    settings = Settings(dsn=DSN, scm="dummy")
+    db = Database(settings)
+    await db.initialize()
+    runner = taskrunner.TaskRunner(settings, db)
+    if not listen:
+        runner.listen = _no_listen  # type: ignore
+
+    added: Dict[int, float] = {}
+    latencies: List[float] = []
+
+    async def task(runner, config: Config) -> None:
+        latencies.append(time.perf_counter() - added[config.idx])
+
+    taskrunner._registered["benchmark"] = (task, Config)
+    await runner.start_consuming()
+    try:
+        for burst in range(BURSTS):
+            for idx in range(burst * BURST_SIZE, (burst + 1) * BURST_SIZE):
+                added[idx] = time.perf_counter()
+                await runner.add(name="benchmark", config=Config(idx=idx))
+            await asyncio.sleep(BURST_INTERVAL)
+        while len(latencies) < BURSTS * BURST_SIZE:
+            await asyncio.sleep(0.1)
+    finally:
+        await runner.stop_consuming()
+        del taskrunner._registered["benchmark"]
+        await db.finalize()
+    return latencies
+
+
+async def _no_listen() -> None:
+    ...
+
+
+class StubSCM:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        ...
+
+    async def file_exists(self, *args, **kwargs) -> bool:
+        await asyncio.sleep(SCM_LATENCY)
+        return False
+
+    async def get_pulls(self, *args, **kwargs) -> list:
+        await asyncio.sleep(SCM_LATENCY)
+        return []
+
+
+async def throughput(concurrency: int) -> float:
+    settings = Settings(dsn=DSN, scm="dummy", task_concurrency=concurrency)
+    db = Database(settings)
+    await db.initialize()
+    runner = taskrunner.TaskRunner(settings, db)
+    data = read_data("guillotina.cov")
+    for idx in range(REPORTS):
+        await runner.add(
+            name="coveragereport",
+            config=tasks.CoverageTaskConfig(
+                organization="benchmark",
+                repo="benchmark",
+                branch="master",
+                commit=f"{concurrency}-{idx}",
+                installation_id=None,
+                data=data,
+            ),
+        )
+    start = time.perf_counter()
+    with patch.object(tasks, "get_client", return_value=StubSCM()):
+        await runner.start_consuming()
+        try:
+            while await db.db.query(Task).filter(Task.status != "error").count() > 0:
+                await asyncio.sleep(0.05)
+        finally:
+            await runner.stop_consuming()
+    elapsed = time.perf_counter() - start
+    await db.finalize()
+    return REPORTS / elapsed
+
+
+def main():
+    for concurrency in CONCURRENCY:
+        report(
+            f"workers {concurrency}", tasks_per_sec=asyncio.run(throughput(concurrency))
+        )
+    shutdown_process_pool()
+
+    for name, listen in (("poll", False), ("notify", True)):
+        latencies = asyncio.run(run(listen))
+        report(
+            name,
+            mean=statistics.mean(latencies),
+            p50=statistics.median(latencies),
+            p99=sorted(latencies)[int(len(latencies) * 0.99)],
+            max=max(latencies),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,21 @@
+import json
+import logging
+from typing import Dict, Optional, Tuple
+
+import asyncpg
 from fastapi import APIRouter, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.requests import Request
+from starlette.responses import JSONResponse
 
 from opencoverage import taskrunner
-from opencoverage.database import Database
+from opencoverage.cache import LRUCache
+from opencoverage.database import REPORTS_CHANNEL, Database, InvalidCursorException
 from opencoverage.settings import Settings
+from opencoverage.storage import get_storage
+from opencoverage.utils import shutdown_process_pool
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -14,17 +25,33 @@ async def ping(request: Request):
     return {"pong": True}
 
 
+async def invalid_cursor(request: Request, exc: InvalidCursorException):
+    return JSONResponse({"reason": "invalidCursor"}, status_code=400)
+
+
 class HTTPApplication(FastAPI):
     def __init__(self, settings: Settings):
         super().__init__(title="API")
         self.include_router(router)
+        self.add_exception_handler(InvalidCursorException, invalid_cursor)
 
         self.db = Database(settings)
+        self.storage = get_storage(settings, self.db)
 
         self.settings = settings
 
         self.taskrunner = taskrunner.TaskRunner(settings, self.db)
 
+        # line rate percentage, or None without reports, by
+        # (organization, repo, branch, project, generation)
+        self.badge_cache: LRUCache[Optional[int]] = LRUCache(
+            settings.badge_cache_size, settings.badge_cache_ttl
+        )
+        # bumped for each saved report so the cached rates of the repository
+        # are no longer used and expire from the cache
+        self.badge_generations: Dict[Tuple[str, str], int] = {}
+        self._reports_listener: Optional[asyncpg.Connection] = None
+
         self.add_event_handler("startup", self.initialize)
         self.add_event_handler("shutdown", self.finalize)
 
@@ -37,8 +64,27 @@ class HTTPApplication(FastAPI):
             allow_headers=["*"],
         )
         await self.db.initialize()
-        await self.taskrunner.start_consuming()
+        try:
+            self._reports_listener = await self.db.listen(
+                REPORTS_CHANNEL, self.invalidate_badges
+            )
+        except Exception:
+            logger.warning(
+                "Could not listen for reports, badges are cached until they expire",
+                exc_info=True,
+            )
+        if self.settings.consume_tasks:
+            await self.taskrunner.start_consuming()
+
+    def invalidate_badges(self, payload: str) -> None:
+        organization, repo = json.loads(payload)
+        key = (organization, repo)
+        self.badge_generations[key] = self.badge_generations.get(key, 0) + 1
 
     async def finalize(self) -> None:
         await self.taskrunner.stop_consuming()
+        if self._reports_listener is not None:
+            await self._reports_listener.close()
+            self._reports_listener = None
         await self.db.finalize()
+        shutdown_process_pool()
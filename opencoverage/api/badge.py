@@ -1,4 +1,6 @@
-from typing import Optional
+import functools
+import hashlib
+from typing import Optional, Tuple
 
 from starlette.requests import Request
 from starlette.responses import JSONResponse, Response
@@ -22,6 +24,8 @@ COLORS = (
     (0, Colors.GT_0),
 )
 
+_MISSING = object()
+
 
 @router.get("/{org}/repos/{repo}/badge.svg")
 async def get_badge(
@@ -31,19 +35,52 @@ async def get_badge(
     branch: Optional[str] = None,
     project: Optional[str] = None,
 ):
-    db = request.app.db
-    _, reports = await db.get_reports(org, repo, branch=branch, project=project, limit=1)
-    if len(reports) == 0:
+    # read before querying, so a report saved meanwhile is not hidden
+    generation = request.app.badge_generations.get((org, repo), 0)
+    key = (org, repo, branch, project, generation)
+    rate = request.app.badge_cache.get(key, _MISSING)
+    if rate is _MISSING:
+        report = await request.app.db.get_latest_report(
+            org, repo, branch=branch, project=project
+        )
+        rate = None if report is None else round(report.line_rate * 100)
+        request.app.badge_cache.set(key, rate)
+    if rate is None:
         return JSONResponse({"reason": "notFound"}, status_code=404)
 
-    report = reports[0]
-    rate = round(report.line_rate * 100)
+    svg, etag = render_badge(rate)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"max-age={request.app.settings.badge_max_age}",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(svg, media_type="image/svg+xml", headers=headers)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    for value in if_none_match.split(","):
+        value = value.strip()
+        if value.startswith("W/"):
+            value = value[2:]
+        if value in ("*", etag):
+            return True
+    return False
+
+
+# rates are percentages, so every badge fits
+@functools.lru_cache(maxsize=128)
+def render_badge(rate: int) -> Tuple[bytes, str]:
+    """
+    SVG of the badge for a line rate percentage, with its ETag
+    """
     for crate, color in COLORS:  # pragma: no cover
         if rate >= crate:
             break
 
-    return Response(
-        f"""<svg
+    svg = f"""<svg
   xmlns="http://www.w3.org/2000/svg"
   xmlns:xlink="http://www.w3.org/1999/xlink"
   width="122"
@@ -101,6 +138,5 @@ async def get_badge(
     </text>
   </g>
 </svg>
-""",
-        media_type="image/svg+xml",
-    )
+""".encode()
+    return svg, f'"{hashlib.sha1(svg).hexdigest()}"'
@@ -1,7 +1,8 @@
 import logging
 import os
+import tempfile
 import zlib
-from typing import Optional
+from typing import IO, List, Optional
 from urllib.parse import parse_qs
 
 from starlette.requests import Request
@@ -9,11 +10,15 @@ from starlette.responses import PlainTextResponse
 
 from opencoverage import tasks
 from opencoverage.clients.scm import get_client
+from opencoverage.utils import run_async
 
 from .app import router
 
 logger = logging.getLogger(__name__)
 
+DECOMPRESS_CHUNK_SIZE = 64 * 1024
+SPOOL_WRITE_SIZE = 1024 * 1024
+
 
 @router.post("/upload/v4")
 async def upload_coverage_v4(request: Request):
@@ -32,6 +37,47 @@ async def upload_coverage_v4(request: Request):
     return PlainTextResponse(f"success\n{upload_url}")
 
 
+async def _spool_body(request: Request, spool: IO[bytes]) -> int:
+    """
+    Write the request body to spool as it is received, decompressing
+    gzip bodies incrementally, so uploads are never held in memory whole.
+
+    The spool rolls over to disk for large uploads so writes are batched
+    and done in the executor instead of blocking the event loop.
+    """
+    gzip_worker = None
+    if request.headers.get("content-type") == "application/x-gzip":
+        gzip_worker = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    size = 0
+    pending: List[bytes] = []
+    pending_size = 0
+    async for chunk in request.stream():
+        if gzip_worker is None:
+            pending.append(chunk)
+            pending_size += len(chunk)
+        else:
+            data = gzip_worker.decompress(chunk, DECOMPRESS_CHUNK_SIZE)
+            while data:
+                pending.append(data)
+                pending_size += len(data)
+                data = gzip_worker.decompress(
+                    gzip_worker.unconsumed_tail, DECOMPRESS_CHUNK_SIZE
+                )
+        if pending_size >= SPOOL_WRITE_SIZE:
+            await run_async(spool.writelines, pending)
+            size += pending_size
+            pending = []
+            pending_size = 0
+    if gzip_worker is not None:
+        data = gzip_worker.flush()
+        pending.append(data)
+        pending_size += len(data)
+    await run_async(spool.writelines, pending)
+    await run_async(spool.seek, 0)
+    return size + pending_size
+
+
 @router.put("/upload-report")
 async def upload_report(
     request: Request,
@@ -40,13 +86,12 @@ async def upload_report(
     slug: str,
     token: Optional[str] = None,
 ):
-    data = await request.body()
-    logger.info(f"Upload body {len(data)}: {request.headers}")
-
-    if request.headers.get("content-type") == "application/x-gzip":
-        gzip_worker = zlib.decompressobj(zlib.MAX_WBITS | 16)
-        data = gzip_worker.decompress(data) + gzip_worker.flush()
-        logger.info(f"decompressed gzip data {len(data)}")
+    with tempfile.SpooledTemporaryFile(
+        max_size=request.app.settings.upload_spool_size
+    ) as spool:
+        size = await _spool_body(request, spool)
+        logger.info(f"Upload body {size}: {request.headers}")
+        data_key = await request.app.storage.put(spool)
 
     organization, _, repo = slug.partition("/")
 
@@ -75,7 +120,7 @@ async def upload_report(
             commit=commit,
             project=project,
             installation_id=installation_id,
-            data=data,
+            data_key=data_key,
         ),
     )
     logger.info("Task scheduled")
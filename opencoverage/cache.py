@@ -0,0 +1,75 @@
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Hashable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+
+class LRUCache(Generic[T]):
+    """
+    In-process cache keeping the most recently used values, optionally
+    expiring them after ttl seconds.
+
+    maxsize bounds the number of values, or their total size when sizeof
+    is given.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        sizeof: Optional[Callable[[T], int]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.size = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, T, int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            stored, value, _ = self._data[key]
+        except KeyError:
+            return default
+        if self.ttl is not None and time.monotonic() - stored > self.ttl:
+            self.delete(key)
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: T) -> None:
+        size = 1 if self.sizeof is None else self.sizeof(value)
+        self.delete(key)
+        if size > self.maxsize:
+            return
+        self._data[key] = (time.monotonic(), value, size)
+        self.size += size
+        while self.size > self.maxsize:
+            _, (_, _, evicted) = self._data.popitem(last=False)
+            self.size -= evicted
+
+    def delete(self, key: Hashable) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= item[2]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.size = 0
+
+
+_MISSING = object()
@@ -7,8 +7,10 @@ from typing import (
     Type,
 )
 
+from opencoverage.parser import parse_diff
 from opencoverage.settings import Settings
-from opencoverage.types import Pull
+from opencoverage.types import DiffCoverage, Pull
+from opencoverage.utils import run_async
 
 
 class SCMClient(abc.ABC):
@@ -32,6 +34,15 @@ class SCMClient(abc.ABC):
     ) -> str:  # pragma: no cover
         ...
 
+    async def get_pull_diff_coverage(
+        self, org: str, repo: str, pull: Pull
+    ) -> List[DiffCoverage]:
+        """
+        Lines changed by the pull request, by file
+        """
+        diff = await self.get_pull_diff(org, repo, pull.id)
+        return await run_async(parse_diff, diff)
+
     @abc.abstractmethod
     async def create_check(
         self, org: str, repo: str, commit: str, details_url: Optional[str] = None
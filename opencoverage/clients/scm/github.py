@@ -1,3 +1,5 @@
+import copy
+import sys
 import time
 from datetime import datetime, timedelta, timezone
 from typing import (
@@ -6,16 +8,21 @@ from typing import (
     Dict,
     List,
     Optional,
+    Tuple,
     cast,
 )
 
 import aiohttp_client
 import jwt
+import orjson
 import pydantic
 from cryptography.hazmat.backends import default_backend
 
+from opencoverage.cache import LRUCache
+from opencoverage.parser import parse_diff
 from opencoverage.settings import Settings
-from opencoverage.types import Pull
+from opencoverage.types import DiffCoverage, Pull
+from opencoverage.utils import run_async
 
 from .base import SCMClient
 from .exceptions import (
@@ -162,6 +169,110 @@ class Permissions:
 # this should
 _token_cache: Dict[str, Token] = {}
 _private_key_cache = {}
+# parsed diff of pull requests by head commit, with the ETag to revalidate it
+_diff_cache: Optional[LRUCache[Tuple[str, List[DiffCoverage]]]] = None
+
+
+def _get_diff_cache(settings: Settings) -> LRUCache[Tuple[str, List[DiffCoverage]]]:
+    global _diff_cache
+    if _diff_cache is None:
+        _diff_cache = LRUCache(settings.github_diff_cache_size)
+    return _diff_cache
+
+
+# validator, headers and body of GET responses by installation, url, params and
+# accept header, so unchanged resources are revalidated with If-None-Match,
+# which does not count against the rate limit
+_response_cache: Optional[LRUCache[Tuple[str, Any, bytes]]] = None
+# larger bodies, or bodies of unknown size, are streamed and not kept in memory
+CACHE_MAX_BODY_SIZE = 1024 * 1024
+
+
+def _get_response_cache(settings: Settings) -> LRUCache[Tuple[str, Any, bytes]]:
+    global _response_cache
+    if _response_cache is None:
+        # bounded by the total size of the cached bodies
+        _response_cache = LRUCache(
+            settings.github_response_cache_size, sizeof=lambda item: len(item[2])
+        )
+    return _response_cache
+
+
+class _StreamReader:
+    def __init__(self, data: bytes):
+        self._data = data
+        self._position = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        start = self._position
+        end = len(self._data) if size < 0 else start + size
+        chunk = self._data[start:end]
+        self._position += len(chunk)
+        return chunk
+
+
+class CachedResponse:
+    """
+    Response with the body read into memory, used in place of an aiohttp
+    response for cached and revalidated GET requests.
+    """
+
+    def __init__(self, status: int, headers: Any, body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.content = _StreamReader(body)
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self, encoding: str = "utf-8") -> str:
+        return self.body.decode(encoding)
+
+    async def json(self) -> Any:
+        return orjson.loads(self.body)
+
+
+class _ConditionalRequest:
+    def __init__(
+        self,
+        request,
+        cache: LRUCache[Tuple[str, Any, bytes]],
+        key: Tuple[Any, ...],
+        cached: Optional[Tuple[str, Any, bytes]],
+    ):
+        self._request = request
+        self._cache = cache
+        self._key = key
+        self._cached = cached
+
+    async def __aenter__(self):
+        resp = await self._request.__aenter__()
+        if resp.status == 304 and self._cached is not None:
+            _, headers, body = self._cached
+            return CachedResponse(200, headers, body)
+        etag = resp.headers.get("ETag")
+        length = resp.headers.get("Content-Length")
+        if (
+            resp.status != 200
+            or etag is None
+            or length is None
+            or int(length) > CACHE_MAX_BODY_SIZE
+        ):
+            return resp
+        try:
+            body = await resp.read()
+        except BaseException:
+            # __aexit__ is not called when entering fails, release the response
+            await self._request.__aexit__(*sys.exc_info())
+            raise
+        headers = resp.headers.copy()
+        if len(body) <= CACHE_MAX_BODY_SIZE:
+            self._cache.set(self._key, (etag, headers, body))
+        return CachedResponse(resp.status, headers, body)
+
+    async def __aexit__(self, *args):
+        return await self._request.__aexit__(*args)
 
 
 class Github(SCMClient):
@@ -252,12 +363,34 @@ class Github(SCMClient):
         headers: Optional[Dict[str, str]] = None,
         params: Optional[Dict[str, str]] = None,
         json: Optional[Dict[str, Any]] = None,
+        cache: bool = True,
     ):
+        """
+        GET requests are revalidated from the response cache unless cache is
+        False or the caller sends its own If-None-Match
+        """
         func = getattr(aiohttp_client, method.lower())
         headers = headers or {}
+        params = params or {}
+        response_cache = _get_response_cache(self.settings)
+        cache_key = None
+        cached = None
+        if cache and method.lower() == "get" and "If-None-Match" not in headers:
+            cache_key = (
+                self.installation_id,
+                url,
+                tuple(sorted(params.items())),
+                headers.get("Accept"),
+            )
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                headers["If-None-Match"] = cached[0]
         token = await self.get_access_token()
         headers["Authorization"] = f"token {token}"
-        return func(url, headers=headers, params=params or {}, json=json)
+        request = func(url, headers=headers, params=params, json=json)
+        if cache_key is None:
+            return request
+        return _ConditionalRequest(request, response_cache, cache_key, cached)
 
     async def validate(self) -> None:
         # Check the installation is correctly working
@@ -307,22 +440,66 @@ class Github(SCMClient):
             for item in data:
                 gpull = GithubPull.parse_obj(item)
                 pulls.append(
-                    Pull(base=gpull.base.ref, head=gpull.head.ref, id=gpull.number)
+                    Pull(
+                        base=gpull.base.ref,
+                        head=gpull.head.ref,
+                        head_sha=gpull.head.sha,
+                        id=gpull.number,
+                    )
                 )
         return pulls
 
     async def get_pull_diff(self, org: str, repo: str, id: int) -> str:
+        data, _ = await self._get_pull_diff(org, repo, id)
+        return cast(str, data)
+
+    async def _get_pull_diff(
+        self, org: str, repo: str, id: int, etag: Optional[str] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Diff and ETag of the pull request, no diff when it still matches etag
+        """
         url = f"{GITHUB_API_URL}/repos/{org}/{repo}/pulls/{id}"
+        headers = {"Accept": "application/vnd.github.v3.diff"}
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        # the parsed diff is cached instead, see get_pull_diff_coverage
         async with await self._prepare_request(
             url=url,
             method="get",
-            headers={"Accept": "application/vnd.github.v3.diff"},
+            headers=headers,
+            cache=False,
         ) as resp:
+            if resp.status == 304 and etag is not None:
+                return None, etag
             if resp.status == 401:
                 text = await resp.json()
                 raise AuthorizationException(f"API Unauthorized: {text}")
             data = await resp.text(encoding="latin-1")
-        return data
+            return data, resp.headers.get("ETag")
+
+    async def get_pull_diff_coverage(
+        self, org: str, repo: str, pull: Pull
+    ) -> List[DiffCoverage]:
+        """
+        The diff of a head commit is fetched and parsed once, uploads for the
+        same commit only revalidate it, which does not count against the
+        rate limit.
+        """
+        diff_cache = _get_diff_cache(self.settings)
+        key = (org, repo, pull.id, pull.head_sha)
+        cached = diff_cache.get(key)
+        data, etag = await self._get_pull_diff(
+            org, repo, pull.id, etag=None if cached is None else cached[0]
+        )
+        if cached is not None and data is None:
+            diff_data = cached[1]
+        else:
+            diff_data = await run_async(parse_diff, data)
+            if etag is not None:
+                diff_cache.set(key, (etag, diff_data))
+        # the line rates of the diff are filled in by the reporter
+        return copy.deepcopy(diff_data)
 
     async def create_check(
         self,
@@ -1,13 +1,18 @@
 import argparse
 import asyncio
 import logging
+import signal
 
 import dotenv
 import uvicorn
 
+from opencoverage import tasks  # noqa
 from opencoverage.api.app import HTTPApplication
 
+from .database import Database
 from .settings import Settings
+from .taskrunner import TaskRunner
+from .utils import shutdown_process_pool
 
 parser = argparse.ArgumentParser(description="command runner", add_help=False)
 parser.add_argument(
@@ -21,14 +26,22 @@ def run_command():
     asyncio.run(_run())
 
 
-async def _run():
+def run_worker():
+    asyncio.run(_run_worker())
+
+
+def _load_settings() -> Settings:
     logging.basicConfig(level=logging.INFO)
 
     arguments, _ = parser.parse_known_args()
     if arguments.env_file:
         dotenv.load_dotenv(arguments.env_file)
 
-    settings = Settings()
+    return Settings()
+
+
+async def _run():
+    settings = _load_settings()
     app = HTTPApplication(settings)
     configuration = uvicorn.Config(
         app,
@@ -42,3 +55,27 @@ async def _run():
     server = uvicorn.Server(config=configuration)
     print(f"Running server: {settings}")
     await server.serve()
+
+
+async def _run_worker():
+    """
+    Only run tasks, without serving the API
+    """
+    settings = _load_settings()
+    db = Database(settings)
+    runner = TaskRunner(settings, db)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    print(f"Running worker: {settings}")
+    await db.initialize()
+    try:
+        await runner.start_consuming()
+        await stop.wait()
+    finally:
+        await runner.stop_consuming()
+        await db.finalize()
+        shutdown_process_pool()
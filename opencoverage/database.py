@@ -1,25 +1,42 @@
+import base64
+import binascii
+import hashlib
+import json
 from datetime import datetime
 from typing import (
+    Any,
+    Callable,
+    Dict,
     List,
     Optional,
+    Sequence,
+    Set,
     Tuple,
+    Type,
     TypedDict,
     cast,
 )
 
+import asyncpg
+import sqlalchemy as sa
 import sqlalchemy.exc
 import sqlalchemy.orm.exc
 from asyncom.om import OMDatabase
 from databases import DatabaseURL
+from sqlalchemy.dialects.postgresql import insert
 
 from . import models, types
+from .encoding import decode_lines, encode_lines
 from .models import (
     ROOT_PROJECT,
+    Blob,
     Branch,
     Commit,
+    CoverageLines,
     CoverageRecord,
     CoverageReport,
     CoverageReportPullRequest,
+    LatestReport,
     Organization,
     PullRequest,
     Repo,
@@ -27,6 +44,80 @@ from .models import (
 )
 from .settings import Settings
 
+TASKS_CHANNEL = "opencoverage_tasks"
+# notified with the json encoded [organization, repo] of saved reports
+REPORTS_CHANNEL = "opencoverage_reports"
+COVERAGE_RECORD_COLUMNS = (
+    "branch",
+    "organization",
+    "repo",
+    "commit_hash",
+    "filename",
+    "project",
+    "lines_hash",
+    "line_rate",
+    "branch_rate",
+    "complexity",
+    "creation_date",
+    "modification_date",
+)
+UPSERT_COVERAGE_RECORD = f"""
+INSERT INTO coveragerecords ({", ".join(COVERAGE_RECORD_COLUMNS)})
+VALUES ({", ".join(f"${idx + 1}" for idx in range(len(COVERAGE_RECORD_COLUMNS)))})
+ON CONFLICT (filename, organization, repo, branch, commit_hash, project)
+DO UPDATE SET
+    lines = NULL,
+    lines_hash = EXCLUDED.lines_hash,
+    line_rate = EXCLUDED.line_rate,
+    branch_rate = EXCLUDED.branch_rate,
+    complexity = EXCLUDED.complexity,
+    modification_date = EXCLUDED.modification_date
+"""
+ADD_COVERAGE_LINES = """
+INSERT INTO coveragelines (hash, data, creation_date)
+SELECT hash, data, $3 FROM unnest($1::varchar[], $2::bytea[]) AS lines(hash, data)
+ON CONFLICT (hash) DO NOTHING
+"""
+
+
+class InvalidCursorException(Exception):
+    ...
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Opaque cursor pointing after the row with values
+    """
+    data = json.dumps(
+        [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    )
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor: str, columns: Sequence[sa.Column]) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(cursor)
+        return [
+            datetime.fromisoformat(value)
+            if isinstance(column.type, sa.DateTime)
+            else value
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError, binascii.Error):
+        raise InvalidCursorException(cursor)
+
+
+def _get_value(row: Any, column: sa.Column) -> Any:
+    if isinstance(row, models.Base):
+        return getattr(row, column.key)
+    # rows of queries on multiple models have their columns prefixed
+    label = f"{column.table.name}_{column.key}"
+    if label in row:
+        return row[label]
+    return row[column.key]
+
 
 class ReportFilesType(TypedDict):
     filename: str
@@ -36,6 +127,7 @@ class ReportFilesType(TypedDict):
 class Database:
     def __init__(self, settings: Settings):
         models.init(settings.dsn)
+        self.dsn = settings.dsn
         self.db = OMDatabase(DatabaseURL(settings.dsn))
 
     async def initialize(self):
@@ -50,47 +142,83 @@ class Database:
                 # loop closing
                 ...
 
-    async def _ensure_ob(self, model, **data):
-        filters = []
-        for key, value in data.items():
-            filters.append(getattr(model, key) == value)
-        try:
-            return await self.db.query(model).filter(*filters).one()
-        except sqlalchemy.orm.exc.NoResultFound:
-            ob = model(
-                creation_date=datetime.utcnow(),
-                modification_date=datetime.utcnow(),
-                **data,
+    async def _ensure_obs(
+        self,
+        *obs: Tuple[Type[models.Base], Dict[str, Any]],
+        update: Optional[Dict[Type[models.Base], Sequence[str]]] = None,
+    ) -> None:
+        """
+        Create the objects that do not exist yet, in a single statement.
+
+        Objects are inserted in order, so parents can be passed before
+        the objects referencing them. The columns in update of existing
+        objects of that model are set to the given values when they differ.
+        """
+        now = datetime.utcnow()
+        inserts = []
+        values: Dict[str, Any] = {}
+        for idx, (model, data) in enumerate(obs):
+            data = {**data, "creation_date": now, "modification_date": now}
+            params = {f"ob{idx}_{key}": value for key, value in data.items()}
+            table = model.__tablename__
+            columns = (update or {}).get(model)
+            if columns:
+                conflict = (
+                    f"ON CONFLICT ({', '.join(c.name for c in model.__table__.primary_key)}) "
+                    f"DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in columns)}, "
+                    "modification_date = EXCLUDED.modification_date "
+                    f"WHERE ({', '.join(f'{table}.{c}' for c in columns)}) "
+                    f"IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in columns)})"
+                )
+            else:
+                conflict = "ON CONFLICT DO NOTHING"
+            inserts.append(
+                f"ensure{idx} AS (INSERT INTO {table} "
+                f"({', '.join(data.keys())}) "
+                f"VALUES ({', '.join(':' + param for param in params.keys())}) "
+                f"{conflict})"
             )
-            await self.db.add(ob)
-            return ob
+            values.update(params)
+        await self.db.execute(f"WITH {', '.join(inserts)} SELECT 1", values)
 
     async def _paged_results(
         self,
         query,
-        cursor_type,
+        order: Sequence[sa.Column],
         limit: int = 10,
         cursor: Optional[str] = None,
         reverse: bool = False,
-    ) -> Tuple[Optional[str], List[models.Base]]:
+    ) -> Tuple[Optional[str], List[Any]]:
+        """
+        Keyset pagination, order needs to be unique within the results of query
+        """
         if cursor is not None:
-            query = query.filter(cursor_type > cursor)
+            values = decode_cursor(cursor, order)
+            key: Any
+            after: Any
+            if len(order) == 1:
+                key, after = order[0], values[0]
+            else:
+                key, after = sa.tuple_(*order), sa.tuple_(*values)
+            query = query.filter(key < after if reverse else key > after)
         if reverse:
-            query = query.order_by(cursor_type.desc()).limit(limit)
+            query = query.order_by(*[column.desc() for column in order])
         else:
-            query = query.order_by(cursor_type).limit(limit)
-        results = await query.all()
-        cursor = None
+            query = query.order_by(*order)
+        results = await query.limit(limit).all()
+        next_cursor = None
         if len(results) == limit:
-            cursor = getattr(results[-1], cursor_type.key)
-        return cursor, results
+            next_cursor = encode_cursor(
+                [_get_value(results[-1], column) for column in order]
+            )
+        return next_cursor, results
 
     async def get_repos(
         self, organization: str, limit: int = 10, cursor: Optional[str] = None
     ) -> Tuple[Optional[str], List[Repo]]:
         return await self._paged_results(
             self.db.query(Repo).filter(Repo.organization == organization),
-            Repo.name,
+            [Repo.name],
             limit=limit,
             cursor=cursor,
         )
@@ -105,19 +233,24 @@ class Database:
         cursor: Optional[str] = None,
     ) -> Tuple[str, List[CoverageReport]]:
         query = self.db.query(CoverageReport)
-        if organization is not None:
-            query = query.filter(CoverageReport.organization == organization)
-        if repo is not None:
-            query = query.filter(CoverageReport.repo == repo)
-        if branch is not None:
-            query = query.filter(CoverageReport.branch == branch)
-        if project is not None:
-            query = query.filter(CoverageReport.project == project)
+        # the primary key columns not filtered on make the order unique
+        order: List[Any] = [CoverageReport.modification_date]
+        for column, value in (
+            (CoverageReport.organization, organization),
+            (CoverageReport.repo, repo),
+            (CoverageReport.branch, branch),
+            (CoverageReport.commit_hash, None),
+            (CoverageReport.project, project),
+        ):
+            if value is None:
+                order.append(column)
+            else:
+                query = query.filter(column == value)
         return cast(
             Tuple[str, List[CoverageReport]],
             await self._paged_results(
                 query,
-                CoverageReport.modification_date,
+                order,
                 limit=limit,
                 cursor=cursor,
                 reverse=True,
@@ -138,34 +271,66 @@ class Database:
             [CoverageReportPullRequest, CoverageReport],
             mapper_factory=lambda q, context: lambda v: v,
         )
-        if organization is not None:
-            query = query.filter(CoverageReportPullRequest.organization == organization)
-        if repo is not None:
-            query = query.filter(CoverageReportPullRequest.repo == repo)
-        if pull is not None:
-            query = query.filter(CoverageReportPullRequest.pull == int(pull))
-        if commit is not None:
-            query = query.filter(CoverageReportPullRequest.commit_hash == commit)
-        if project is not None:
-            query = query.filter(CoverageReportPullRequest.project == project)
+        order: List[Any] = [CoverageReportPullRequest.modification_date]
+        for column, value in (
+            (CoverageReportPullRequest.organization, organization),
+            (CoverageReportPullRequest.repo, repo),
+            (CoverageReportPullRequest.branch, None),
+            (CoverageReportPullRequest.commit_hash, commit),
+            (CoverageReportPullRequest.project, project),
+            (CoverageReportPullRequest.pull, None if pull is None else int(pull)),
+        ):
+            if value is None:
+                order.append(column)
+            else:
+                query = query.filter(column == value)
+        # join on the full report key so the primary key of coveragereports
+        # is used instead of matching every report with the same commit hash
         query = query.outerjoin(
             CoverageReport,
-            CoverageReportPullRequest.commit_hash == CoverageReport.commit_hash,
-        ).filter(
-            CoverageReportPullRequest.project == CoverageReport.project,
+            sa.and_(
+                CoverageReportPullRequest.organization == CoverageReport.organization,
+                CoverageReportPullRequest.repo == CoverageReport.repo,
+                CoverageReportPullRequest.branch == CoverageReport.branch,
+                CoverageReportPullRequest.commit_hash == CoverageReport.commit_hash,
+                CoverageReportPullRequest.project == CoverageReport.project,
+            ),
         )
-
-        if cursor is not None:
-            query = query.filter(CoverageReportPullRequest.modification_date > cursor)
-        query = query.order_by(CoverageReportPullRequest.modification_date.desc()).limit(
-            limit
+        return cast(
+            Tuple[str, List[types.PRReportResult]],
+            await self._paged_results(
+                query,
+                order,
+                limit=limit,
+                cursor=cursor,
+                reverse=True,
+            ),
         )
 
-        results = await query.all()
-        cursor_result = None
-        if len(results) == limit:
-            cursor_result = results[-1]["coveragereportpullrequests_modification_date"]
-        return cast(Tuple[str, List[types.PRReportResult]], (cursor_result, results))
+    async def get_latest_report(
+        self,
+        organization: str,
+        repo: str,
+        branch: Optional[str] = None,
+        project: Optional[str] = None,
+    ) -> Optional[LatestReport]:
+        """
+        Most recent report of the repo, optionally of a branch and project.
+        With both, this is a primary key lookup.
+        """
+        query = self.db.query(LatestReport).filter(
+            LatestReport.organization == organization, LatestReport.repo == repo
+        )
+        if branch is not None:
+            query = query.filter(LatestReport.branch == branch)
+        if project is not None:
+            query = query.filter(LatestReport.project == project)
+        results = (
+            await query.order_by(LatestReport.modification_date.desc()).limit(1).all()
+        )
+        if len(results) == 0:
+            return None
+        return results[0]
 
     async def get_report(
         self, organization: str, repo: str, commit: str, project: Optional[str] = None
@@ -193,7 +358,7 @@ class Database:
                 self.db.query(PullRequest).filter(
                     PullRequest.organization == organization, PullRequest.repo == repo
                 ),
-                PullRequest.id,
+                [PullRequest.id],
                 limit=limit,
                 cursor=cursor,
                 reverse=True,
@@ -221,14 +386,9 @@ class Database:
             CoverageRecord.commit_hash == commit_hash,
             CoverageRecord.project == (project or ROOT_PROJECT),
         )
-        if cursor is not None:
-            query = query.filter(CoverageRecord.filename > cursor)
-        query = query.order_by(CoverageRecord.filename).limit(limit)
-        results: List[ReportFilesType] = await query.all()
-        cursor = None
-        if len(results) == limit:
-            cursor = results[-1]["filename"]
-        return cursor, results
+        return await self._paged_results(
+            query, [CoverageRecord.filename], limit=limit, cursor=cursor
+        )
 
     async def get_report_file(
         self,
@@ -238,20 +398,31 @@ class Database:
         filename: str,
         project: Optional[str] = None,
     ) -> Optional[CoverageRecord]:
-        try:
-            return (
-                await self.db.query(CoverageRecord)
-                .filter(
+        table = CoverageRecord.__table__
+        row = await self.db.fetch_one(
+            sa.select([table, CoverageLines.data.label("lines_data")])
+            .select_from(
+                table.outerjoin(
+                    CoverageLines.__table__,
+                    CoverageLines.hash == CoverageRecord.lines_hash,
+                )
+            )
+            .where(
+                sa.and_(
                     CoverageRecord.organization == organization,
                     CoverageRecord.repo == repo,
                     CoverageRecord.commit_hash == commit_hash,
                     CoverageRecord.filename == filename,
                     CoverageRecord.project == (project or ROOT_PROJECT),
                 )
-                .one()
             )
-        except sqlalchemy.orm.exc.NoResultFound:
+        )
+        if row is None:
             return None
+        values = {column.name: row[column.name] for column in table.columns}
+        if row["lines_data"] is not None:
+            values["lines"] = decode_lines(row["lines_data"])
+        return CoverageRecord(**values)
 
     def _update_coverage_data(
         self,
@@ -314,19 +485,22 @@ class Database:
         if project is None:
             project = ROOT_PROJECT
 
-        await self._ensure_ob(
-            Branch, name=pull.base, organization=organization, repo=repo
-        )
-        await self._ensure_ob(
-            Branch, name=pull.head, organization=organization, repo=repo
-        )
-        await self._ensure_ob(
-            PullRequest,
-            organization=organization,
-            repo=repo,
-            id=pull.id,
-            base=pull.base,
-            head=pull.head,
+        await self._ensure_obs(
+            (Repo, dict(name=repo, organization=organization)),
+            (Branch, dict(name=pull.base, organization=organization, repo=repo)),
+            (Branch, dict(name=pull.head, organization=organization, repo=repo)),
+            (
+                PullRequest,
+                dict(
+                    organization=organization,
+                    repo=repo,
+                    id=pull.id,
+                    base=pull.base,
+                    head=pull.head,
+                ),
+            ),
+            # the base of a pull request can be changed
+            update={PullRequest: ("base", "head")},
         )
 
         report = CoverageReportPullRequest(
@@ -385,74 +559,212 @@ class Database:
         if project is None:
             project = ROOT_PROJECT
 
-        await self._ensure_ob(Repo, name=repo, organization=organization)
-        await self._ensure_ob(Branch, name=branch, organization=organization, repo=repo)
-        await self._ensure_ob(
-            Commit, branch=branch, organization=organization, repo=repo, hash=commit_hash
+        await self._ensure_obs(
+            (Repo, dict(name=repo, organization=organization)),
+            (Branch, dict(name=branch, organization=organization, repo=repo)),
+            (
+                Commit,
+                dict(
+                    branch=branch, organization=organization, repo=repo, hash=commit_hash
+                ),
+            ),
         )
 
-        try:
-            report = (
-                await self.db.query(CoverageReport)
-                .filter(
-                    CoverageReport.organization == organization,
-                    CoverageReport.branch == branch,
-                    CoverageReport.repo == repo,
-                    CoverageReport.commit_hash == commit_hash,
-                    CoverageReport.project == project,
-                )
-                .one()
+        filters = (
+            CoverageRecord.branch == branch,
+            CoverageRecord.organization == organization,
+            CoverageRecord.repo == repo,
+            CoverageRecord.commit_hash == commit_hash,
+            CoverageRecord.project == project,
+        )
+        now = datetime.utcnow()
+        records = {}
+        # coverage of each file as stored, to find files that changed
+        states = {}
+        lines = {}
+        for filename, source in coverage["file_coverage"].items():
+            data = encode_lines(source["lines"])
+            lines_hash = hashlib.sha256(data).hexdigest()
+            lines[lines_hash] = data
+            states[filename] = (
+                lines_hash,
+                float(source["line_rate"]),
+                int(source["branch_rate"]),
+                int(source["complexity"]),
             )
-            self._update_coverage_data(report, coverage)
-            await self.db.update(report)
-        except sqlalchemy.orm.exc.NoResultFound:
-            report = CoverageReport(
-                organization=organization,
-                branch=branch,
-                repo=repo,
-                commit_hash=commit_hash,
-                creation_date=datetime.utcnow(),
-                project=project,
+            records[filename] = (
+                branch,
+                organization,
+                repo,
+                commit_hash,
+                filename,
+                project,
+                *states[filename],
+                now,
+                now,
             )
-            self._update_coverage_data(report, coverage)
-            await self.db.add(report)
 
         async with self.db.transaction():
-            await self.db.query(CoverageRecord).filter(
-                CoverageRecord.branch == branch,
-                CoverageRecord.organization == organization,
-                CoverageRecord.repo == repo,
-                CoverageRecord.commit_hash == commit_hash,
-                CoverageRecord.project == project,
-            ).delete()
-            for filename, source in coverage["file_coverage"].items():
-                await self.db.add(
-                    CoverageRecord(
-                        branch=branch,
-                        organization=organization,
-                        repo=repo,
-                        commit_hash=commit_hash,
-                        filename=filename,
-                        project=project,
-                        lines=source["lines"],
-                        line_rate=source["line_rate"],
-                        branch_rate=source["branch_rate"],
-                        complexity=source["complexity"],
-                        creation_date=datetime.utcnow(),
-                        modification_date=datetime.utcnow(),
+            try:
+                report = (
+                    await self.db.query(CoverageReport)
+                    .filter(
+                        CoverageReport.organization == organization,
+                        CoverageReport.branch == branch,
+                        CoverageReport.repo == repo,
+                        CoverageReport.commit_hash == commit_hash,
+                        CoverageReport.project == project,
                     )
+                    .one()
+                )
+                self._update_coverage_data(report, coverage)
+                await self.db.update(report)
+            except sqlalchemy.orm.exc.NoResultFound:
+                report = CoverageReport(
+                    organization=organization,
+                    branch=branch,
+                    repo=repo,
+                    commit_hash=commit_hash,
+                    creation_date=datetime.utcnow(),
+                    project=project,
+                )
+                self._update_coverage_data(report, coverage)
+                await self.db.add(report)
+            await self._update_latest_report(report)
+            # delivered once committed, to invalidate cached badges of the repo
+            await self.db.execute(
+                "SELECT pg_notify(:channel, :payload)",
+                {"channel": REPORTS_CHANNEL, "payload": json.dumps([organization, repo])},
+            )
+
+            # only write files that changed since the last upload for the commit
+            existing = {
+                row["filename"]: tuple(row.values())[1:]
+                for row in await self.db.fetch_all(
+                    sa.select(
+                        [
+                            CoverageRecord.filename,
+                            CoverageRecord.lines_hash,
+                            CoverageRecord.line_rate,
+                            CoverageRecord.branch_rate,
+                            CoverageRecord.complexity,
+                        ]
+                    ).where(sa.and_(*filters))
+                )
+            }
+            changed = [
+                filename
+                for filename, state in states.items()
+                if existing.get(filename) != state
+            ]
+            await self._add_lines(
+                {states[filename][0]: lines[states[filename][0]] for filename in changed}
+            )
+            if len(existing) == 0:
+                await self._copy_records(
+                    CoverageRecord.__tablename__,
+                    COVERAGE_RECORD_COLUMNS,
+                    list(records.values()),
                 )
+                return
+
+            removed = existing.keys() - records.keys()
+            if len(removed) > 0:
+                await self.db.query(CoverageRecord).filter(
+                    *filters, CoverageRecord.filename.in_(removed)
+                ).delete()
+            await self._upsert_records([records[filename] for filename in changed])
+
+    async def _update_latest_report(self, report: CoverageReport) -> None:
+        """
+        Make report the latest of its branch and project unless a more
+        recent report was saved concurrently.
+        """
+        values = {
+            column.name: getattr(report, column.name)
+            for column in LatestReport.__table__.columns
+        }
+        statement = insert(LatestReport.__table__).values(**values)
+        await self.db.execute(
+            statement.on_conflict_do_update(
+                index_elements=[
+                    LatestReport.organization,
+                    LatestReport.repo,
+                    LatestReport.branch,
+                    LatestReport.project,
+                ],
+                set_={
+                    name: statement.excluded[name]
+                    for name in values.keys()
+                    if name not in ("organization", "repo", "branch", "project")
+                },
+                where=LatestReport.modification_date
+                <= statement.excluded.modification_date,
+            )
+        )
 
-    async def add_task(self, *, name: str, data: bytes, status: str):
+    async def _add_lines(self, lines: Dict[str, bytes]) -> None:
+        """
+        Store line hits not stored yet for another file or commit
+        """
+        if len(lines) == 0:
+            return
+        connection = self.db.connection().raw_connection
+        await connection.execute(
+            ADD_COVERAGE_LINES,
+            list(lines.keys()),
+            list(lines.values()),
+            datetime.utcnow(),
+        )
+
+    async def _copy_records(
+        self, table: str, columns: Tuple[str, ...], records: List[Tuple[Any, ...]]
+    ) -> None:
+        """
+        Write many rows in a single round trip with COPY
+        """
+        if len(records) == 0:
+            return
+        connection = self.db.connection().raw_connection
+        await connection.copy_records_to_table(table, records=records, columns=columns)
+
+    async def _upsert_records(self, records: List[Tuple[Any, ...]]) -> None:
+        if len(records) == 0:
+            return
+        connection = self.db.connection().raw_connection
+        await connection.executemany(UPSERT_COVERAGE_RECORD, records)
+
+    async def add_task(
+        self, *, name: str, data: bytes, status: str, data_key: Optional[str] = None
+    ):
         await self.db.add(
             Task(
                 name=name,
                 data=data,
                 status=status,
+                data_key=data_key,
+                attempts=0,
                 creation_date=datetime.utcnow(),
                 modification_date=datetime.utcnow(),
             )
         )
+        # delivered to listeners once the transaction commits
+        await self.db.execute(
+            "SELECT pg_notify(:channel, :name)", {"channel": TASKS_CHANNEL, "name": name}
+        )
+
+    async def listen(
+        self, channel: str, callback: Callable[[str], None]
+    ) -> asyncpg.Connection:
+        """
+        Call callback with the payload of notifications sent to channel, using
+        a dedicated connection the caller is responsible for closing.
+        """
+        conn = await asyncpg.connect(self.dsn)
+        await conn.add_listener(
+            channel, lambda conn, pid, channel, payload: callback(payload)
+        )
+        return conn
 
     async def update_task(self, task):
         task.modification_date = datetime.utcnow()
@@ -461,17 +773,98 @@ class Database:
     async def remove_task(self, task: Task):
         await self.db.delete(task)
 
-    async def get_task(self) -> Optional[Task]:
-        try:
-            return (
-                await self.db.query(
-                    Task,
+    async def claim_task(
+        self, stale_before: datetime, max_attempts: int = 3
+    ) -> Optional[Task]:
+        """
+        Mark the oldest scheduled task as running and return it.
+
+        Running tasks not updated since stale_before belonged to a runner
+        that went away and are claimed again, unless they were already
+        claimed max_attempts times, they are marked in error then so a task
+        that brings its runner down is not retried forever.
+        """
+        async with self.db.transaction():
+            while True:
+                try:
+                    task = (
+                        await self.db.query(
+                            Task,
+                        )
+                        .filter(
+                            sa.or_(
+                                Task.status == "scheduled",
+                                sa.and_(
+                                    Task.status == "running",
+                                    Task.modification_date < stale_before,
+                                ),
+                            )
+                        )
+                        .order_by(Task.creation_date)
+                        .limit(1)
+                        .with_for_update(skip_locked=True)
+                        .one()
+                    )
+                except sqlalchemy.orm.exc.NoResultFound:
+                    return None
+                if task.attempts >= max_attempts:
+                    task.status = "error"
+                    task.info = f"Runner went away in each of {task.attempts} attempts"
+                    await self.update_task(task)
+                    continue
+                task.status = "running"
+                task.attempts += 1
+                await self.update_task(task)
+                return task
+
+    async def get_referenced_blobs(self, error_since: datetime) -> Set[str]:
+        """
+        Blob keys still used by pending tasks or by recently failed tasks
+        """
+        results = await self.db.fetch_all(
+            sa.select([Task.data_key])
+            .where(
+                sa.and_(
+                    Task.data_key.isnot(None),
+                    sa.or_(Task.status != "error", Task.modification_date > error_since),
                 )
-                .filter(Task.status != "error")
-                .order_by(Task.creation_date)
-                .limit(1)
-                .with_for_update(skip_locked=True)
-                .one()
             )
+            .distinct()
+        )
+        return {row[0] for row in results}
+
+    async def add_blob(self, *, key: str, oid: int, size: int) -> bool:
+        """
+        Register a stored blob, returns False if the key was already stored
+        """
+        now = datetime.utcnow()
+        result = await self.db.fetch_val(
+            insert(Blob.__table__)
+            .values(key=key, oid=oid, size=size, creation_date=now, modification_date=now)
+            .on_conflict_do_nothing(index_elements=[Blob.key])
+            .returning(Blob.key)
+        )
+        if result is None:
+            # already stored, refresh so it is not garbage collected
+            await self.db.execute(
+                sa.update(Blob.__table__)
+                .where(Blob.key == key)
+                .values(modification_date=now)
+            )
+            return False
+        return True
+
+    async def get_blob(self, key: str) -> Optional[Blob]:
+        try:
+            return await self.db.query(Blob).filter(Blob.key == key).one()
         except sqlalchemy.orm.exc.NoResultFound:
             return None
+
+    async def remove_blob(self, blob: Blob) -> None:
+        await self.db.delete(blob)
+
+    async def get_blob_keys(self, older_than: datetime) -> List[str]:
+        results = await self.db.fetch_all(
+            sa.select([Blob.key]).where(Blob.modification_date < older_than)
+        )
+        return [row[0] for row in results]
@@ -0,0 +1,81 @@
+import struct
+import sys
+from array import array
+from itertools import accumulate
+from typing import Dict, Tuple, Union
+
+VERSION = 1
+# version, line delta item size, hits item size, number of lines
+HEADER = struct.Struct("<BBBI")
+# array type codes by item size, smallest first
+TYPECODES = {
+    array(typecode).itemsize: typecode for typecode in reversed(("B", "H", "I", "L", "Q"))
+}
+_SIZES = sorted(TYPECODES.keys())
+
+
+class EncodingException(Exception):
+    ...
+
+
+def _pack(values) -> Tuple[int, bytes]:
+    """
+    Pack values in the smallest little endian unsigned array that fits them
+    """
+    if min(values, default=0) < 0:
+        raise EncodingException("Negative values can not be encoded")
+    largest = max(values, default=0)
+    for size in _SIZES:
+        if largest < 1 << (size * 8):
+            break
+    else:
+        raise EncodingException(f"Value too large to encode: {largest}")
+    packed = array(TYPECODES[size], values)
+    if sys.byteorder == "big":  # pragma: no cover
+        packed.byteswap()
+    return size, packed.tobytes()
+
+
+def _unpack(size: int, data: Union[bytes, memoryview]) -> array:
+    try:
+        unpacked = array(TYPECODES[size])
+    except KeyError:
+        raise EncodingException(f"Invalid item size: {size}")
+    unpacked.frombytes(data)
+    if sys.byteorder == "big":  # pragma: no cover
+        unpacked.byteswap()
+    return unpacked
+
+
+def encode_lines(lines: Dict[int, int]) -> bytes:
+    """
+    Encode line hits as sorted, delta encoded, line numbers followed by
+    the hits of each line.
+    """
+    line_numbers = sorted(lines)
+    deltas = [line - previous for previous, line in zip([0] + line_numbers, line_numbers)]
+    delta_size, packed_deltas = _pack(deltas)
+    hits_size, packed_hits = _pack([lines[line] for line in line_numbers])
+    return (
+        HEADER.pack(VERSION, delta_size, hits_size, len(line_numbers))
+        + packed_deltas
+        + packed_hits
+    )
+
+
+def decode_lines(data: bytes) -> Dict[int, int]:
+    try:
+        version, delta_size, hits_size, count = HEADER.unpack_from(data)
+    except struct.error:
+        raise EncodingException("Invalid line data")
+    if version != VERSION:
+        raise EncodingException(f"Unsupported line data version: {version}")
+    start = HEADER.size
+    hits_start = start + delta_size * count
+    end = hits_start + hits_size * count
+    if len(data) != end:
+        raise EncodingException("Invalid line data")
+    view = memoryview(data)
+    deltas = _unpack(delta_size, view[start:hits_start])
+    hits = _unpack(hits_size, view[hits_start:end])
+    return dict(zip(accumulate(deltas), hits))
@@ -1,3 +1,5 @@
+import logging
+
 import psycopg2.errors
 import sqlalchemy as sa
 import sqlalchemy.exc
@@ -7,6 +9,8 @@ from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base(cls=OMBase)
 
 
@@ -33,8 +37,8 @@ class Repo(Base):  # type: ignore
 class Branch(Base):  # type: ignore
     __tablename__ = "branches"
 
-    organization = sa.Column(sa.String, primary_key=True, index=True)
-    repo = sa.Column(sa.String, primary_key=True, index=True)
+    organization = sa.Column(sa.String, primary_key=True)
+    repo = sa.Column(sa.String, primary_key=True)
     name = sa.Column(sa.String, primary_key=True)
 
     creation_date = sa.Column(sa.DateTime)
@@ -55,12 +59,8 @@ class Branch(Base):  # type: ignore
 class PullRequest(Base):  # type: ignore
     __tablename__ = "pullrequests"
 
-    organization = sa.Column(sa.String, primary_key=True, index=True)
-    repo = sa.Column(
-        sa.String,
-        primary_key=True,
-        index=True,
-    )
+    organization = sa.Column(sa.String, primary_key=True)
+    repo = sa.Column(sa.String, primary_key=True)
     id = sa.Column(sa.Integer, primary_key=True)
     base = sa.Column(sa.String)
     head = sa.Column(sa.String)
@@ -85,10 +85,10 @@ class PullRequest(Base):  # type: ignore
 class Commit(Base):  # type: ignore
     __tablename__ = "commits"
 
-    organization = sa.Column(sa.String, primary_key=True, index=True)
-    repo = sa.Column(sa.String, primary_key=True, index=True)
-    branch = sa.Column(sa.String, primary_key=True, index=True)
-    hash = sa.Column(sa.String, primary_key=True, index=True)
+    organization = sa.Column(sa.String, primary_key=True)
+    repo = sa.Column(sa.String, primary_key=True)
+    branch = sa.Column(sa.String, primary_key=True)
+    hash = sa.Column(sa.String, primary_key=True)
 
     creation_date = sa.Column(sa.DateTime)
     modification_date = sa.Column(sa.DateTime)
@@ -108,14 +108,14 @@ ROOT_PROJECT = ""
 class CoverageReport(Base):  # type: ignore
     __tablename__ = "coveragereports"
 
-    organization = sa.Column(sa.String, index=True, primary_key=True)
-    repo = sa.Column(sa.String, index=True, primary_key=True)
-    branch = sa.Column(sa.String, index=True, primary_key=True)
-    commit_hash = sa.Column(sa.String, index=True, primary_key=True)
+    organization = sa.Column(sa.String, primary_key=True)
+    repo = sa.Column(sa.String, primary_key=True)
+    branch = sa.Column(sa.String, primary_key=True)
+    commit_hash = sa.Column(sa.String, primary_key=True)
 
     # projects are a way of handling mono-repo setups where
     # you want to track coverage of multiple sub-folders seperately
-    project = sa.Column(sa.String, index=True, primary_key=True, default=ROOT_PROJECT)
+    project = sa.Column(sa.String, primary_key=True, default=ROOT_PROJECT)
 
     lines_valid = sa.Column(sa.Integer)
     lines_covered = sa.Column(sa.Integer)
@@ -134,6 +134,45 @@ class CoverageReport(Base):  # type: ignore
             [Commit.organization, Commit.repo, Commit.branch, Commit.hash],
             ondelete="SET NULL",
         ),
+        # keyset pagination of recent reports, see Database.get_reports
+        sa.Index(
+            "ix_coveragereports_recent",
+            modification_date,
+            organization,
+            repo,
+            branch,
+            commit_hash,
+            project,
+        ),
+        # listings of a repository, branch and project equality filters drop
+        # out of the order, see Database.get_reports
+        sa.Index(
+            "ix_coveragereports_repo_recent",
+            organization,
+            repo,
+            modification_date,
+            branch,
+            commit_hash,
+            project,
+        ),
+        # latest report of a branch, see the badge
+        sa.Index(
+            "ix_coveragereports_branch_recent",
+            organization,
+            repo,
+            branch,
+            project,
+            modification_date,
+            commit_hash,
+        ),
+        # reports are looked up by commit without the branch
+        sa.Index(
+            "ix_coveragereports_commit",
+            organization,
+            repo,
+            commit_hash,
+            project,
+        ),
     )
 
 
@@ -141,13 +180,16 @@ class CoverageRecord(Base):  # type: ignore
     __tablename__ = "coveragerecords"
 
     filename = sa.Column(sa.String, primary_key=True)
-    organization = sa.Column(sa.String, index=True, primary_key=True)
-    repo = sa.Column(sa.String, index=True, primary_key=True)
-    branch = sa.Column(sa.String, index=True, primary_key=True)
-    commit_hash = sa.Column(sa.String, index=True, primary_key=True)
-    project = sa.Column(sa.String, index=True, primary_key=True, default=ROOT_PROJECT)
+    organization = sa.Column(sa.String, primary_key=True)
+    repo = sa.Column(sa.String, primary_key=True)
+    branch = sa.Column(sa.String, primary_key=True)
+    commit_hash = sa.Column(sa.String, primary_key=True)
+    project = sa.Column(sa.String, primary_key=True, default=ROOT_PROJECT)
 
+    # only set on records saved before line hits were stored in CoverageLines
     lines = sa.Column(JSONB)
+    # CoverageLines the line hits of the file are stored in
+    lines_hash = sa.Column(sa.String)
 
     line_rate = sa.Column(sa.Float)
     branch_rate = sa.Column(sa.Integer)
@@ -168,17 +210,88 @@ class CoverageRecord(Base):  # type: ignore
             ],
             ondelete="SET NULL",
         ),
+        # files of a report are looked up by commit without the branch
+        sa.Index(
+            "ix_coveragerecords_commit",
+            organization,
+            repo,
+            commit_hash,
+            project,
+            filename,
+        ),
     )
 
 
+class LatestReport(Base):  # type: ignore
+    """
+    Summary of the most recent report of each branch and project, maintained
+    by Database.save_coverage, so badges do not need to sort coveragereports.
+    """
+
+    __tablename__ = "latestreports"
+
+    organization = sa.Column(sa.String, primary_key=True)
+    repo = sa.Column(sa.String, primary_key=True)
+    branch = sa.Column(sa.String, primary_key=True)
+    project = sa.Column(sa.String, primary_key=True, default=ROOT_PROJECT)
+
+    commit_hash = sa.Column(sa.String)
+
+    lines_valid = sa.Column(sa.Integer)
+    lines_covered = sa.Column(sa.Integer)
+    line_rate = sa.Column(sa.Float)
+    branches_valid = sa.Column(sa.Integer)
+    branches_covered = sa.Column(sa.Integer)
+    branch_rate = sa.Column(sa.Integer)
+    complexity = sa.Column(sa.Integer)
+
+    creation_date = sa.Column(sa.DateTime)
+    modification_date = sa.Column(sa.DateTime)
+
+    __table_args__ = (
+        sa.ForeignKeyConstraint(
+            ["organization", "repo", "branch", "commit_hash", "project"],
+            [
+                CoverageReport.organization,
+                CoverageReport.repo,
+                CoverageReport.branch,
+                CoverageReport.commit_hash,
+                CoverageReport.project,
+            ],
+            ondelete="CASCADE",
+        ),
+        # latest report of any branch, see Database.get_latest_report
+        sa.Index(
+            "ix_latestreports_recent",
+            organization,
+            repo,
+            modification_date,
+        ),
+    )
+
+
+class CoverageLines(Base):  # type: ignore
+    """
+    Line hits, see opencoverage.encoding, stored once for all files with the
+    same coverage.
+    """
+
+    __tablename__ = "coveragelines"
+
+    hash = sa.Column(sa.String, primary_key=True)
+    data = sa.Column(sa.LargeBinary)
+
+    creation_date = sa.Column(sa.DateTime)
+
+
 class CoverageReportPullRequest(Base):  # type: ignore
     __tablename__ = "coveragereportpullrequests"
 
-    organization = sa.Column(sa.String, index=True, primary_key=True)
-    repo = sa.Column(sa.String, index=True, primary_key=True)
-    branch = sa.Column(sa.String, index=True, primary_key=True)
-    commit_hash = sa.Column(sa.String, index=True, primary_key=True)
-    project = sa.Column(sa.String, index=True, primary_key=True, default=ROOT_PROJECT)
+    organization = sa.Column(sa.String, primary_key=True)
+    repo = sa.Column(sa.String, primary_key=True)
+    branch = sa.Column(sa.String, primary_key=True)
+    commit_hash = sa.Column(sa.String, primary_key=True)
+    project = sa.Column(sa.String, primary_key=True, default=ROOT_PROJECT)
 
     pull = sa.Column(sa.Integer, primary_key=True)
     pull_diff = sa.Column(JSONB)
@@ -203,6 +316,25 @@ class CoverageReportPullRequest(Base):  # type: ignore
             ],
             ondelete="SET NULL",
         ),
+        # keyset pagination of recent reports, see Database.get_pr_reports
+        sa.Index(
+            "ix_coveragereportpullrequests_recent",
+            modification_date,
+            organization,
+            repo,
+            branch,
+            commit_hash,
+            project,
+            pull,
+        ),
+        sa.Index(
+            "ix_coveragereportpullrequests_pull",
+            organization,
+            repo,
+            pull,
+            commit_hash,
+            project,
+        ),
     )
 
 
@@ -214,11 +346,30 @@ class Task(Base):  # type: ignore
     data = sa.Column(sa.LargeBinary)
     status = sa.Column(sa.String, index=True)
     info = sa.Column(sa.String)
+    # key of the raw payload in blob storage
+    data_key = sa.Column(sa.String, index=True)
+    # times the task was claimed, tasks of runners that went away are retried
+    attempts = sa.Column(sa.Integer, nullable=False, default=0, server_default="0")
 
     creation_date = sa.Column(sa.DateTime, index=True)
     modification_date = sa.Column(sa.DateTime, index=True)
 
 
+class Blob(Base):  # type: ignore
+    """
+    Raw upload payloads stored as large objects, keyed by sha256
+    """
+
+    __tablename__ = "blobs"
+
+    key = sa.Column(sa.String, primary_key=True)
+    oid = sa.Column(sa.BigInteger)
+    size = sa.Column(sa.BigInteger)
+
+    creation_date = sa.Column(sa.DateTime)
+    modification_date = sa.Column(sa.DateTime, index=True)
+
+
 MODELS = (
     Organization,
     Repo,
@@ -226,9 +377,87 @@ MODELS = (
     PullRequest,
     Commit,
     CoverageReport,
+    LatestReport,
     CoverageRecord,
+    CoverageLines,
     CoverageReportPullRequest,
     Task,
+    Blob,
+)
+
+# tables are only created when missing, changes to existing tables go here.
+# They run on every start outside of a transaction, so they must be idempotent
+# and indexes are built and dropped concurrently to not block writes.
+MIGRATIONS = (
+    "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS data_key VARCHAR",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tasks_data_key ON tasks (data_key)",
+    "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE coveragerecords ADD COLUMN IF NOT EXISTS lines_hash VARCHAR",
+    # move line hits stored on coverage records to coveragelines
+    """DO $$ BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'coveragerecords' AND column_name = 'lines_data')
+    THEN
+        INSERT INTO coveragelines (hash, data, creation_date)
+        SELECT DISTINCT encode(sha256(lines_data), 'hex'), lines_data, now()
+        FROM coveragerecords WHERE lines_data IS NOT NULL
+        ON CONFLICT DO NOTHING;
+        UPDATE coveragerecords SET lines_hash = encode(sha256(lines_data), 'hex')
+        WHERE lines_data IS NOT NULL;
+    END IF;
+    END $$""",
+    "ALTER TABLE coveragerecords DROP COLUMN IF EXISTS lines_data",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coveragereports_recent ON coveragereports
+    (modification_date, organization, repo, branch, commit_hash, project)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coveragereports_repo_recent ON coveragereports
+    (organization, repo, modification_date, branch, commit_hash, project)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coveragereportpullrequests_recent
+    ON coveragereportpullrequests
+    (modification_date, organization, repo, branch, commit_hash, project, pull)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coveragereports_branch_recent ON coveragereports
+    (organization, repo, branch, project, modification_date, commit_hash)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coveragereports_commit ON coveragereports
+    (organization, repo, commit_hash, project)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coveragerecords_commit ON coveragerecords
+    (organization, repo, commit_hash, project, filename)""",
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_coveragereportpullrequests_pull
+    ON coveragereportpullrequests (organization, repo, pull, commit_hash, project)""",
+    # single column indexes on primary key columns, replaced by the above
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_branches_organization",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_branches_repo",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_pullrequests_organization",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_pullrequests_repo",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_commits_organization",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_commits_repo",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_commits_branch",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_commits_hash",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereports_organization",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereports_repo",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereports_branch",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereports_commit_hash",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereports_project",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragerecords_organization",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragerecords_repo",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragerecords_branch",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragerecords_commit_hash",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragerecords_project",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereportpullrequests_organization",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereportpullrequests_repo",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereportpullrequests_branch",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereportpullrequests_commit_hash",
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_coveragereportpullrequests_project",
+    # fill latestreports from the reports saved before it existed
+    """INSERT INTO latestreports (organization, repo, branch, project, commit_hash,
+        lines_valid, lines_covered, line_rate, branches_valid, branches_covered,
+        branch_rate, complexity, creation_date, modification_date)
+    SELECT DISTINCT ON (organization, repo, branch, project)
+        organization, repo, branch, project, commit_hash, lines_valid, lines_covered,
+        line_rate, branches_valid, branches_covered, branch_rate, complexity,
+        creation_date, modification_date
+    FROM coveragereports
+    WHERE NOT EXISTS (SELECT 1 FROM latestreports)
+    ORDER BY organization, repo, branch, project, modification_date DESC
+    ON CONFLICT DO NOTHING""",
 )
 
 
@@ -243,4 +472,13 @@ def init(url: str) -> Engine:
             sqlalchemy.exc.ProgrammingError,
         ):
             ...
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for statement in MIGRATIONS:
+            try:
+                conn.execute(sa.text(statement))
+            except (
+                sqlalchemy.exc.OperationalError,
+                sqlalchemy.exc.ProgrammingError,
+            ):
+                logger.warning(f"Could not run migration: {statement}", exc_info=True)
     return engine
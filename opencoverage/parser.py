@@ -1,8 +1,21 @@
+import io
 import os
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
 from io import StringIO
-from typing import Dict, List
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from lcov_cobertura import LcovCobertura
 from lxml import etree
 from unidiff import PatchSet
 
@@ -20,98 +33,427 @@ def get_el(el: etree.Element, name: str) -> etree.Element:
     return rel
 
 
-def parse_files(data: str) -> Dict[str, str]:
-    files: Dict[str, str] = {}
-    lines: List[str] = []
-    filename = None
-    for line in data.strip().splitlines():
-        if line == "<<<<<< EOF":
-            if filename is not None:
-                files[filename] = "\n".join(lines)
-            lines = []
-            filename = None
-        else:
-            if filename is None:
-                # line should start with # path
-                _, _, filename = line.partition("# path=")
-            else:
-                lines.append(line)
-    return files
+NETWORK_MARKER = b"<<<<<< network"
+EOF_MARKER = b"<<<<<< EOF"
+PATH_PREFIX = "# path="
+WHITESPACE = b" \t\r\n"
 
+CoverageInput = Union[str, bytes, memoryview]
 
-def parse_xml_coverage_data(cov_data: str, toc: List[str]) -> types.CoverageData:
-    try:
-        dom = etree.fromstring(cov_data)
-    except etree.XMLSyntaxError:
-        raise ParsingException("Invalid xml")
+# coverage files submitted to the executor at once, the default process pool
+# runs one per cpu
+PARALLEL_PARSE_WINDOW = os.cpu_count() or 1
+
+
+class MemoryViewReader(io.RawIOBase):
+    """
+    Read only file object over a memoryview so slices of an upload can be
+    streamed to parsers without copying the whole slice.
+    """
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        start = self._pos
+        end = min(start + len(buffer), len(self._view))
+        buffer[: end - start] = self._view[start:end]
+        self._pos = end
+        return end - start
+
+
+def open_view(data: Union[bytes, memoryview]) -> io.BufferedReader:
+    return io.BufferedReader(MemoryViewReader(memoryview(data)))
+
+
+def scan_envelope(data: bytes) -> Tuple[List[str], int]:
+    """
+    Find the toc of a codecov upload and the offset its files section
+    starts at, without decoding or copying the files.
+    """
+    idx = data.find(NETWORK_MARKER)
+    if idx == -1:
+        return [], len(data)
+    toc = [li for li in data[:idx].decode("utf-8").splitlines() if li]
+    return toc, idx + len(NETWORK_MARKER)
+
+
+def iter_files(data: bytes, start: int = 0) -> Iterator[Tuple[str, memoryview]]:
+    """
+    Yield (path, content) for every file in the files section of an upload.
+    Content is a slice of the original buffer.
+    """
+    view = memoryview(data)
+    pos = start
+    while True:
+        end = data.find(EOF_MARKER, pos)
+        if end == -1:
+            break
+        while pos < end and data[pos] in WHITESPACE:
+            pos += 1
+        header_end = data.find(b"\n", pos, end)
+        if header_end != -1:
+            header = data[pos:header_end].decode("utf-8").strip()
+            _, _, filename = header.partition(PATH_PREFIX)
+            content_start = header_end + 1
+            yield filename, view[content_start:end]
+        pos = end + len(EOF_MARKER)
+
+
+def parse_files(data: Union[str, bytes]) -> Dict[str, str]:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return {
+        filename: "\n".join(content.tobytes().decode("utf-8").splitlines())
+        for filename, content in iter_files(data)
+    }
+
+
+def _iter_lines(cov_data: CoverageInput) -> Iterator[str]:
+    if isinstance(cov_data, str):
+        yield from cov_data.split("\n")
+    else:
+        for line in open_view(cov_data):
+            yield line.decode("utf-8").rstrip("\r\n")
+
+
+def _clear_element(el: etree.Element) -> None:
+    # free the processed element and any siblings already handled so the
+    # tree being built by iterparse does not grow with the report
+    el.clear()
+    parent = el.getparent()
+    if parent is not None:
+        while el.getprevious() is not None:
+            del parent[0]
+
+
+class PathIndex:
+    """
+    Index of repository paths (the toc sent with the upload) used to map
+    report filenames to repository files.
+
+    A report filename resolves to itself when it is in the toc, otherwise to
+    the shortest match found by prepending trailing segments of the report
+    base path. Lookups are set based so resolution cost does not grow with
+    the size of the toc.
+    """
+
+    def __init__(self, toc: Iterable[str]):
+        self._paths = set(toc)
+        self._prefixes: Dict[str, List[str]] = {}
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._paths
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def _get_prefixes(self, base_path: str) -> List[str]:
+        if base_path not in self._prefixes:
+            prefixes = []
+            prefix = ""
+            for part in reversed(base_path.split(os.path.sep)):
+                prefix = f"{part}{os.path.sep}{prefix}"
+                prefixes.append(prefix)
+            self._prefixes[base_path] = prefixes
+        return self._prefixes[base_path]
+
+    def resolve(self, filename: str, base_path: str = "") -> Optional[str]:
+        if filename in self._paths:
+            return filename
+        for prefix in self._get_prefixes(base_path):
+            candidate = f"{prefix}{filename}"
+            if candidate in self._paths:
+                return candidate
+        return None
+
+
+def get_path_index(toc: Iterable[str]) -> PathIndex:
+    if isinstance(toc, PathIndex):
+        return toc
+    return PathIndex(toc)
+
+
+def iter_xml_coverage_data(
+    cov_data: CoverageInput, toc: Iterable[str]
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Incrementally parse a cobertura report.
+
+    Yields ("coverage", attributes) for the root element followed by
+    (filename, FileCoverageData) for every class that resolves to a file
+    in the toc. Processed elements are discarded as parsing progresses so
+    memory is bounded by the largest single class instead of the report.
+    """
+    if isinstance(cov_data, str):
+        cov_data = cov_data.encode("utf-8")
 
+    index = get_path_index(toc)
+    base_report_path = None
+    root_found = False
+    context = etree.iterparse(
+        open_view(cov_data), events=("end",), tag=("source", "class", "package")
+    )
     try:
-        base_path_el = get_el(get_el(dom, "sources"), "source")
-        base_report_path = base_path_el.text
-    except ParsingException:
-        base_report_path = ""
-
-    file_coverage = {}
-    for pel in get_el(dom, "packages").findall("package"):
-        for classes in pel.findall("classes"):
-            for klass in classes.findall("class"):
+        for _, el in context:
+            if not root_found:
+                root_found = True
+                yield "coverage", dict(el.getroottree().getroot().attrib)
+
+            if el.tag == "source":
+                if base_report_path is None:
+                    base_report_path = el.text or ""
+            elif el.tag == "class":
                 lines = {}
-                for lel in get_el(klass, "lines").findall("line"):
+                for lel in get_el(el, "lines").iterfind("line"):
                     lines[int(lel.attrib["number"])] = int(lel.attrib["hits"])
 
-                # find correct filename
-                filename = klass.attrib["filename"]
-                if filename not in toc:
-                    for part in reversed(base_report_path.split(os.path.sep)):
-                        filename = f"{part}{os.path.sep}{filename}"
-                        if filename in toc:
-                            break
-                    else:
-                        # could not find valid path, ignore file
-                        continue
+                filename = index.resolve(el.attrib["filename"], base_report_path or "")
+                if filename is not None:
+                    yield filename, types.FileCoverageData(
+                        line_rate=float(el.attrib["line-rate"]),
+                        branch_rate=float(el.attrib["branch-rate"]),
+                        complexity=float(el.attrib["complexity"]),
+                        lines=lines,
+                    )
+                _clear_element(el)
+            else:
+                _clear_element(el)
+        if not root_found:
+            yield "coverage", dict(context.root.attrib)
+    except etree.XMLSyntaxError:
+        raise ParsingException("Invalid xml")
+
 
-                file_coverage[filename] = types.FileCoverageData(
-                    line_rate=float(klass.attrib["line-rate"]),
-                    branch_rate=float(klass.attrib["branch-rate"]),
-                    complexity=float(klass.attrib["complexity"]),
-                    lines=lines,
+def parse_xml_coverage_data(
+    cov_data: CoverageInput, toc: Iterable[str]
+) -> types.CoverageData:
+    attrib = None
+    file_coverage: Dict[str, types.FileCoverageData] = {}
+    for name, value in iter_xml_coverage_data(cov_data, toc):
+        if attrib is None:
+            attrib = value
+        else:
+            file_coverage[name] = value
+
+    if attrib is None:  # pragma: no cover
+        raise ParsingException("Invalid xml")
+
+    return types.CoverageData(
+        version=attrib["version"],
+        timestamp=int(attrib["timestamp"]),
+        lines_covered=int(attrib["lines-covered"]),
+        lines_valid=int(attrib["lines-valid"]),
+        line_rate=float(attrib["line-rate"]),
+        branches_covered=int(attrib["branches-covered"]),
+        branches_valid=int(attrib["branches-valid"]),
+        branch_rate=float(attrib["branch-rate"]),
+        complexity=int(attrib["complexity"]),
+        file_coverage=file_coverage,
+    )
+
+
+def _rate(total: int, covered: int) -> float:
+    if total == 0:
+        return 0.0
+    return covered / total
+
+
+def parse_lcov_coverage_data(
+    cov_data: CoverageInput, toc: Iterable[str]
+) -> types.CoverageData:
+    """
+    Single pass lcov reader.
+
+    Totals and rates are computed the same way lcov_cobertura does so the
+    result matches converting the report to cobertura first.
+    """
+    index = get_path_index(toc)
+    file_coverage: Dict[str, types.FileCoverageData] = {}
+    lines_valid = lines_covered = branches_valid = branches_covered = 0
+
+    filename = None
+    lines: Dict[int, int] = {}
+    file_lines_total = file_lines_covered = 0
+    file_branches_total = file_branches_covered = 0
+    for line in _iter_lines(cov_data):
+        if line.strip() == "end_of_record":
+            if filename is None:
+                continue
+            lines_valid += file_lines_total
+            lines_covered += file_lines_covered
+            branches_valid += file_branches_total
+            branches_covered += file_branches_covered
+            resolved = index.resolve(filename, ".")
+            if resolved is not None:
+                file_coverage[resolved] = types.FileCoverageData(
+                    line_rate=_rate(file_lines_total, file_lines_covered),
+                    branch_rate=_rate(file_branches_total, file_branches_covered),
+                    complexity=0.0,
+                    lines=dict(sorted(lines.items())),
                 )
+            continue
+
+        record, _, value = line.partition(":")
+        if record == "SF":
+            filename = os.path.relpath(value.strip())
+            lines = {}
+            file_lines_total = file_lines_covered = 0
+            file_branches_total = file_branches_covered = 0
+        elif record == "DA":
+            line_no, hits = value.strip().split(",")[:2]
+            lines[int(line_no)] = int(hits)
+            if int(hits) > 0:
+                file_lines_covered += 1
+            file_lines_total += 1
+        elif record == "BRDA":
+            line_no, _, _, branch_hits = value.strip().split(",")
+            lines.setdefault(int(line_no), 0)
+            file_branches_total += 1
+            if branch_hits != "-" and int(branch_hits) > 0:
+                file_branches_covered += 1
+        elif record == "BRF":
+            file_branches_total = int(value)
+        elif record == "BRH":
+            file_branches_covered = int(value)
 
     return types.CoverageData(
-        version=dom.attrib["version"],
-        timestamp=int(dom.attrib["timestamp"]),
-        lines_covered=int(dom.attrib["lines-covered"]),
-        lines_valid=int(dom.attrib["lines-valid"]),
-        line_rate=float(dom.attrib["line-rate"]),
-        branches_covered=int(dom.attrib["branches-covered"]),
-        branches_valid=int(dom.attrib["branches-valid"]),
-        branch_rate=float(dom.attrib["branch-rate"]),
-        complexity=int(dom.attrib["complexity"]),
+        version="2.0.3",
+        timestamp=int(time.time()),
+        lines_covered=lines_covered,
+        lines_valid=lines_valid,
+        line_rate=_rate(lines_valid, lines_covered),
+        branches_covered=branches_covered,
+        branches_valid=branches_valid,
+        branch_rate=_rate(branches_valid, branches_covered),
+        complexity=0,
         file_coverage=file_coverage,
     )
 
 
-def parse_lcov_coverage_data(cov_data: str, toc: List[str]) -> types.CoverageData:
-    converter = LcovCobertura(cov_data)
-    cobertura_xml = converter.convert()
-    return parse_xml_coverage_data(cobertura_xml, toc)
+def merge_coverage_data(coverages: List[types.CoverageData]) -> types.CoverageData:
+    """
+    Merge reports from sharded test runs into one report.
 
+    Totals are summed from the report headers, as for a single report, so
+    files that are not in the toc still count. Hits of files found in more
+    than one report are summed per line and their line counts replace the
+    ones each report contributed. Reports carry no per file branch counts
+    so branch totals and complexity are summed as if files were disjoint.
+    """
+    if len(coverages) == 1:
+        return coverages[0]
 
-def parse_raw_coverage_data(data: bytes) -> types.CoverageData:
-    text = data.decode("utf-8")
-    toc_raw, _, files_data = text.partition("<<<<<< network")
-    toc = [li for li in toc_raw.splitlines() if li]
+    lines_valid = lines_covered = branches_valid = branches_covered = 0
+    complexity = 0.0
+    file_coverage: Dict[str, types.FileCoverageData] = {}
+    merged_files = set()
+    for coverage in coverages:
+        lines_valid += coverage["lines_valid"]
+        lines_covered += coverage["lines_covered"]
+        branches_valid += coverage["branches_valid"]
+        branches_covered += coverage["branches_covered"]
+        complexity += coverage["complexity"]
+        for filename, fcov in coverage["file_coverage"].items():
+            if filename not in file_coverage:
+                file_coverage[filename] = types.FileCoverageData(
+                    line_rate=fcov["line_rate"],
+                    branch_rate=fcov["branch_rate"],
+                    complexity=fcov["complexity"],
+                    lines=dict(fcov["lines"]),
+                )
+                continue
+            if filename not in merged_files:
+                merged = file_coverage[filename]
+                lines_valid -= len(merged["lines"])
+                lines_covered -= len([h for h in merged["lines"].values() if h])
+                merged_files.add(filename)
+            lines_valid -= len(fcov["lines"])
+            lines_covered -= len([h for h in fcov["lines"].values() if h])
+            merged = file_coverage[filename]
+            merged["branch_rate"] = max(merged["branch_rate"], fcov["branch_rate"])
+            merged["complexity"] = max(merged["complexity"], fcov["complexity"])
+            for line_no, hits in fcov["lines"].items():
+                merged["lines"][line_no] = merged["lines"].get(line_no, 0) + hits
 
-    coverage_files = parse_files(files_data)
+    for filename in merged_files:
+        merged = file_coverage[filename]
+        merged["lines"] = dict(sorted(merged["lines"].items()))
+        file_lines_covered = len([h for h in merged["lines"].values() if h])
+        merged["line_rate"] = _rate(len(merged["lines"]), file_lines_covered)
+        lines_valid += len(merged["lines"])
+        lines_covered += file_lines_covered
 
-    for filename, cov_data in coverage_files.items():
-        if filename.endswith(".xml"):
-            return parse_xml_coverage_data(cov_data, toc)
-        elif filename.endswith(".lcov"):
-            return parse_lcov_coverage_data(cov_data, toc)
+    latest = max(coverages, key=lambda c: c["timestamp"])
+    return types.CoverageData(
+        version=latest["version"],
+        timestamp=latest["timestamp"],
+        lines_covered=lines_covered,
+        lines_valid=lines_valid,
+        line_rate=_rate(lines_valid, lines_covered),
+        branches_covered=branches_covered,
+        branches_valid=branches_valid,
+        branch_rate=_rate(branches_valid, branches_covered),
+        complexity=complexity,
+        file_coverage=file_coverage,
+    )
+
+
+def parse_coverage_file(
+    filename: str, cov_data: CoverageInput, toc: Iterable[str]
+) -> types.CoverageData:
+    if filename.endswith(".xml"):
+        return parse_xml_coverage_data(cov_data, toc)
     else:
+        return parse_lcov_coverage_data(cov_data, toc)
+
+
+def parse_raw_coverage_data(
+    data: bytes, executor: Optional[Executor] = None
+) -> types.CoverageData:
+    """
+    Parse every coverage file in an upload and merge them into one report.
+
+    When an executor is provided and there are multiple coverage files,
+    files are parsed in parallel with it.
+    """
+    toc_raw, files_start = scan_envelope(data)
+    toc = PathIndex(toc_raw)
+
+    coverage_files = [
+        (filename, cov_data)
+        for filename, cov_data in iter_files(data, files_start)
+        if filename.endswith((".xml", ".lcov"))
+    ]
+    if len(coverage_files) == 0:
         raise ParsingException("Could not find coverage file")
 
+    if executor is not None and len(coverage_files) > 1:
+        coverages = []
+        pending: Deque[Future] = deque()
+        for filename, cov_data in coverage_files:
+            if len(pending) >= PARALLEL_PARSE_WINDOW:
+                coverages.append(pending.popleft().result())
+            # memoryviews can not be pickled, only the files being parsed are
+            # copied instead of the whole upload
+            pending.append(
+                executor.submit(parse_coverage_file, filename, cov_data.tobytes(), toc)
+            )
+        coverages.extend(future.result() for future in pending)
+    else:
+        coverages = [
+            parse_coverage_file(filename, cov_data, toc)
+            for filename, cov_data in coverage_files
+        ]
+    return merge_coverage_data(coverages)
+
 
 def parse_diff(data: str) -> List[types.DiffCoverage]:
     patch_set = PatchSet(StringIO(data))
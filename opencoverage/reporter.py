@@ -1,3 +1,6 @@
+import asyncio
+import contextvars
+import logging
 import os
 from io import StringIO
 from typing import List, Optional, Tuple
@@ -8,10 +11,29 @@ from opencoverage.models import ROOT_PROJECT
 from opencoverage.settings import Settings
 
 from . import types
+from .cache import LRUCache
 from .clients import SCMClient
 from .database import Database
-from .parser import parse_diff, parse_raw_coverage_data
-from .utils import run_async
+from .parser import parse_raw_coverage_data
+from .utils import get_process_pool, run_async
+
+logger = logging.getLogger(__name__)
+
+# cov.yaml of a commit, or None when it has none. The file can not change for
+# a commit, the ttl only frees memory of commits no longer uploaded to.
+_configuration_cache: Optional[LRUCache[Optional[types.CoverageConfiguration]]] = None
+_MISSING = object()
+
+
+def _get_configuration_cache(
+    settings: Settings,
+) -> LRUCache[Optional[types.CoverageConfiguration]]:
+    global _configuration_cache
+    if _configuration_cache is None:
+        _configuration_cache = LRUCache(
+            settings.configuration_cache_size, ttl=settings.configuration_cache_ttl
+        )
+    return _configuration_cache
 
 
 class CoverageReporter:
@@ -41,7 +63,9 @@ class CoverageReporter:
         *,
         coverage_data: bytes,
     ) -> None:
-        coverage = await run_async(parse_raw_coverage_data, coverage_data)
+        coverage = await run_async(
+            parse_raw_coverage_data, coverage_data, executor=get_process_pool()
+        )
 
         config = await self.get_coverage_configuration()
         project_config = None
@@ -72,10 +96,45 @@ class CoverageReporter:
         )
 
         pulls = await self.scm.get_pulls(self.organization, self.repo, self.commit)
-        for pull in pulls:
-            if self.branch == pull.base:
-                continue
-            await self.update_pull(pull, coverage, config, project_config)
+        await self.update_pulls(
+            [pull for pull in pulls if self.branch != pull.base],
+            coverage,
+            config,
+            project_config,
+        )
+
+    async def update_pulls(
+        self,
+        pulls: List[types.Pull],
+        coverage: types.CoverageData,
+        config: Optional[types.CoverageConfiguration],
+        project_config: Optional[types.CoverageConfigurationProject],
+    ) -> None:
+        """
+        Update pulls concurrently. A pull that fails does not stop the
+        others, the first error is raised once all are done.
+        """
+        semaphore = asyncio.Semaphore(max(self.settings.pull_concurrency, 1))
+
+        async def update(pull: types.Pull) -> None:
+            async with semaphore:
+                await self.update_pull(pull, coverage, config, project_config)
+
+        # started from an empty context so each uses its own database connection
+        results = await asyncio.gather(
+            *[
+                contextvars.Context().run(asyncio.create_task, update(pull))
+                for pull in pulls
+            ],
+            return_exceptions=True,
+        )
+        errors = []
+        for pull, result in zip(pulls, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error updating pull {pull.id}", exc_info=result)
+                errors.append(result)
+        if len(errors) > 0:
+            raise errors[0]
 
     def hits_target_diff_coverage(
         self,
@@ -120,15 +179,33 @@ class CoverageReporter:
         return True
 
     async def get_coverage_configuration(self) -> Optional[types.CoverageConfiguration]:
+        """
+        cov.yaml of the commit, cached so uploads of other shards and projects
+        of the commit do not download it again.
+        """
+        cache = _get_configuration_cache(self.settings)
+        key = (self.organization, self.repo, self.commit)
+        config = cache.get(key, _MISSING)
+        if config is _MISSING:
+            config = await self._download_coverage_configuration()
+            cache.set(key, config)
+        if config is None:
+            return None
+        # callers may modify it
+        return config.copy(deep=True)
+
+    async def _download_coverage_configuration(
+        self,
+    ) -> Optional[types.CoverageConfiguration]:
         if await self.scm.file_exists(
             self.organization, self.repo, self.commit, "cov.yaml"
         ):
-            data = b""
+            chunks = []
             async for chunk in self.scm.download_file(
                 self.organization, self.repo, self.commit, "cov.yaml"
             ):
-                data += chunk
-            text = data.decode("utf-8")
+                chunks.append(chunk)
+            text = b"".join(chunks).decode("utf-8")
             data = yaml.safe_load(StringIO(text))
             return types.CoverageConfiguration.parse_obj(data)
         return None
@@ -190,17 +267,17 @@ Overall coverage: *{(100 * coverage["line_rate"]):.1f}%*
                 # if it isn't in the file coverage report, we don't care about it
                 continue
 
-            file_total = 0
-            file_covered = 0
-            ddata["hits"] = ddata["misses"] = 0
-            for line_no, hits in lines.items():
-                if line_no in ddata["lines"]:
-                    file_total += 1
-                    if hits:
-                        file_covered += 1
-                        ddata["hits"] += 1
-                    else:
-                        ddata["misses"] += 1
+            # covered lines touched by the diff, looking up the smaller side in
+            # the larger so large diffs of large files stay linear
+            diff_lines = set(ddata["lines"])
+            if len(diff_lines) < len(lines):
+                touched = [line_no for line_no in diff_lines if line_no in lines]
+            else:
+                touched = [line_no for line_no in lines if line_no in diff_lines]
+            file_total = len(touched)
+            file_covered = sum(1 for line_no in touched if lines[line_no])
+            ddata["hits"] = file_covered
+            ddata["misses"] = file_total - file_covered
 
             if file_total > 0:
                 ddata["line_rate"] = file_covered / file_total
@@ -221,9 +298,13 @@ Overall coverage: *{(100 * coverage["line_rate"]):.1f}%*
         config: Optional[types.CoverageConfiguration],
         project_config: Optional[types.CoverageConfigurationProject],
     ):
-        diff = await self.scm.get_pull_diff(self.organization, self.repo, pull.id)
-        diff_data = await run_async(parse_diff, diff)
-        diff_data, diff_line_rate = self.get_line_rate(diff_data, coverage)
+        diff_data = await self.scm.get_pull_diff_coverage(
+            self.organization, self.repo, pull
+        )
+        # large diffs take a while, don't block other requests and tasks
+        diff_data, diff_line_rate = await run_async(
+            self.get_line_rate, diff_data, coverage
+        )
 
         check_id = await self.scm.create_check(
             self.organization, self.repo, self.commit, details_url=self.get_diff_url(pull)
@@ -1,3 +1,5 @@
+import os
+import tempfile
 from typing import List, Optional
 
 from pydantic import BaseSettings
@@ -16,7 +18,48 @@ class Settings(BaseSettings):
 
     cors: List[str] = []
 
+    # uploads larger than this are spooled to disk while being received
+    upload_spool_size: int = 1024 * 1024
+    # where raw uploads are kept until processed: enum(filesystem, postgres)
+    storage: str = "filesystem"
+    storage_path: str = os.path.join(tempfile.gettempdir(), "opencoverage")
+    # seconds between removing blobs no task references anymore
+    storage_gc_interval: int = 300
+    # seconds a new blob is kept before it can be collected
+    storage_gc_grace_period: int = 600
+    # seconds payloads of failed tasks are kept for debugging
+    storage_error_retention: int = 7 * 24 * 60 * 60
+
+    # run tasks in the API server, disable when running `opencoverage-worker`
+    consume_tasks: bool = True
+    # number of tasks run concurrently by each task runner
+    task_concurrency: int = 4
+    # seconds a task may run before it is aborted and marked in error
+    task_timeout: int = 10 * 60
+    # times a task is claimed before it is marked in error, tasks are claimed
+    # again when their runner went away
+    task_max_attempts: int = 3
+    # pull requests of a commit updated concurrently by a coverage report task
+    pull_concurrency: int = 4
+    # cov.yaml of commits cached in memory by each task runner, 0 disables it
+    configuration_cache_size: int = 1024
+    # seconds a cached cov.yaml is kept, it can not change for a commit
+    configuration_cache_ttl: int = 60 * 60
+
+    # badge rates, by repository, branch and project, cached in memory by each
+    # API server
+    badge_cache_size: int = 1024
+    # seconds a cached badge rate is used when report notifications are missed
+    badge_cache_ttl: int = 5 * 60
+    # seconds clients may use a badge before checking it again with its ETag
+    badge_max_age: int = 60
+
     scm: str
     github_app_id: Optional[str]
     github_app_pem_file: Optional[str]
     github_default_installation_id: Optional[str]
+    # bytes of GitHub responses cached in memory by each process to revalidate
+    # them with their ETag
+    github_response_cache_size: int = 64 * 1024 * 1024
+    # parsed pull request diffs cached in memory by each process
+    github_diff_cache_size: int = 256
@@ -0,0 +1,177 @@
+import abc
+import hashlib
+import os
+import tempfile
+from datetime import datetime, timezone
+from typing import IO, List, Set
+
+from .database import Database
+from .settings import Settings
+from .utils import run_async
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobNotFoundException(Exception):
+    ...
+
+
+class BlobStorage(abc.ABC):
+    """
+    Content addressed storage for raw upload payloads.
+
+    Blobs are keyed by the sha256 of their content so identical uploads are
+    only stored once. Blobs are not removed when a task finishes since other
+    tasks may reference the same content; `collect_garbage` removes blobs
+    that are no longer referenced.
+    """
+
+    @abc.abstractmethod
+    async def put(self, fileobj: IO[bytes]) -> str:  # pragma: no cover
+        ...
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> bytes:  # pragma: no cover
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None:  # pragma: no cover
+        ...
+
+    @abc.abstractmethod
+    async def keys(self, older_than: datetime) -> List[str]:  # pragma: no cover
+        ...
+
+    async def collect_garbage(self, referenced: Set[str], older_than: datetime) -> int:
+        """
+        Remove blobs created before older_than that are not referenced.
+        """
+        removed = 0
+        for key in await self.keys(older_than):
+            if key not in referenced:
+                await self.delete(key)
+                removed += 1
+        return removed
+
+
+class FileStorage(BlobStorage):
+    def __init__(self, path: str):
+        self.path = path
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.path, key)
+
+    def _write(self, fileobj: IO[bytes]) -> str:
+        os.makedirs(self.path, exist_ok=True)
+        sha = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fi:
+                while chunk := fileobj.read(CHUNK_SIZE):
+                    sha.update(chunk)
+                    fi.write(chunk)
+            key = sha.hexdigest()
+            path = self._get_path(key)
+            if os.path.exists(path):
+                # already stored, refresh so it is not garbage collected
+                os.utime(path)
+                os.remove(tmp_path)
+            else:
+                os.rename(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return key
+
+    def _read(self, key: str) -> bytes:
+        try:
+            with open(self._get_path(key), "rb") as fi:
+                return fi.read()
+        except FileNotFoundError:
+            raise BlobNotFoundException(key)
+
+    def _delete(self, key: str) -> None:
+        try:
+            os.remove(self._get_path(key))
+        except FileNotFoundError:
+            ...
+
+    def _keys(self, older_than: datetime) -> List[str]:
+        if not os.path.exists(self.path):
+            return []
+        keys = []
+        # dates are naive utc everywhere else
+        timestamp = older_than.replace(tzinfo=timezone.utc).timestamp()
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < timestamp:
+                    keys.append(entry.name)
+        return keys
+
+    async def put(self, fileobj: IO[bytes]) -> str:
+        return await run_async(self._write, fileobj)
+
+    async def get(self, key: str) -> bytes:
+        return await run_async(self._read, key)
+
+    async def delete(self, key: str) -> None:
+        await run_async(self._delete, key)
+
+    async def keys(self, older_than: datetime) -> List[str]:
+        return await run_async(self._keys, older_than)
+
+
+class PostgresStorage(BlobStorage):
+    """
+    Store blobs as PostgreSQL large objects so they live outside of the
+    tasks table and are shared by every worker.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def put(self, fileobj: IO[bytes]) -> str:
+        sha = hashlib.sha256()
+        async with self.db.db.transaction():
+            oid = await self.db.db.fetch_val("SELECT lo_create(0)")
+            offset = 0
+            while chunk := await run_async(fileobj.read, CHUNK_SIZE):
+                sha.update(chunk)
+                await self.db.db.execute(
+                    "SELECT lo_put(:oid, :offset, :data)",
+                    {"oid": oid, "offset": offset, "data": chunk},
+                )
+                offset += len(chunk)
+            key = sha.hexdigest()
+            if not await self.db.add_blob(key=key, oid=oid, size=offset):
+                await self.db.db.execute("SELECT lo_unlink(:oid)", {"oid": oid})
+        return key
+
+    async def get(self, key: str) -> bytes:
+        blob = await self.db.get_blob(key)
+        if blob is None:
+            raise BlobNotFoundException(key)
+        return await self.db.db.fetch_val("SELECT lo_get(:oid)", {"oid": blob.oid})
+
+    async def delete(self, key: str) -> None:
+        async with self.db.db.transaction():
+            blob = await self.db.get_blob(key)
+            if blob is not None:
+                await self.db.db.execute("SELECT lo_unlink(:oid)", {"oid": blob.oid})
+                await self.db.remove_blob(blob)
+
+    async def keys(self, older_than: datetime) -> List[str]:
+        return await self.db.get_blob_keys(older_than)
+
+
+def get_storage(settings: Settings, db: Database) -> BlobStorage:
+    if settings.storage == "filesystem":
+        return FileStorage(settings.storage_path)
+    elif settings.storage == "postgres":
+        return PostgresStorage(db)
+    else:
+        raise TypeError(
+            "Must provide valid storage value, allowed: [filesystem, postgres], "
+            f"provided: {settings.storage}"
+        )
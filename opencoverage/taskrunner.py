@@ -1,10 +1,14 @@
 import asyncio
+import contextvars
 import logging
 import pickle
+import time
 import traceback
+from datetime import datetime, timedelta
 from typing import (
     Any,
     Dict,
+    List,
     Optional,
     Tuple,
     Type,
@@ -12,10 +16,11 @@ from typing import (
 
 import pydantic
 
-from opencoverage.database import Database
+from opencoverage.database import TASKS_CHANNEL, Database
 
 from .models import Task
 from .settings import Settings
+from .storage import get_storage
 
 logger = logging.getLogger(__name__)
 _registered: Dict[str, Tuple[Any, Type[pydantic.BaseModel]]] = {}
@@ -35,14 +40,23 @@ class TaskRunner:
     to be able to run jobs based on that task data
     """
 
+    # polling interval used when no listener connection is available
     check_interval = 0.5
-    consume_task: Optional[asyncio.Task]
+    # safety net polling while listening for task notifications
+    listen_check_interval = 10.0
+    # minimum seconds between attempts to reconnect the listener
+    listen_retry_interval = 10.0
+    consume_tasks: List[asyncio.Task]
 
     def __init__(self, settings: Settings, db: Database):
         self.settings = settings
         self.db = db
-        self.consume_task = None
+        self.consume_tasks = []
         self._consuming_tasks = False
+        self._last_gc = time.monotonic()
+        self._listener: Optional[Any] = None
+        self._last_listen_attempt = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
 
     async def add(self, *, name: str, config: pydantic.BaseModel) -> None:
         if name not in _registered:
@@ -50,28 +64,101 @@ class TaskRunner:
         _, config_type = _registered[name]
         if not isinstance(config, config_type):
             raise InvalidTaskException(f"Invalid task config: {name}: {config}")
-        await self.db.add_task(name=name, data=pickle.dumps(config), status="scheduled")
+        await self.db.add_task(
+            name=name,
+            data=pickle.dumps(config),
+            status="scheduled",
+            data_key=getattr(config, "data_key", None),
+        )
 
     async def start_consuming(self) -> None:
         self._consuming_tasks = True
-        self.consume_task = asyncio.create_task(self.run_tasks())
+        self._wakeup = asyncio.Event()
+        await self.listen()
+        # each worker only claims a task once it is done with the previous one.
+        # Workers start from an empty context, the database connection is kept
+        # in a context var and sharing it between workers breaks transactions.
+        self.consume_tasks = [
+            contextvars.Context().run(asyncio.create_task, self.run_tasks())
+            for _ in range(max(self.settings.task_concurrency, 1))
+        ]
 
     async def stop_consuming(self) -> None:
         self._consuming_tasks = False
+        if self._wakeup is not None:
+            self._wakeup.set()
         # give it some time to finish
-        if self.consume_task is not None:
-            await asyncio.wait([self.consume_task], timeout=5)
-            if not self.consume_task.done():  # pragma: no cover
-                self.consume_task.cancel()
+        if len(self.consume_tasks) > 0:
+            _, pending = await asyncio.wait(self.consume_tasks, timeout=5)
+            if len(pending) > 0:  # pragma: no cover
+                for task in pending:
+                    task.cancel()
                 # wait more for cleanup
-                await asyncio.wait([self.consume_task], timeout=1)
-        self.consume_task = None
+                await asyncio.wait(pending, timeout=1)
+        self.consume_tasks = []
+        await self.unlisten()
+
+    async def listen(self) -> None:
+        """
+        Wake up the runner as soon as a task is added instead of waiting
+        for the next poll. Polling is used when this is not possible.
+        """
+        self._last_listen_attempt = time.monotonic()
+        try:
+            self._listener = await self.db.listen(TASKS_CHANNEL, self.notify)
+        except Exception:
+            logger.warning("Could not listen for tasks, polling instead", exc_info=True)
+            self._listener = None
+
+    async def unlisten(self) -> None:
+        if self._listener is None:
+            return
+        try:
+            await self._listener.close()
+        except Exception:  # pragma: no cover
+            logger.warning("Error closing task listener", exc_info=True)
+        self._listener = None
+
+    def notify(self, payload: str = "") -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    @property
+    def listening(self) -> bool:
+        return self._listener is not None and not self._listener.is_closed()
+
+    async def wait_for_tasks(self) -> None:
+        if not self.listening and (
+            time.monotonic() - self._last_listen_attempt > self.listen_retry_interval
+        ):
+            await self.unlisten()
+            await self.listen()
+        timeout = self.listen_check_interval if self.listening else self.check_interval
+        if self._wakeup is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
 
     async def run_tasks(self) -> None:
         while self._consuming_tasks:
             try:
-                await self._run_tasks()
-                await asyncio.sleep(self.check_interval)
+                # clear before checking so notifications sent meanwhile are not lost
+                if self._wakeup is not None:
+                    self._wakeup.clear()
+                ran = await self._run_tasks()
+                if time.monotonic() - self._last_gc > self.settings.storage_gc_interval:
+                    try:
+                        await self.collect_garbage()
+                    except Exception:
+                        logger.exception("Error collecting garbage")
+                if ran:
+                    # there may be more tasks queued, check again right away
+                    await asyncio.sleep(0)
+                else:
+                    await self.wait_for_tasks()
             except (RuntimeError, asyncio.CancelledError):  # pragma: no cover
                 return
             except Exception:
@@ -80,17 +167,41 @@ class TaskRunner:
                 )
                 await asyncio.sleep(1)
 
-    async def _run_tasks(self) -> None:
+    async def collect_garbage(self) -> None:
+        """
+        Remove stored payloads that are not referenced by any task anymore
+        """
+        self._last_gc = time.monotonic()
+        storage = get_storage(self.settings, self.db)
+        now = datetime.utcnow()
+        referenced = await self.db.get_referenced_blobs(
+            now - timedelta(seconds=self.settings.storage_error_retention)
+        )
+        removed = await storage.collect_garbage(
+            referenced, now - timedelta(seconds=self.settings.storage_gc_grace_period)
+        )
+        if removed > 0:
+            logger.info(f"Removed {removed} unreferenced blobs")
+
+    async def _run_tasks(self) -> bool:
+        """
+        Run the next scheduled task, returning if there was one
+        """
         error = False
         task = None
         try:
-            async with self.db.db.transaction():
-                task = await self.db.get_task()
-                if task is None:
-                    return
-                logger.info(f"Running task: {task.name}: {task.id}")
-                await self.run_task(task)
-                await self.db.remove_task(task)
+            # tasks running longer than allowed must be from a runner that died
+            task = await self.db.claim_task(
+                datetime.utcnow() - timedelta(seconds=self.settings.task_timeout * 2),
+                self.settings.task_max_attempts,
+            )
+            if task is None:
+                return False
+            logger.info(f"Running task: {task.name}: {task.id}")
+            await asyncio.wait_for(
+                self.run_task(task), timeout=self.settings.task_timeout
+            )
+            await self.db.remove_task(task)
         except Exception:
             error = True
             logger.exception("Error running task")
@@ -103,6 +214,7 @@ class TaskRunner:
             task.info = traceback.format_exc()
             # remove old bad data that caused the error?
             await self.db.update_task(task)
+        return task is not None
 
     async def run_task(self, task: Task) -> None:
         func, _ = _registered[task.name]
@@ -5,6 +5,7 @@ import pydantic
 from . import taskrunner
 from .clients.scm import get_client
 from .reporter import CoverageReporter
+from .storage import get_storage
 
 
 class CoverageTaskConfig(pydantic.BaseModel):
@@ -13,7 +14,9 @@ class CoverageTaskConfig(pydantic.BaseModel):
     branch: str
     commit: str
     installation_id: Optional[str]
-    data: bytes
+    # raw upload, either inline or a reference to the upload in storage
+    data: Optional[bytes] = None
+    data_key: Optional[str] = None
     flags: Optional[str] = None
     project: Optional[str] = None
 
@@ -21,6 +24,12 @@ class CoverageTaskConfig(pydantic.BaseModel):
 async def run_coverage_report(
     runner: taskrunner.TaskRunner, config: CoverageTaskConfig
 ) -> None:
+    if config.data_key is not None:
+        storage = get_storage(runner.settings, runner.db)
+        data = await storage.get(config.data_key)
+    else:
+        data = config.data or b""
+
     async with get_client(runner.settings, config.installation_id) as scm:
         reporter = CoverageReporter(
             settings=runner.settings,
@@ -32,7 +41,7 @@ async def run_coverage_report(
             commit=config.commit,
             project=config.project,
         )
-        await reporter(coverage_data=config.data)
+        await reporter(coverage_data=data)
 
 
 taskrunner.register("coveragereport", run_coverage_report, CoverageTaskConfig)
@@ -42,6 +42,8 @@ class Pull(pydantic.BaseModel):
     id: int
     base: str
     head: str
+    # commit the head branch points to, when known
+    head_sha: Optional[str] = None
 
 
 class PRReportResult(TypedDict):
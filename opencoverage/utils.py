@@ -1,6 +1,8 @@
 import asyncio
 import contextvars
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
+from typing import Optional
 
 
 async def run_async(func, *args, **kwargs):
@@ -10,3 +12,20 @@ async def run_async(func, *args, **kwargs):
     func = context.run
     args = (child,)
     return await loop.run_in_executor(None, func, *args)
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor()
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False)
+        _process_pool = None
@@ -1,4 +1,12 @@
-from typing import Dict, List, Optional
+from typing import (
+    IO,
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
 
 
 class XMLSyntaxError(Exception):
@@ -7,6 +15,7 @@ class XMLSyntaxError(Exception):
 
 class Element:
     text: str
+    tag: str
     attrib: Dict[str, str]
 
     def find(self, key: str) -> Optional["Element"]:
@@ -15,6 +24,39 @@ class Element:
     def findall(self, key: str) -> List["Element"]:
         ...
 
+    def iterfind(self, key: str) -> Iterator["Element"]:
+        ...
+
+    def clear(self) -> None:
+        ...
+
+    def getparent(self) -> Optional["Element"]:
+        ...
+
+    def getprevious(self) -> Optional["Element"]:
+        ...
+
+    def getroottree(self) -> "ElementTree":
+        ...
+
+    def __delitem__(self, index: int) -> None:
+        ...
+
+
+class ElementTree:
+    def getroot(self) -> Element:
+        ...
+
+
+class iterparse:
+    root: Element
+
+    def __init__(self, source: IO[bytes], **kwargs: Any):
+        ...
+
+    def __iter__(self) -> Iterator[Tuple[str, Element]]:
+        ...
+
 
 def fromstring(text) -> Element:
     ...
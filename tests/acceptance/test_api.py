@@ -1,3 +1,4 @@
+import asyncio
 from unittest.mock import patch
 
 import pytest
@@ -103,6 +104,40 @@ index 8ad9304b..de0e1d25 100644
     assert len(resp.json()["result"]) == 1
 
 
+async def test_upload_against_many_prs(http_client, scm, tasks):
+    # e.g. stacked pull requests, updated concurrently
+    scm.get_pulls.return_value = [
+        types.Pull(head="test-changes", base=f"base{idx}", id=str(idx))
+        for idx in range(1, 4)
+    ]
+    scm.get_pull_diff.return_value = """diff --git a/guillotina/addons.py b/guillotina/addons.py
+index 8ad9304b..de0e1d25 100644
+--- a/guillotina/addons.py
++++ b/guillotina/addons.py
+@@ -69,1 +69,2 @@ async def install(container, addon):
+     registry = task_vars.registry.get()
++    registry
+"""
+    scm.create_check.return_value = "check"
+    scm.create_comment.return_value = "comment"
+
+    resp = await http_client.put(
+        "/upload-report",
+        query_string={
+            "slug": "vangheem/guillotina",
+            "branch": "test-changes",
+            "commit": "59cc8f62c5e0d13a685bb3d388e8cb10669aebec",
+        },
+        data=read_data("guillotina.pr"),
+    )
+    assert resp.status_code == 200
+    await tasks.wait()
+
+    resp = await http_client.get("/recent-pr-reports")
+    assert sorted(r["pull"] for r in resp.json()["result"]) == [1, 2, 3]
+    assert scm.create_comment.call_count == 3
+
+
 async def test_get_pr_report_404(http_client):
     resp = await http_client.get("/vangheem/repos/guillotina/pulls/1/123/report")
     assert resp.status_code == 404
@@ -196,6 +231,51 @@ async def test_get_badge(http_client, app, settings, db, scm):
     assert "<svg" in resp.content.decode()
 
 
+async def test_get_badge_cached_until_saved(http_client, app, db):
+    coverage = {
+        "lines_valid": 2,
+        "lines_covered": 1,
+        "line_rate": 0.5,
+        "branches_valid": 0,
+        "branches_covered": 0,
+        "branch_rate": 0,
+        "complexity": 0,
+        "file_coverage": {},
+    }
+    await db.save_coverage(
+        organization="plone",
+        repo="guillotina",
+        branch="master",
+        commit_hash="123",
+        coverage=coverage,
+    )
+    resp = await http_client.get("/plone/repos/guillotina/badge.svg")
+    assert "50%" in resp.content.decode()
+    etag = resp.headers["etag"]
+    resp = await http_client.get(
+        "/plone/repos/guillotina/badge.svg", headers={"If-None-Match": etag}
+    )
+    assert resp.status_code == 304
+
+    await db.save_coverage(
+        organization="plone",
+        repo="guillotina",
+        branch="master",
+        commit_hash="1234",
+        coverage={**coverage, "line_rate": 0.75},
+    )
+    for _ in range(50):
+        # invalidated by the notification of the saved report
+        if app.badge_generations.get(("plone", "guillotina")) == 2:
+            break
+        await asyncio.sleep(0.02)
+    resp = await http_client.get(
+        "/plone/repos/guillotina/badge.svg", headers={"If-None-Match": etag}
+    )
+    assert resp.status_code == 200
+    assert "75%" in resp.content.decode()
+
+
 async def test_download_file(http_client, db, scm):
     await db.update_organization("plone", "123")
     scm.file_exists.return_value = True
@@ -230,3 +310,9 @@ async def test_download_file_not_found(http_client, db, scm):
     )
     assert resp.status_code == 404
     assert resp.json()["reason"] == "fileNotFound"
+
+
+async def test_get_reports_invalid_cursor(http_client, app):
+    resp = await http_client.get("/plone/repos/guillotina/reports?cursor=invalid")
+    assert resp.status_code == 400
+    assert resp.json() == {"reason": "invalidCursor"}
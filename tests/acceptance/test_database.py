@@ -0,0 +1,381 @@
+import asyncio
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from opencoverage import models, types
+from opencoverage.encoding import encode_lines
+from opencoverage.models import (
+    Branch,
+    Commit,
+    CoverageRecord,
+    PullRequest,
+    Repo,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+def _coverage(**files):
+    return {
+        "lines_valid": 0,
+        "lines_covered": 0,
+        "line_rate": 0,
+        "branches_valid": 0,
+        "branches_covered": 0,
+        "branch_rate": 0,
+        "complexity": 0,
+        "file_coverage": {
+            filename: {
+                "line_rate": 1.0,
+                "branch_rate": 0,
+                "complexity": 0,
+                "lines": lines,
+            }
+            for filename, lines in files.items()
+        },
+    }
+
+
+@pytest.fixture()
+async def database(db):
+    await db.initialize()
+    yield db
+    await db.finalize()
+
+
+async def _save(db, coverage, commit="commit"):
+    await db.save_coverage(
+        organization="organization",
+        repo="repo",
+        branch="branch",
+        commit_hash=commit,
+        coverage=coverage,
+    )
+
+
+async def _records(db):
+    return {
+        record.filename: record
+        for record in await db.db.query(CoverageRecord)
+        .filter(CoverageRecord.commit_hash == "commit")
+        .all()
+    }
+
+
+async def _lines(db, filename, commit="commit"):
+    record = await db.get_report_file("organization", "repo", commit, filename)
+    return record.lines
+
+
+async def test_save_coverage_only_writes_changes(database):
+    await _save(database, _coverage(**{"foo.py": {1: 1}, "bar.py": {1: 1}}))
+    before = await _records(database)
+
+    await _save(database, _coverage(**{"foo.py": {1: 1}, "baz.py": {1: 0}}))
+    after = await _records(database)
+    assert sorted(after.keys()) == ["baz.py", "foo.py"]
+    assert after["foo.py"].modification_date == before["foo.py"].modification_date
+    assert await _lines(database, "baz.py") == {1: 0}
+
+    await _save(database, _coverage(**{"foo.py": {1: 0}, "baz.py": {1: 0}}))
+    changed = await _records(database)
+    assert await _lines(database, "foo.py") == {1: 0}
+    assert changed["foo.py"].modification_date > before["foo.py"].modification_date
+    assert changed["baz.py"].modification_date == after["baz.py"].modification_date
+
+
+async def test_save_coverage_stores_lines_once(database):
+    await _save(database, _coverage(**{"foo.py": {1: 1}, "bar.py": {1: 1}}))
+    await _save(database, _coverage(**{"foo.py": {1: 1}, "bar.py": {2: 1}}), "commit2")
+    assert await database.db.fetch_val("SELECT count(*) FROM coveragelines") == 2
+    assert await database.db.fetch_val("SELECT count(*) FROM coveragerecords") == 4
+    assert await _lines(database, "bar.py") == {1: 1}
+    assert await _lines(database, "bar.py", "commit2") == {2: 1}
+
+
+async def test_get_report_file_not_found(database):
+    assert (
+        await database.get_report_file("organization", "repo", "commit", "foo.py")
+    ) is None
+
+
+async def test_get_report_file_with_json_lines(database):
+    await _save(database, _coverage(**{"foo.py": {1: 1}}))
+    # records saved before line hits were stored in coveragelines
+    await database.db.execute(
+        "UPDATE coveragerecords SET lines = :lines, lines_hash = NULL",
+        {"lines": '{"1": 1}'},
+    )
+    assert await _lines(database, "foo.py") == {"1": 1}
+
+
+async def test_migrate_lines_data(database, pg_dsn):
+    await _save(database, _coverage(**{"foo.py": {1: 1}}))
+    await database.db.execute(
+        "ALTER TABLE coveragerecords ADD COLUMN lines_data BYTEA",
+    )
+    await database.db.execute("DELETE FROM coveragelines")
+    await database.db.execute(
+        "UPDATE coveragerecords SET lines_hash = NULL, lines_data = :data",
+        {"data": encode_lines({1: 2})},
+    )
+    models.init(pg_dsn)
+    assert await _lines(database, "foo.py") == {1: 2}
+    columns = sa.inspect(sa.create_engine(pg_dsn)).get_columns("coveragerecords")
+    assert "lines_data" not in [column["name"] for column in columns]
+
+
+async def test_ensure_obs(database):
+    obs = (
+        (Repo, dict(name="repo", organization="organization")),
+        (Branch, dict(name="branch", organization="organization", repo="repo")),
+        (
+            Commit,
+            dict(branch="branch", organization="organization", repo="repo", hash="a"),
+        ),
+    )
+    # concurrent uploads ensure the same parents
+    await asyncio.gather(*[database._ensure_obs(*obs) for _ in range(10)])
+    await database._ensure_obs(*obs)
+    for table in ("repos", "branches", "commits"):
+        assert await database.db.fetch_val(f"SELECT count(*) FROM {table}") == 1
+
+
+async def test_ensure_obs_updates_pull(database):
+    for base in ("branch", "other"):
+        await database._ensure_obs(
+            (Repo, dict(name="repo", organization="organization")),
+            (Branch, dict(name=base, organization="organization", repo="repo")),
+            (
+                PullRequest,
+                dict(
+                    organization="organization", repo="repo", id=1, base=base, head=base
+                ),
+            ),
+            update={PullRequest: ("base", "head")},
+        )
+    _, pulls = await database.get_pulls("organization", "repo")
+    assert [(p.base, p.head) for p in pulls] == [("other", "other")]
+
+
+async def _all_pages(func, **kwargs):
+    results = []
+    cursor = None
+    while True:
+        cursor, page = await func(limit=2, cursor=cursor, **kwargs)
+        results.extend(page)
+        if cursor is None:
+            return results
+
+
+async def test_paged_reports_with_same_modification_date(database):
+    for idx in range(5):
+        await _save(database, _coverage(), f"commit{idx}")
+    await database.db.execute(
+        "UPDATE coveragereports SET modification_date = :date",
+        {"date": datetime.utcnow()},
+    )
+    for kwargs in ({}, {"organization": "organization", "repo": "repo"}):
+        reports = await _all_pages(database.get_reports, **kwargs)
+        assert sorted(r.commit_hash for r in reports) == [f"commit{i}" for i in range(5)]
+        # newest first, ties broken by the rest of the key
+        assert [r.commit_hash for r in reports] == [
+            f"commit{i}" for i in range(4, -1, -1)
+        ]
+
+
+async def test_paged_pulls_newest_first(database):
+    for idx in range(5):
+        await database._ensure_obs(
+            (Repo, dict(name="repo", organization="organization")),
+            (Branch, dict(name="branch", organization="organization", repo="repo")),
+            (
+                PullRequest,
+                dict(
+                    organization="organization",
+                    repo="repo",
+                    id=idx,
+                    base="branch",
+                    head="branch",
+                ),
+            ),
+        )
+    pulls = await _all_pages(database.get_pulls, organization="organization", repo="repo")
+    assert [p.id for p in pulls] == [4, 3, 2, 1, 0]
+
+
+async def test_migrate_indexes(database, pg_dsn):
+    await database.db.execute(
+        "CREATE INDEX ix_coveragerecords_commit_hash ON coveragerecords (commit_hash)"
+    )
+    await database.db.execute("DROP INDEX ix_coveragerecords_commit")
+    models.init(pg_dsn)
+    indexes = sa.inspect(sa.create_engine(pg_dsn)).get_indexes("coveragerecords")
+    assert [index["name"] for index in indexes] == ["ix_coveragerecords_commit"]
+
+
+async def test_migrations_do_not_fail(database, pg_dsn, caplog):
+    models.init(pg_dsn)
+    assert [r.message for r in caplog.records if r.name == "opencoverage.models"] == []
+
+
+async def test_migration_failure_logged(database, pg_dsn, caplog):
+    with patch.object(models, "MIGRATIONS", ("ALTER TABLE missing ADD COLUMN foo INT",)):
+        models.init(pg_dsn)
+    assert caplog.records[-1].message.startswith("Could not run migration")
+
+
+async def _save_pr(db, organization="organization", commit="commit"):
+    await db.save_coverage(
+        organization=organization,
+        repo="repo",
+        branch="branch",
+        commit_hash=commit,
+        coverage=_coverage(),
+    )
+    await db.create_coverage_diff(
+        organization=organization,
+        repo="repo",
+        branch="branch",
+        commit_hash=commit,
+        project=None,
+        pull=types.Pull(id=1, base="main", head="branch"),
+        pull_diff=[],
+        check_id="check",
+        comment_id="comment",
+        line_rate=1.0,
+    )
+
+
+async def test_get_pr_reports_matches_report_key(database):
+    await _save_pr(database)
+    # the same commit hash in another organization, e.g. a fork
+    await _save_pr(database, organization="other")
+    _, reports = await database.get_pr_reports(
+        organization="organization", repo="repo", pull=1, commit="commit"
+    )
+    assert len(reports) == 1
+    assert reports[0]["coveragereports_organization"] == "organization"
+    _, reports = await database.get_pr_reports()
+    assert sorted(r["coveragereports_organization"] for r in reports) == [
+        "organization",
+        "other",
+    ]
+
+
+async def _explain(db, func, **kwargs):
+    statements = []
+
+    async def fetch_all(statement):
+        statements.append(statement)
+        return []
+
+    with patch.object(db.db, "fetch_all", fetch_all):
+        await func(**kwargs)
+    sql = statements[0].compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    # the test tables are too small for the planner to prefer indexes
+    await db.db.execute("SET enable_seqscan = off")
+    try:
+        return "\n".join(row[0] for row in await db.db.fetch_all(f"EXPLAIN {sql}"))
+    finally:
+        await db.db.execute("RESET enable_seqscan")
+
+
+def _scans(plan):
+    # scan node of each table in the plan
+    return {
+        line.split(" on ")[1].split()[0]: line.split("->")[-1].split(" using ")[0].strip()
+        for line in plan.splitlines()
+        if " on " in line
+    }
+
+
+async def test_get_recent_pr_reports_plan(database):
+    await _save_pr(database)
+    plan = await _explain(database, database.get_pr_reports)
+    assert "Index Scan Backward using ix_coveragereportpullrequests_recent" in plan
+    assert _scans(plan)["coveragereports"] == "Index Scan"
+    assert "Sort" not in plan
+    assert "Seq Scan" not in plan
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {},
+        {"branch": "branch"},
+        {"project": "project"},
+        {"branch": "branch", "project": "project"},
+    ],
+)
+async def test_get_reports_plan(database, filters):
+    await _save(database, _coverage(), "commit")
+    plan = await _explain(
+        database,
+        database.get_reports,
+        organization="organization",
+        repo="repo",
+        **filters,
+    )
+    # read in order from an index, ix_coveragereports_branch_recent also
+    # matches when both branch and project are given
+    assert _scans(plan)["coveragereports"].startswith("Index Scan Backward")
+    assert "Sort" not in plan
+    assert "Seq Scan" not in plan
+
+
+async def test_get_pr_report_plan(database):
+    await _save_pr(database)
+    plan = await _explain(
+        database,
+        database.get_pr_reports,
+        organization="organization",
+        repo="repo",
+        pull=1,
+        commit="commit",
+        project="",
+    )
+    scans = _scans(plan)
+    assert sorted(scans) == ["coveragereportpullrequests", "coveragereports"]
+    assert all(scan.startswith("Index Scan") for scan in scans.values())
+    assert "(pull = 1)" in plan
+    assert "Seq Scan" not in plan
+
+
+async def test_save_coverage_updates_latest_report(database):
+    await _save(database, _coverage(), "commit1")
+    await _save(database, _coverage(), "commit2")
+    latest = await database.get_latest_report("organization", "repo", "branch", "")
+    assert latest.commit_hash == "commit2"
+
+    # a new upload for an older commit makes it the latest again
+    await _save(database, _coverage(), "commit1")
+    latest = await database.get_latest_report("organization", "repo")
+    assert latest.commit_hash == "commit1"
+    assert await database.db.fetch_val("SELECT count(*) FROM latestreports") == 1
+    assert await database.get_latest_report("organization", "repo", "missing") is None
+
+
+async def test_latest_report_is_not_replaced_by_older(database):
+    await _save(database, _coverage(), "commit1")
+    await _save(database, _coverage(), "commit2")
+    report = await database.get_report("organization", "repo", "commit1")
+    report.modification_date = datetime(2000, 1, 1)
+    await database._update_latest_report(report)
+    latest = await database.get_latest_report("organization", "repo", "branch", "")
+    assert latest.commit_hash == "commit2"
+
+
+async def test_migrate_latest_reports(database, pg_dsn):
+    await _save(database, _coverage(), "commit1")
+    await _save(database, _coverage(), "commit2")
+    await database.db.execute("DELETE FROM latestreports")
+    models.init(pg_dsn)
+    latest = await database.get_latest_report("organization", "repo", "branch", "")
+    assert latest.commit_hash == "commit2"
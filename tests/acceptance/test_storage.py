@@ -0,0 +1,62 @@
+import io
+from datetime import datetime, timedelta
+
+import pytest
+
+from opencoverage import storage
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture()
+async def pg_storage(db):
+    await db.initialize()
+    yield storage.PostgresStorage(db)
+    await db.finalize()
+
+
+async def test_put_get_delete(pg_storage):
+    data = b"data" * 1024 * 1024
+    key = await pg_storage.put(io.BytesIO(data))
+    assert await pg_storage.get(key) == data
+    await pg_storage.delete(key)
+    with pytest.raises(storage.BlobNotFoundException):
+        await pg_storage.get(key)
+
+
+async def test_put_deduplicates(pg_storage, db):
+    count_query = "SELECT count(*) FROM pg_largeobject_metadata"
+    num_objects = await db.db.fetch_val(count_query)
+    key = await pg_storage.put(io.BytesIO(b"data"))
+    assert await pg_storage.put(io.BytesIO(b"data")) == key
+    assert await db.db.fetch_val("SELECT count(*) FROM blobs") == 1
+    # duplicated large object is removed
+    assert await db.db.fetch_val(count_query) == num_objects + 1
+
+
+async def test_collect_garbage(pg_storage, db):
+    key1 = await pg_storage.put(io.BytesIO(b"data1"))
+    key2 = await pg_storage.put(io.BytesIO(b"data2"))
+    await db.add_task(name="test", data=b"", status="scheduled", data_key=key1)
+
+    referenced = await db.get_referenced_blobs(datetime.utcnow())
+    assert referenced == {key1}
+    removed = await pg_storage.collect_garbage(
+        referenced, datetime.utcnow() + timedelta(seconds=10)
+    )
+    assert removed == 1
+    await pg_storage.get(key1)
+    with pytest.raises(storage.BlobNotFoundException):
+        await pg_storage.get(key2)
+
+
+async def test_referenced_blobs_of_failed_tasks(db):
+    await db.initialize()
+    await db.add_task(name="test", data=b"", status="error", data_key="failed")
+    await db.add_task(name="test", data=b"", status="scheduled", data_key="pending")
+    assert await db.get_referenced_blobs(datetime.utcnow() - timedelta(days=1)) == {
+        "failed",
+        "pending",
+    }
+    assert await db.get_referenced_blobs(datetime.utcnow()) == {"pending"}
+    await db.finalize()
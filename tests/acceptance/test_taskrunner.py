@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pydantic
+import pytest
+
+from opencoverage import taskrunner
+from opencoverage.api.app import HTTPApplication
+from opencoverage.models import Task
+
+pytestmark = pytest.mark.asyncio
+
+
+class Config(pydantic.BaseModel):
+    ...
+
+
+@pytest.fixture()
+async def runner(settings, db):
+    await db.initialize()
+    runner = taskrunner.TaskRunner(settings, db)
+    yield runner
+    await runner.stop_consuming()
+    await db.finalize()
+
+
+async def test_add_task_wakes_up_runner(runner):
+    started = asyncio.Event()
+
+    async def task(runner, config):
+        started.set()
+
+    with patch.dict(taskrunner._registered, {"test": (task, Config)}):
+        # only a notification can start the task in time
+        runner.check_interval = runner.listen_check_interval = 60
+        await runner.start_consuming()
+        assert runner.listening
+        await asyncio.sleep(0.1)
+        await runner.add(name="test", config=Config())
+        await asyncio.wait_for(started.wait(), timeout=5)
+
+
+async def test_claim_task_skips_claimed_tasks(db):
+    await db.initialize()
+    try:
+        await db.add_task(name="test", data=b"", status="scheduled")
+        await db.add_task(name="test", data=b"", status="scheduled")
+        stale_before = datetime.utcnow() - timedelta(minutes=10)
+        task1 = await db.claim_task(stale_before)
+        task2 = await db.claim_task(stale_before)
+        assert task1.status == task2.status == "running"
+        assert task1.id != task2.id
+        assert await db.claim_task(stale_before) is None
+
+        # reclaim tasks of a runner that went away
+        task3 = await db.claim_task(datetime.utcnow())
+        assert task3.id == task1.id
+    finally:
+        await db.finalize()
+
+
+async def test_claim_task_gives_up_after_attempts(db):
+    await db.initialize()
+    try:
+        await db.add_task(name="test", data=b"", status="scheduled")
+        await db.add_task(name="test", data=b"", status="scheduled")
+        task1 = await db.claim_task(datetime.utcnow(), max_attempts=2)
+        assert task1.attempts == 1
+        assert (await db.claim_task(datetime.utcnow(), max_attempts=2)).id == task1.id
+        # the other task is claimed once the first one ran out of attempts
+        task2 = await db.claim_task(datetime.utcnow(), max_attempts=2)
+        assert task2.id != task1.id
+        assert task2.attempts == 1
+        task1 = await db.db.query(Task).filter(Task.id == task1.id).one()
+        assert task1.status == "error"
+        assert task1.attempts == 2
+    finally:
+        await db.finalize()
+
+
+async def test_run_tasks_concurrently(runner, settings):
+    settings.task_concurrency = 4
+    running = 0
+    done = asyncio.Event()
+
+    async def task(runner, config):
+        nonlocal running
+        running += 1
+        if running == 4:
+            done.set()
+        await done.wait()
+
+    with patch.dict(taskrunner._registered, {"test": (task, Config)}):
+        await runner.start_consuming()
+        for _ in range(4):
+            await runner.add(name="test", config=Config())
+        # every task must be running at the same time for this to finish
+        await asyncio.wait_for(done.wait(), timeout=5)
+
+
+async def test_api_without_consuming_tasks(settings, bootstrap):
+    settings.consume_tasks = False
+    app = HTTPApplication(settings)
+    await app.initialize()
+    try:
+        assert app.taskrunner.consume_tasks == []
+    finally:
+        await app.finalize()
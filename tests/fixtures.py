@@ -1,9 +1,12 @@
 import os
+from functools import partial
 from unittest.mock import AsyncMock
 
 import aiohttp_client
 import pytest
 
+from opencoverage import reporter
+from opencoverage.clients import SCMClient
 from opencoverage.settings import Settings
 
 
@@ -22,6 +25,10 @@ def scm():
     mock.installation_id = "1234"
     mock.get_pulls.return_value = []
     mock.file_exists.return_value = False
+    # parses what get_pull_diff returns
+    mock.get_pull_diff_coverage.side_effect = partial(
+        SCMClient.get_pull_diff_coverage, mock
+    )
     yield mock
 
 
@@ -34,3 +41,9 @@ def settings(pg_dsn):
 @pytest.fixture(autouse=True)
 def clear_aiohttp_sessions(event_loop):
     event_loop.run_until_complete(aiohttp_client.close())
+
+
+@pytest.fixture(autouse=True)
+def clear_configuration_cache():
+    yield
+    reporter._configuration_cache = None
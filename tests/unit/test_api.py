@@ -1,3 +1,4 @@
+import os
 import zlib
 from unittest.mock import (
     ANY,
@@ -10,6 +11,8 @@ import pytest
 from starlette.datastructures import URL
 
 from opencoverage.api import badge, upload
+from opencoverage.cache import LRUCache
+from opencoverage.utils import run_async
 
 pytestmark = pytest.mark.asyncio
 
@@ -33,13 +36,37 @@ def get_client(settings, db, taskrunner, scm):
 
 
 @pytest.fixture()
-def req(settings, db, taskrunner, get_client):
+def storage():
+    storage = AsyncMock()
+    storage.uploads = []
+
+    async def put(fileobj):
+        storage.uploads.append(fileobj.read())
+        return "key"
+
+    storage.put.side_effect = put
+    yield storage
+
+
+def _stream(*chunks):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    return stream
+
+
+@pytest.fixture()
+def req(settings, db, taskrunner, get_client, storage):
     req = AsyncMock()
-    req.body.return_value = b"data"
+    req.stream = _stream(b"da", b"ta")
     req.headers = {}
     req.app.settings = settings
     req.app.db = db
     req.app.taskrunner = taskrunner
+    req.app.storage = storage
+    req.app.badge_cache = LRUCache(10)
+    req.app.badge_generations = {}
     req.url = URL("http://foobar.com")
     yield req
 
@@ -75,15 +102,17 @@ async def test_upload_v4_https(settings):
 
 
 class TestUploadReport:
-    async def test_upload_report(self, req, db, scm, taskrunner):
+    async def test_upload_report(self, req, db, scm, taskrunner, storage):
         await upload.upload_report(req, branch="branch", commit="commit", slug="org/repo")
         db.update_organization.assert_called_with("org", scm.installation_id)
         taskrunner.add.assert_called_with(name="coveragereport", config=ANY)
         config = taskrunner.add.mock_calls[0].kwargs["config"]
-        config.branch == "branch"
-        config.commit == "commit"
-        config.organization == "org"
-        config.data == b"data"
+        assert config.branch == "branch"
+        assert config.commit == "commit"
+        assert config.organization == "org"
+        assert config.data is None
+        assert config.data_key == "key"
+        assert storage.uploads == [b"data"]
 
     async def test_upload_report_with_token(
         self, req, db, scm, get_client, settings, taskrunner
@@ -94,31 +123,53 @@ class TestUploadReport:
         get_client.assert_called_with(settings, "token")
         taskrunner.add.assert_called_with(name="coveragereport", config=ANY)
 
-    async def test_upload_gzip_report(self, req, db, scm, taskrunner):
+    async def test_upload_gzip_report(self, req, db, scm, taskrunner, storage):
         gzip_worker = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
         reports_gzip = gzip_worker.compress(b"data") + gzip_worker.flush()
-        req.body.return_value = reports_gzip
+        req.stream = _stream(reports_gzip[:5], reports_gzip[5:])
         req.headers["content-type"] = "application/x-gzip"
 
         await upload.upload_report(req, branch="branch", commit="commit", slug="org/repo")
         taskrunner.add.assert_called_with(name="coveragereport", config=ANY)
         config = taskrunner.add.mock_calls[0].kwargs["config"]
-        config.branch == "branch"
-        config.commit == "commit"
-        config.organization == "org"
-        config.data == b"data"
+        assert config.branch == "branch"
+        assert config.commit == "commit"
+        assert config.organization == "org"
+        assert config.data_key == "key"
+        assert storage.uploads == [b"data"]
+
+    async def test_upload_large_gzip_report(self, req, settings, storage):
+        data = os.urandom(1024 * 1024).hex().encode()
+        gzip_worker = zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        reports_gzip = gzip_worker.compress(data) + gzip_worker.flush()
+        chunks = []
+        while reports_gzip:
+            chunks.append(reports_gzip[:1024])
+            reports_gzip = reports_gzip[1024:]
+        req.stream = _stream(*chunks)
+        req.headers["content-type"] = "application/x-gzip"
+        settings.upload_spool_size = 1024
+
+        with patch("opencoverage.api.upload.run_async", side_effect=run_async) as write:
+            await upload.upload_report(
+                req, branch="branch", commit="commit", slug="org/repo"
+            )
+        assert storage.uploads == [data]
+        # spooled to disk in batches from the executor
+        assert 2 < write.call_count < len(chunks)
 
 
 async def test_get_badge(req, db):
     report = Mock()
     report.line_rate = 0.888123
-    db.get_reports.return_value = (None, [report])
+    db.get_latest_report.return_value = report
     resp = await badge.get_badge(req, "org", "repo")
     body = resp.body.decode()
     assert "89%" in body
     assert badge.Colors.GT_85 in body
 
     report.line_rate = 0.518123
+    req.app.badge_generations[("org", "repo")] = 1
     resp = await badge.get_badge(req, "org", "repo")
     body = resp.body.decode()
     assert "52%" in body
@@ -126,6 +177,45 @@ async def test_get_badge(req, db):
 
 
 async def test_get_badge_missing(req, db):
-    db.get_reports.return_value = (None, [])
+    db.get_latest_report.return_value = None
     resp = await badge.get_badge(req, "org", "repo")
     assert resp.status_code == 404
+
+
+async def test_get_badge_cached(req, db):
+    report = Mock()
+    report.line_rate = 0.9
+    db.get_latest_report.return_value = report
+    await badge.get_badge(req, "org", "repo", branch="main")
+    resp = await badge.get_badge(req, "org", "repo", branch="main")
+    assert "90%" in resp.body.decode()
+    db.get_latest_report.assert_called_once()
+
+    await badge.get_badge(req, "org", "repo", branch="other")
+    assert db.get_latest_report.call_count == 2
+
+
+async def test_get_badge_cache_bounded(req, db):
+    db.get_latest_report.return_value = None
+    for idx in range(20):
+        await badge.get_badge(req, "org", "repo", branch=f"branch{idx}")
+    assert len(req.app.badge_cache) == 10
+
+
+async def test_get_badge_not_modified(req, db, settings):
+    report = Mock()
+    report.line_rate = 0.9
+    db.get_latest_report.return_value = report
+    resp = await badge.get_badge(req, "org", "repo")
+    etag = resp.headers["etag"]
+    assert resp.headers["cache-control"] == f"max-age={settings.badge_max_age}"
+
+    req.headers["if-none-match"] = f'"other", W/{etag}'
+    resp = await badge.get_badge(req, "org", "repo")
+    assert resp.status_code == 304
+    assert resp.body == b""
+    assert resp.headers["etag"] == etag
+
+    req.headers["if-none-match"] = '"other"'
+    resp = await badge.get_badge(req, "org", "repo")
+    assert resp.status_code == 200
@@ -0,0 +1,63 @@
+import time
+from unittest.mock import patch
+
+from opencoverage.cache import LRUCache
+
+
+def test_get_set():
+    cache = LRUCache(10)
+    assert cache.get("foo") is None
+    assert cache.get("foo", "default") == "default"
+    cache.set("foo", "bar")
+    assert cache.get("foo") == "bar"
+    assert "foo" in cache
+    cache.delete("foo")
+    assert "foo" not in cache
+    cache.delete("foo")
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert "a" in cache
+    assert "b" not in cache
+    assert len(cache) == 2
+
+
+def test_expires():
+    cache = LRUCache(2, ttl=10)
+    cache.set("a", 1)
+    with patch("opencoverage.cache.time.monotonic", return_value=time.monotonic() + 11):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_disabled():
+    cache = LRUCache(0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_clear():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_bounded_by_size():
+    cache = LRUCache(10, sizeof=len)
+    cache.set("a", "x" * 4)
+    cache.set("b", "x" * 4)
+    cache.set("a", "x" * 6)
+    assert cache.size == 10
+    cache.set("c", "x" * 2)
+    assert "b" not in cache
+    assert cache.size == 8
+    # larger than the cache
+    cache.set("c", "x" * 11)
+    assert "c" not in cache
+    assert cache.size == 6
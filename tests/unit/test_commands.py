@@ -1,4 +1,4 @@
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
 from opencoverage import commands
 
@@ -44,3 +44,20 @@ def test_load_env_file():
         commands.run_command()
         mocked_server.assert_called_once()
         load_dotenv.assert_called_with(".env")
+
+
+def test_run_worker():
+    with patch("opencoverage.commands.Settings"), patch(
+        "opencoverage.commands.Database"
+    ) as db, patch("opencoverage.commands.TaskRunner") as runner, patch(
+        "opencoverage.commands.asyncio.Event"
+    ) as event:
+        runner.return_value.start_consuming = AsyncMock()
+        runner.return_value.stop_consuming = AsyncMock()
+        db.return_value.initialize = AsyncMock()
+        db.return_value.finalize = AsyncMock()
+        event.return_value.wait = AsyncMock()
+        commands.run_worker()
+        runner.return_value.start_consuming.assert_called_once()
+        runner.return_value.stop_consuming.assert_called_once()
+        db.return_value.finalize.assert_called_once()
@@ -1,11 +1,19 @@
+import hashlib
 from datetime import datetime
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 import sqlalchemy.orm.exc
+from sqlalchemy.dialects import postgresql
 
 from opencoverage import models
-from opencoverage.database import Database
+from opencoverage.database import (
+    REPORTS_CHANNEL,
+    Database,
+    InvalidCursorException,
+    encode_cursor,
+)
+from opencoverage.encoding import encode_lines
 
 pytestmark = pytest.mark.asyncio
 
@@ -21,6 +29,8 @@ def raw():
 
     txn = AsyncMock()
     db.transaction = MagicMock(return_value=txn)
+    db.connection = MagicMock()
+    db.connection.return_value.raw_connection = AsyncMock()
 
     yield db
 
@@ -76,7 +86,7 @@ class TestGetRepos:
         repo1 = models.Repo(name="1")
         raw.all.return_value = [repo1]
         cursor, results = await db.get_repos("organization", limit=1)
-        assert cursor == "1"
+        assert cursor == encode_cursor(["1"])
         assert results == [repo1]
         raw.query.assert_called_with(models.Repo)
         raw.filter.assert_called_once()
@@ -87,15 +97,23 @@ class TestGetRepos:
     async def test_get_repos_by_cursor(self, db, raw):
         repo2 = models.Repo(name="2")
         raw.all.return_value = [repo2]
-        cursor, results = await db.get_repos("organization", limit=1, cursor="1")
-        assert cursor == "2"
+        cursor, results = await db.get_repos(
+            "organization", limit=1, cursor=encode_cursor(["1"])
+        )
+        assert cursor == encode_cursor(["2"])
         assert results == [repo2]
         raw.query.assert_called_with(models.Repo)
         assert len(raw.filter.mock_calls) == 2
+        assert str(raw.filter.mock_calls[1].args[0]) == "repos.name > :name_1"
         raw.order_by.assert_called_with(models.Repo.name)
         raw.limit.assert_called_with(1)
         raw.all.assert_called_once()
 
+    async def test_get_repos_invalid_cursor(self, db, raw):
+        for cursor in ("cursor", encode_cursor(["1", "2"]), encode_cursor([]) + "a"):
+            with pytest.raises(InvalidCursorException):
+                await db.get_repos("organization", cursor=cursor)
+
 
 class TestGetReports:
     async def test_get_reports(self, db, raw):
@@ -112,15 +130,38 @@ class TestGetReports:
         raw.limit.assert_called_with(10)
         raw.all.assert_called_once()
 
+    async def test_get_reports_cursor(self, db, raw):
+        date = datetime.utcnow()
+        report = models.CoverageReport(
+            modification_date=date, branch="branch", commit_hash="commit_hash", project=""
+        )
+        raw.all.return_value = [report]
+        cursor, _ = await db.get_reports("organization", "repo", limit=1)
+        # filtered columns are not part of the cursor
+        assert cursor == encode_cursor([date, "branch", "commit_hash", ""])
+
+        await db.get_reports("organization", "repo", limit=1, cursor=cursor)
+        assert str(raw.filter.mock_calls[-1].args[0]) == (
+            "(coveragereports.modification_date, coveragereports.branch, "
+            "coveragereports.commit_hash, coveragereports.project) "
+            "< (:param_1, :param_2, :param_3, :param_4)"
+        )
+        assert [str(c) for c in raw.order_by.mock_calls[-1].args] == [
+            "coveragereports.modification_date DESC",
+            "coveragereports.branch DESC",
+            "coveragereports.commit_hash DESC",
+            "coveragereports.project DESC",
+        ]
+
 
 class TestGetReportFiles:
     async def test_get_report_files(self, db, raw):
         record = {"filename": "filename"}
         raw.all.return_value = [record]
         cursor, results = await db.get_report_files(
-            "organization", "repo", "commit_hash", limit=1, cursor="cursor"
+            "organization", "repo", "commit_hash", limit=1, cursor=encode_cursor(["a"])
         )
-        assert cursor == "filename"
+        assert cursor == encode_cursor(["filename"])
         assert results == [record]
         raw.query.assert_called_once()
         assert len(raw.filter.mock_calls) == 2
@@ -170,6 +211,167 @@ class TestSaveCoverage:
         )
         raw.update.assert_called_once()
 
+    async def test_ensures_parents_in_one_statement(self, db, raw):
+        await db.save_coverage(
+            organization="organization",
+            repo="repo",
+            branch="branch",
+            commit_hash="commit_hash",
+            coverage={
+                "lines_valid": 0,
+                "lines_covered": 0,
+                "line_rate": 0,
+                "branches_valid": 0,
+                "branches_covered": 0,
+                "branch_rate": 0,
+                "complexity": 0,
+                "file_coverage": {},
+            },
+        )
+        # parents, then the latest report and its notification
+        assert raw.execute.call_count == 3
+        query, values = raw.execute.call_args_list[0].args
+        for table in ("repos", "branches", "commits"):
+            assert f"INSERT INTO {table}" in query
+        assert query.count("ON CONFLICT DO NOTHING") == 3
+        assert values["ob2_hash"] == "commit_hash"
+
+    async def test_updates_latest_report(self, db, raw):
+        raw.one.side_effect = sqlalchemy.orm.exc.NoResultFound
+        await db.save_coverage(
+            organization="organization",
+            repo="repo",
+            branch="branch",
+            commit_hash="commit_hash",
+            coverage={
+                "lines_valid": 2,
+                "lines_covered": 1,
+                "line_rate": 0.5,
+                "branches_valid": 0,
+                "branches_covered": 0,
+                "branch_rate": 0,
+                "complexity": 0,
+                "file_coverage": {},
+            },
+        )
+        raw.transaction.assert_called_once()
+        statement = raw.execute.call_args_list[1].args[0]
+        compiled = statement.compile(dialect=postgresql.dialect())
+        assert "INSERT INTO latestreports" in str(compiled)
+        assert "ON CONFLICT (organization, repo, branch, project) DO UPDATE" in str(
+            compiled
+        )
+        assert compiled.params["commit_hash"] == "commit_hash"
+        assert compiled.params["line_rate"] == 0.5
+        raw.execute.assert_called_with(
+            "SELECT pg_notify(:channel, :payload)",
+            {"channel": REPORTS_CHANNEL, "payload": '["organization", "repo"]'},
+        )
+
+    async def test_copies_coverage_records(self, db, raw):
+        await db.save_coverage(
+            organization="organization",
+            repo="repo",
+            branch="branch",
+            commit_hash="commit_hash",
+            coverage={
+                "lines_valid": 2,
+                "lines_covered": 1,
+                "line_rate": 0.5,
+                "branches_valid": 0,
+                "branches_covered": 0,
+                "branch_rate": 0,
+                "complexity": 0,
+                "file_coverage": {
+                    "foo.py": {
+                        "line_rate": 0.5,
+                        "branch_rate": 0,
+                        "complexity": 0,
+                        "lines": {1: 1, 2: 0},
+                    }
+                },
+            },
+        )
+        copy = raw.connection.return_value.raw_connection.copy_records_to_table
+        copy.assert_called_once()
+        assert copy.call_args.args == ("coveragerecords",)
+        (record,) = copy.call_args.kwargs["records"]
+        lines_hash = hashlib.sha256(encode_lines({1: 1, 2: 0})).hexdigest()
+        assert record[4:10] == ("foo.py", models.ROOT_PROJECT, lines_hash, 0.5, 0, 0)
+        lines = raw.connection.return_value.raw_connection.execute
+        assert lines.call_args.args[1:3] == ([lines_hash], [encode_lines({1: 1, 2: 0})])
+
+    async def test_upserts_changed_records(self, db, raw):
+        coverage = {
+            "lines_valid": 2,
+            "lines_covered": 1,
+            "line_rate": 0.5,
+            "branches_valid": 0,
+            "branches_covered": 0,
+            "branch_rate": 0,
+            "complexity": 0,
+            "file_coverage": {
+                "foo.py": {
+                    "line_rate": 0.5,
+                    "branch_rate": 0,
+                    "complexity": 0,
+                    "lines": {1: 1, 2: 0},
+                },
+                "bar.py": {
+                    "line_rate": 1.0,
+                    "branch_rate": 0,
+                    "complexity": 0,
+                    "lines": {1: 1},
+                },
+            },
+        }
+        await db.save_coverage(
+            organization="organization",
+            repo="repo",
+            branch="branch",
+            commit_hash="commit_hash",
+            coverage=coverage,
+        )
+        copy = raw.connection.return_value.raw_connection.copy_records_to_table
+        foo, bar = copy.call_args.kwargs["records"]
+
+        raw.fetch_all.return_value = [
+            {
+                "filename": "foo.py",
+                "lines_hash": foo[6],
+                "line_rate": 0.5,
+                "branch_rate": 0,
+                "complexity": 0,
+            },
+            {
+                "filename": "bar.py",
+                "lines_hash": bar[6],
+                "line_rate": 0.5,
+                "branch_rate": 0,
+                "complexity": 0,
+            },
+            {
+                "filename": "removed.py",
+                "lines_hash": "removed",
+                "line_rate": 0.5,
+                "branch_rate": 0,
+                "complexity": 0,
+            },
+        ]
+        await db.save_coverage(
+            organization="organization",
+            repo="repo",
+            branch="branch",
+            commit_hash="commit_hash",
+            coverage=coverage,
+        )
+        copy.assert_called_once()
+        raw.delete.assert_called()
+        executemany = raw.connection.return_value.raw_connection.executemany
+        executemany.assert_called_once()
+        (record,) = executemany.call_args.args[1]
+        assert record[:10] == bar[:10]
+
 
 class TestTasks:
     async def test_update_task(self, db, raw):
@@ -208,7 +410,12 @@ class TestGetPRReports:
                 raise AssertionError(f"Could not find filter: {filt}")
 
     async def test_get_pr_reports_cursor(self, db, raw):
-        result = {"coveragereportpullrequests_modification_date": datetime.utcnow()}
+        date = datetime.utcnow()
+        result = {
+            "coveragereportpullrequests_modification_date": date,
+            "coveragereportpullrequests_branch": "branch",
+            "coveragereportpullrequests_project": "project",
+        }
         raw.all.return_value = [result]
         cursor, results = await db.get_pr_reports(
             organization="organization",
@@ -216,9 +423,9 @@ class TestGetPRReports:
             pull=1,
             commit="commit",
             limit=1,
-            cursor="cursor",
+            cursor=encode_cursor([date, "branch", ""]),
         )
-        assert cursor is not None
+        assert cursor == encode_cursor([date, "branch", "project"])
         assert results == [result]
         raw.all.assert_called_once()
         for filt in (
@@ -226,7 +433,6 @@ class TestGetPRReports:
             models.CoverageReportPullRequest.repo == "repo",
             models.CoverageReportPullRequest.pull == 1,
             models.CoverageReportPullRequest.commit_hash == "commit",
-            models.CoverageReportPullRequest.modification_date > "cursor",
         ):
             for call in raw.filter.mock_calls:
                 if call.args[0].compare(filt):
@@ -0,0 +1,46 @@
+import pytest
+
+from opencoverage import encoding
+
+
+@pytest.mark.parametrize(
+    "lines",
+    [
+        {},
+        {1: 0},
+        {1: 1, 2: 0, 10: 5},
+        {5: 300, 70_000: 1},
+        {1: 2 ** 40},
+    ],
+)
+def test_round_trip(lines):
+    assert encoding.decode_lines(encoding.encode_lines(lines)) == lines
+
+
+def test_unsorted_lines():
+    data = encoding.encode_lines({10: 1, 2: 3})
+    assert list(encoding.decode_lines(data).items()) == [(2, 3), (10, 1)]
+
+
+def test_small_values_use_single_bytes():
+    lines = {idx: 1 for idx in range(1, 1001)}
+    assert len(encoding.encode_lines(lines)) == encoding.HEADER.size + 2000
+
+
+def test_negative_values():
+    with pytest.raises(encoding.EncodingException):
+        encoding.encode_lines({1: -1})
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"\x02\x01\x01\x00\x00\x00\x00",
+        b"\x01\x03\x01\x00\x00\x00\x00",
+        encoding.encode_lines({1: 1})[:-1],
+    ],
+)
+def test_invalid_data(data):
+    with pytest.raises(encoding.EncodingException):
+        encoding.decode_lines(data)
@@ -1,9 +1,13 @@
+import tracemalloc
+from concurrent.futures import Future, ProcessPoolExecutor
 from unittest.mock import Mock, patch
 
 import pytest
+from lcov_cobertura import LcovCobertura
 from lxml import etree
 
 from opencoverage import parser
+from tests.utils import read_data
 
 
 def test_get_el_raises_parsing_exception():
@@ -189,3 +193,317 @@ two
         "foo1.txt": "one\ntwo",
         "foo2.txt": "one\ntwo",
     }
+
+
+def test_parse_xml_coverage_data_from_bytes():
+    result = parser.parse_xml_coverage_data(
+        b"""<?xml version="1.0" ?>
+<coverage version="5.3.1" timestamp="1610313969570"
+          lines-valid="2" lines-covered="1" line-rate="0.5"
+          branches-covered="0" branches-valid="0" branch-rate="0" complexity="0">
+    <sources>
+        <source>/some/path</source>
+    </sources>
+    <packages>
+        <package name="something" line-rate="0.5" branch-rate="0" complexity="0">
+            <classes>
+                <class name="foo.py" filename="foo.py" complexity="0" line-rate="0.5" branch-rate="0">
+                    <lines>
+                        <line number="1" hits="1"/>
+                        <line number="2" hits="0"/>
+                    </lines>
+                </class>
+                <class name="bar.py" filename="bar.py" complexity="0" line-rate="1" branch-rate="0">
+                    <lines/>
+                </class>
+            </classes>
+        </package>
+    </packages>
+</coverage>""",  # noqa
+        ["path/foo.py", "bar.py"],
+    )
+    assert result["line_rate"] == 0.5
+    assert result["file_coverage"] == {
+        "path/foo.py": {
+            "line_rate": 0.5,
+            "branch_rate": 0.0,
+            "complexity": 0.0,
+            "lines": {1: 1, 2: 0},
+        },
+        "bar.py": {
+            "line_rate": 1.0,
+            "branch_rate": 0.0,
+            "complexity": 0.0,
+            "lines": {},
+        },
+    }
+
+
+def test_iter_xml_coverage_data_no_classes():
+    result = list(
+        parser.iter_xml_coverage_data(
+            '<coverage version="1"><packages></packages></coverage>', []
+        )
+    )
+    assert result == [("coverage", {"version": "1"})]
+
+
+def test_parse_guillotina_coverage():
+    data = read_data("guillotina.cov")
+    result = parser.parse_raw_coverage_data(data)
+    assert len(result["file_coverage"]) == 373
+    assert result["file_coverage"]["guillotina/__init__.py"]["line_rate"] == 1.0
+
+
+def _lcov_report():
+    toc_raw, _, files_data = read_data("lcov").decode("utf-8").partition("<<<<<< network")
+    toc = [li for li in toc_raw.splitlines() if li]
+    files = parser.parse_files(files_data)
+    return toc, [v for k, v in files.items() if k.endswith(".lcov")][0]
+
+
+def test_parse_lcov_matches_cobertura_conversion():
+    toc, cov_data = _lcov_report()
+    with patch("time.time", return_value=1610313969.5):
+        expected = parser.parse_xml_coverage_data(LcovCobertura(cov_data).convert(), toc)
+        result = parser.parse_lcov_coverage_data(cov_data, toc)
+    assert len(result["file_coverage"]) > 0
+    assert result == expected
+
+
+@pytest.mark.parametrize(
+    "cov_data",
+    [
+        "",
+        "SF:./foo.js\nDA:1,1\nDA:2,0\nDA:2,3\nend_of_record\n",
+        "SF:foo.js\nBRDA:3,0,0,-\nBRDA:3,0,1,2\nDA:3,1\nend_of_record\n",
+        "SF:foo.js\nBRDA:3,0,0,1\nBRF:4\nBRH:1\nend_of_record\nend_of_record\n",
+        "SF:foo.js\nDA:1,1\nend_of_record\nSF:bar.js\nDA:1,0\nend_of_record\n",
+        "SF:foo.js\nDA:1,1\nend_of_record\nSF:missing.js\nDA:1,0\nend_of_record\n",
+    ],
+)
+def test_parse_lcov_records_match_cobertura_conversion(cov_data):
+    toc = ["foo.js", "bar.js"]
+    with patch("time.time", return_value=1610313969.5):
+        expected = parser.parse_xml_coverage_data(LcovCobertura(cov_data).convert(), toc)
+        result = parser.parse_lcov_coverage_data(cov_data, toc)
+    assert result == expected
+
+
+def test_parse_lcov_ignores_unterminated_record():
+    result = parser.parse_lcov_coverage_data(
+        "SF:foo.js\nDA:1,1\nend_of_record\nSF:bar.js\nDA:1,0\n", ["foo.js", "bar.js"]
+    )
+    assert list(result["file_coverage"].keys()) == ["foo.js"]
+    assert result["lines_valid"] == 1
+
+
+class TestPathIndex:
+    def test_resolve_exact(self):
+        index = parser.PathIndex(["foo/bar.py", "bar.py"])
+        assert index.resolve("bar.py", "/src/foo") == "bar.py"
+
+    def test_resolve_with_base_path(self):
+        index = parser.PathIndex(["foo/bar.py"])
+        assert index.resolve("bar.py", "/src/foo") == "foo/bar.py"
+
+    def test_resolve_shortest_match_wins(self):
+        index = parser.PathIndex(["src/foo/bar.py", "foo/bar.py"])
+        assert index.resolve("bar.py", "/src/foo") == "foo/bar.py"
+        index = parser.PathIndex(["src/foo/bar.py"])
+        assert index.resolve("bar.py", "/src/foo") == "src/foo/bar.py"
+
+    def test_resolve_missing(self):
+        index = parser.PathIndex(["foo/bar.py"])
+        assert index.resolve("baz.py", "/src/foo") is None
+        assert index.resolve("baz.py") is None
+
+    def test_get_path_index(self):
+        index = parser.PathIndex(["foo.py"])
+        assert parser.get_path_index(index) is index
+        assert "foo.py" in parser.get_path_index(["foo.py"])
+        assert len(index) == 1
+
+
+def _cobertura_class(filename, lines):
+    line_els = "".join(f'<line number="{no}" hits="{hits}"/>' for no, hits in lines)
+    return f"""<class name="{filename}" filename="{filename}" complexity="0"
+                       line-rate="0" branch-rate="0">
+                    <lines>{line_els}</lines>
+                </class>"""
+
+
+def _cobertura(filename, lines, timestamp=1, branches_valid=0, files=None):
+    files = files or {filename: lines}
+    lines_valid = sum(len(file_lines) for file_lines in files.values())
+    lines_covered = sum(
+        len([hits for _, hits in file_lines if hits]) for file_lines in files.values()
+    )
+    line_rate = lines_covered / lines_valid if lines_valid else 0
+    classes = "".join(
+        _cobertura_class(name, file_lines) for name, file_lines in files.items()
+    )
+    return f"""<?xml version="1.0" ?>
+<coverage version="5.3.1" timestamp="{timestamp}" lines-valid="{lines_valid}"
+          lines-covered="{lines_covered}" line-rate="{line_rate}"
+          branches-covered="0" branches-valid="{branches_valid}"
+          branch-rate="0" complexity="0">
+    <packages>
+        <package name="pkg" line-rate="0" branch-rate="0" complexity="0">
+            <classes>
+                {classes}
+            </classes>
+        </package>
+    </packages>
+</coverage>"""
+
+
+def _upload(*files):
+    data = "foo.py\nbar.py\n<<<<<< network\n"
+    for name, content in files:
+        data += f"# path={name}\n{content}\n<<<<<< EOF\n"
+    return data.encode("utf-8")
+
+
+class TestMergeCoverage:
+    def test_merge_sums_hits(self):
+        result = parser.parse_raw_coverage_data(
+            _upload(
+                ("shard1/coverage.xml", _cobertura("foo.py", [(1, 1), (2, 0)], 1)),
+                ("shard2/coverage.xml", _cobertura("foo.py", [(2, 2), (3, 0)], 2)),
+                ("shard3/coverage.lcov", "SF:bar.py\nDA:1,1\nend_of_record\n"),
+                ("ignored.txt", "foobar"),
+            )
+        )
+        assert result["file_coverage"]["foo.py"]["lines"] == {1: 1, 2: 2, 3: 0}
+        assert result["file_coverage"]["foo.py"]["line_rate"] == 2 / 3
+        assert result["file_coverage"]["bar.py"]["lines"] == {1: 1}
+        assert result["lines_valid"] == 4
+        assert result["lines_covered"] == 3
+        assert result["line_rate"] == 0.75
+
+    def test_merge_uses_executor(self):
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            result = parser.parse_raw_coverage_data(
+                _upload(
+                    ("shard1/coverage.xml", _cobertura("foo.py", [(1, 1)], 1, 2)),
+                    ("shard2/coverage.xml", _cobertura("bar.py", [(1, 0)], 2, 4)),
+                ),
+                executor=executor,
+            )
+        assert set(result["file_coverage"].keys()) == {"foo.py", "bar.py"}
+        assert result["timestamp"] == 2
+        assert result["branches_valid"] == 6
+        assert result["line_rate"] == 0.5
+
+    def test_merge_matches_single_report(self):
+        files = {
+            "foo.py": [(1, 1), (2, 0)],
+            "bar.py": [(1, 0)],
+            "missing.py": [(1, 1), (2, 1)],
+        }
+        single = parser.parse_raw_coverage_data(
+            _upload(("coverage.xml", _cobertura(None, None, 1, 6, files=files)))
+        )
+        sharded = parser.parse_raw_coverage_data(
+            _upload(
+                *(
+                    (f"shard{idx}/coverage.xml", _cobertura(name, lines, 1, 2))
+                    for idx, (name, lines) in enumerate(files.items())
+                )
+            )
+        )
+        assert set(sharded["file_coverage"].keys()) == {"foo.py", "bar.py"}
+        for key in ("lines_valid", "lines_covered", "line_rate", "branches_valid"):
+            assert sharded[key] == single[key]
+        assert sharded["lines_valid"] == 5
+        assert sharded["lines_covered"] == 3
+
+    def test_merge_submits_files_lazily(self):
+        class Executor:
+            pending = max_pending = 0
+
+            def submit(self, func, *args):
+                future = Future()
+                future.set_result(func(*args))
+                self.pending += 1
+                self.max_pending = max(self.pending, self.max_pending)
+                result = future.result
+
+                def consume():
+                    self.pending -= 1
+                    return result()
+
+                future.result = consume
+                return future
+
+        upload = _upload(
+            *(
+                (f"shard{idx}/coverage.xml", _cobertura("foo.py", [(1, idx)]))
+                for idx in range(6)
+            )
+        )
+        executor = Executor()
+        with patch.object(parser, "PARALLEL_PARSE_WINDOW", 2):
+            result = parser.parse_raw_coverage_data(upload, executor=executor)
+        assert result["file_coverage"]["foo.py"]["lines"] == {1: 15}
+        # only a window of files is copied and waiting to be parsed at once
+        assert executor.max_pending == 2
+        assert executor.pending == 0
+
+    def test_merge_single_report_unchanged(self):
+        coverage = parser.parse_xml_coverage_data(
+            _cobertura("foo.py", [(1, 1)]), ["foo.py"]
+        )
+        assert parser.merge_coverage_data([coverage]) is coverage
+
+    def test_no_coverage_files(self):
+        with pytest.raises(parser.ParsingException):
+            parser.parse_raw_coverage_data(_upload(("foo.txt", "foobar")))
+
+
+class TestEnvelope:
+    def test_scan_envelope(self):
+        data = _upload(("coverage.xml", "<xml/>"), ("coverage.lcov", "SF:foo.py"))
+        toc, start = parser.scan_envelope(data)
+        assert toc == ["foo.py", "bar.py"]
+        files = [
+            (name, content.tobytes()) for name, content in parser.iter_files(data, start)
+        ]
+        assert files == [
+            ("coverage.xml", b"<xml/>\n"),
+            ("coverage.lcov", b"SF:foo.py\n"),
+        ]
+
+    def test_scan_envelope_no_network(self):
+        toc, start = parser.scan_envelope(b"foobar")
+        assert toc == []
+        assert list(parser.iter_files(b"foobar", start)) == []
+
+    def test_open_view(self):
+        data = b"one\r\ntwo\nthree"
+        assert list(parser._iter_lines(memoryview(data)[4:])) == ["", "two", "three"]
+        assert parser.open_view(data).read() == data
+
+    def test_parse_does_not_copy_upload(self):
+        lcov = "".join(
+            f"SF:file{idx}.js\nDA:1,1\nDA:2,0\nend_of_record\n" for idx in range(30_000)
+        )
+        classes = "".join(
+            f'<class name="f{idx}" filename="f{idx}.py" complexity="0" line-rate="1" '
+            f'branch-rate="0"><lines><line number="1" hits="1"/></lines></class>'
+            for idx in range(20_000)
+        )
+        xml = _cobertura("foo.py", [(1, 1)]).replace("<classes>", f"<classes>{classes}")
+        data = _upload(("coverage.lcov", lcov), ("coverage.xml", xml))
+        assert len(data) > 2_000_000
+
+        tracemalloc.start()
+        try:
+            result = parser.parse_raw_coverage_data(data)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert result["file_coverage"]["foo.py"]["lines"] == {1: 1}
+        # the upload is never decoded or copied as a whole
+        assert peak < len(data) / 10
@@ -1,4 +1,10 @@
-from unittest.mock import ANY, AsyncMock, patch
+import asyncio
+from unittest.mock import (
+    ANY,
+    AsyncMock,
+    Mock,
+    patch,
+)
 
 import pytest
 
@@ -87,6 +93,39 @@ async def test_report_ignores_pull_after_merge(reporter, db, scm):
     scm.get_pull_diff.assert_not_called()
 
 
+async def test_update_pulls_concurrently(reporter, settings):
+    settings.pull_concurrency = 2
+    running = []
+    concurrency = []
+
+    async def update_pull(pull, *args):
+        running.append(pull.id)
+        concurrency.append(len(running))
+        await asyncio.sleep(0.05)
+        running.remove(pull.id)
+
+    pulls = [types.Pull(id=idx, base="base", head="head") for idx in range(4)]
+    with patch.object(reporter, "update_pull", side_effect=update_pull) as update:
+        await reporter.update_pulls(pulls, {}, None, None)
+    assert update.call_count == 4
+    assert max(concurrency) == 2
+
+
+async def test_update_pulls_isolates_errors(reporter):
+    updated = []
+
+    async def update_pull(pull, *args):
+        if pull.id == 1:
+            raise ValueError("failed")
+        updated.append(pull.id)
+
+    pulls = [types.Pull(id=idx, base="base", head="head") for idx in range(3)]
+    with patch.object(reporter, "update_pull", side_effect=update_pull):
+        with pytest.raises(ValueError):
+            await reporter.update_pulls(pulls, {}, None, None)
+    assert sorted(updated) == [0, 2]
+
+
 async def test_report_get_line_rate(reporter, db, scm):
     coverage = {
         "version": "5.3.1",
@@ -183,6 +222,41 @@ async def test_report_get_line_rate_missing_files(reporter, db, scm):
     assert rate == 1.0
 
 
+async def test_report_get_line_rate_large_diff(reporter, db, scm):
+    coverage = {
+        "line_rate": 0.5,
+        "file_coverage": {
+            "small": {"lines": {line: line % 2 for line in range(1, 11)}},
+            "large": {"lines": {line: line % 2 for line in range(1, 1001)}},
+        },
+    }
+    ddata, rate = reporter.get_line_rate(
+        [
+            # diff lines without coverage and repeated lines are not counted
+            {
+                "filename": "small",
+                "lines": list(range(1, 101)) + [1, 2],
+                "line_rate": 1,
+                "hits": 0,
+                "misses": 0,
+            },
+            {
+                "filename": "large",
+                "lines": [1, 2, 3, 3, 2000],
+                "line_rate": 1,
+                "hits": 0,
+                "misses": 0,
+            },
+        ],
+        coverage,
+    )
+    assert [(d["hits"], d["misses"], d["line_rate"]) for d in ddata] == [
+        (5, 5, 0.5),
+        (2, 1, 2 / 3),
+    ]
+    assert rate == 7 / 13
+
+
 async def test_report_update_pull(reporter, db, scm):
     scm.get_pull_diff.return_value = """diff --git a/guillotina/addons.py b/guillotina/addons.py
 index 8ad9304b..de0e1d25 100644
@@ -330,6 +404,41 @@ foobar.py
     )
 
 
+async def test_coverage_configuration_cached(reporter, scm):
+    scm.file_exists.return_value = True
+
+    async def _download_file(*args):
+        yield b"diff_target: "
+        yield b"90%"
+
+    scm.download_file = Mock(side_effect=_download_file)
+    config = await reporter.get_coverage_configuration()
+    assert config.diff_target == "90%"
+    config.diff_target = "100%"
+    assert (await reporter.get_coverage_configuration()).diff_target == "90%"
+    scm.file_exists.assert_called_once()
+    scm.download_file.assert_called_once()
+
+    reporter.commit = "other"
+    await reporter.get_coverage_configuration()
+    assert scm.file_exists.call_count == 2
+
+
+async def test_missing_coverage_configuration_cached(reporter, scm):
+    scm.file_exists.return_value = False
+    assert await reporter.get_coverage_configuration() is None
+    assert await reporter.get_coverage_configuration() is None
+    scm.file_exists.assert_called_once()
+
+
+async def test_coverage_configuration_cache_disabled(reporter, settings, scm):
+    settings.configuration_cache_size = 0
+    scm.file_exists.return_value = False
+    assert await reporter.get_coverage_configuration() is None
+    assert await reporter.get_coverage_configuration() is None
+    assert scm.file_exists.call_count == 2
+
+
 async def test_report_no_coverage_file(settings, db, scm):
     scm.file_exists.return_value = False
 
@@ -10,6 +10,8 @@ from unittest.mock import (
 import pytest
 
 from opencoverage.clients import scm
+from opencoverage.types import Pull
+from opencoverage.utils import run_async
 from tests import utils
 
 pytestmark = pytest.mark.asyncio
@@ -19,6 +21,8 @@ pytestmark = pytest.mark.asyncio
 def _clear():
     scm.github._token_cache.clear()
     scm.github._private_key_cache.clear()
+    scm.github._diff_cache = None
+    scm.github._response_cache = None
 
 
 def test_get_client_unsupported():
@@ -42,6 +46,7 @@ class TestGithub:
         res.status = 200
         res.json.return_value = {"foo": "bar"}
         res.text.return_value = '{"foo": "bar"}'
+        res.headers = {}
         yield res
 
     @pytest.fixture()
@@ -126,6 +131,106 @@ class TestGithub:
         with pytest.raises(scm.github.AuthorizationException):
             await client.get_pull_diff("org", "repo", "id")
 
+    async def test_get_pull_diff_coverage_cached(self, client, session, response, token):
+        response.text.return_value = """diff --git a/foo.py b/foo.py
+index 8ad9304b..de0e1d25 100644
+--- a/foo.py
++++ b/foo.py
+@@ -1,1 +1,2 @@
+ foo
++bar
+"""
+        response.headers = {"ETag": '"etag"', "Content-Length": "100"}
+        pull = Pull(id=1, base="base", head="head", head_sha="sha")
+        with patch(
+            "opencoverage.clients.scm.github.run_async", side_effect=run_async
+        ) as parse:
+            diff_data = await client.get_pull_diff_coverage("org", "repo", pull)
+            assert [(d["filename"], d["lines"]) for d in diff_data] == [("foo.py", [2])]
+            assert "If-None-Match" not in session.get.call_args.kwargs["headers"]
+            diff_data[0]["hits"] = 1
+
+            response.status = 304
+            assert await client.get_pull_diff_coverage("org", "repo", pull) == [
+                {**diff_data[0], "hits": 0}
+            ]
+            assert session.get.call_args.kwargs["headers"]["If-None-Match"] == '"etag"'
+            assert parse.call_count == 1
+            # the raw diff is not kept in the response cache as well
+            assert len(scm.github._response_cache) == 0
+
+            # a new head commit is parsed again
+            response.status = 200
+            await client.get_pull_diff_coverage(
+                "org", "repo", Pull(id=1, base="base", head="head", head_sha="other")
+            )
+            assert parse.call_count == 2
+
+    async def test_get_cached(self, client, session, response, token):
+        response.read.return_value = b'{"foo": "bar"}'
+        response.headers = {"ETag": '"etag"', "Content-Length": "14"}
+        assert await client.file_exists("org", "repo", "commit", "foo.yaml")
+        assert "If-None-Match" not in session.get.call_args.kwargs["headers"]
+
+        async for chunk in client.download_file("org", "repo", "commit", "foo.yaml"):
+            ...
+        # another accept header is another representation
+        assert "If-None-Match" not in session.get.call_args.kwargs["headers"]
+
+        response.status = 304
+        assert await client.file_exists("org", "repo", "commit", "foo.yaml")
+        headers = session.get.call_args.kwargs["headers"]
+        assert headers["If-None-Match"] == '"etag"'
+
+    async def test_get_cached_body(self, client, session, response, token):
+        response.read.return_value = b"x" * 3000
+        response.headers = {"ETag": '"etag"', "Content-Length": "3000"}
+        chunks = []
+        async for chunk in client.download_file("org", "repo", "commit", "foo.yaml"):
+            chunks.append(chunk)
+        response.status = 304
+        response.read.reset_mock()
+        chunks2 = []
+        async for chunk in client.download_file("org", "repo", "commit", "foo.yaml"):
+            chunks2.append(chunk)
+        response.read.assert_not_called()
+        assert chunks == chunks2
+        assert [len(chunk) for chunk in chunks] == [1024, 1024, 952]
+
+    async def test_get_not_cached_without_etag(self, client, session, response, token):
+        await client.file_exists("org", "repo", "commit", "foo.yaml")
+        await client.file_exists("org", "repo", "commit", "foo.yaml")
+        assert "If-None-Match" not in session.get.call_args.kwargs["headers"]
+        assert len(scm.github._response_cache) == 0
+
+    async def test_get_streamed_without_length(self, client, session, response, token):
+        chunks = [b"x" * 1024, b""]
+        response.content.read.side_effect = chunks
+        for headers in (
+            {"ETag": '"etag"'},
+            {"ETag": '"etag"', "Content-Length": str(2 * scm.github.CACHE_MAX_BODY_SIZE)},
+        ):
+            response.content.read.side_effect = list(chunks)
+            response.headers = headers
+            async for chunk in client.download_file("org", "repo", "commit", "foo"):
+                assert chunk == chunks[0]
+            response.read.assert_not_called()
+        assert len(scm.github._response_cache) == 0
+
+    async def test_get_cache_size(self, client, settings, session, response, token):
+        settings.github_response_cache_size = 10
+        response.read.return_value = b'{"foo": "bar"}'
+        response.headers = {"ETag": '"etag"', "Content-Length": "14"}
+        await client.file_exists("org", "repo", "commit", "foo.yaml")
+        assert len(scm.github._response_cache) == 0
+
+    async def test_get_read_error_releases(self, client, session, req, response, token):
+        response.read.side_effect = ConnectionResetError()
+        response.headers = {"ETag": '"etag"', "Content-Length": "14"}
+        with pytest.raises(ConnectionResetError):
+            await client.file_exists("org", "repo", "commit", "foo.yaml")
+        req.__aexit__.assert_awaited_once()
+
     async def test_create_check(self, client, session, response, token):
         response.status = 201
         check = scm.github.GithubCheck(
@@ -0,0 +1,69 @@
+import io
+import os
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+
+import pytest
+
+from opencoverage import storage
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture()
+def file_storage(tmp_path):
+    yield storage.FileStorage(str(tmp_path / "blobs"))
+
+
+async def test_put_get_delete(file_storage):
+    key = await file_storage.put(io.BytesIO(b"data"))
+    assert key == "3a6eb0790f39ac87c94f3856b2dd2c5d110e6811602261a9a923d3bb23adc8b7"
+    assert await file_storage.get(key) == b"data"
+    await file_storage.delete(key)
+    with pytest.raises(storage.BlobNotFoundException):
+        await file_storage.get(key)
+    # deleting missing blob is a noop
+    await file_storage.delete(key)
+
+
+async def test_put_deduplicates(file_storage):
+    key = await file_storage.put(io.BytesIO(b"data"))
+    path = os.path.join(file_storage.path, key)
+    os.utime(path, (0, 0))
+    assert await file_storage.put(io.BytesIO(b"data")) == key
+    assert os.listdir(file_storage.path) == [key]
+    # refreshed so it is not collected
+    assert os.path.getmtime(path) > 0
+
+
+async def test_put_cleans_up_on_error(file_storage):
+    fileobj = Mock()
+    fileobj.read.side_effect = IOError
+    with pytest.raises(IOError):
+        await file_storage.put(fileobj)
+    assert os.listdir(file_storage.path) == []
+
+
+async def test_collect_garbage(file_storage):
+    assert await file_storage.keys(datetime.utcnow()) == []
+    key1 = await file_storage.put(io.BytesIO(b"data1"))
+    await file_storage.put(io.BytesIO(b"data2"))
+    key3 = await file_storage.put(io.BytesIO(b"data3"))
+    os.utime(os.path.join(file_storage.path, key3), (time.time() + 60,) * 2)
+
+    removed = await file_storage.collect_garbage(
+        {key1}, datetime.utcnow() + timedelta(seconds=10)
+    )
+    assert removed == 1
+    assert sorted(os.listdir(file_storage.path)) == sorted([key1, key3])
+
+
+def test_get_storage(settings, tmp_path):
+    settings.storage_path = str(tmp_path)
+    assert storage.get_storage(settings, None).path == str(tmp_path)
+    settings.storage = "postgres"
+    assert isinstance(storage.get_storage(settings, None), storage.PostgresStorage)
+    settings.storage = "missing"
+    with pytest.raises(TypeError):
+        storage.get_storage(settings, None)
@@ -23,13 +23,16 @@ def db():
     txn = AsyncMock()
     raw_db.transaction = MagicMock(return_value=txn)
     db.db = raw_db
-    db.get_task.return_value = None
+    db.claim_task.return_value = None
+    listener = AsyncMock()
+    listener.is_closed = Mock(return_value=False)
+    db.listen.return_value = listener
     yield db
 
 
 @pytest.fixture()
-def runner(db):
-    yield taskrunner.TaskRunner(None, db)
+def runner(settings, db):
+    yield taskrunner.TaskRunner(settings, db)
 
 
 class FooType(pydantic.BaseModel):
@@ -56,7 +59,27 @@ class TestAddTask:
         )
         await runner.add(name="coveragereport", config=config)
         db.add_task.assert_called_with(
-            name="coveragereport", data=pickle.dumps(config), status="scheduled"
+            name="coveragereport",
+            data=pickle.dumps(config),
+            status="scheduled",
+            data_key=None,
+        )
+
+    async def test_add_task_with_data_key(self, db, runner):
+        config = tasks.CoverageTaskConfig(
+            organization="organization",
+            repo="repo",
+            branch="branch",
+            commit="commit",
+            installation_id="installation_id",
+            data_key="key",
+        )
+        await runner.add(name="coveragereport", config=config)
+        db.add_task.assert_called_with(
+            name="coveragereport",
+            data=pickle.dumps(config),
+            status="scheduled",
+            data_key="key",
         )
 
 
@@ -64,11 +87,92 @@ class TestConsume:
     async def test_consume(self, db, runner):
         await runner.start_consuming()
         await runner.stop_consuming()
-        assert runner.consume_task is None
+        assert runner.consume_tasks == []
+
+    async def test_consume_listens_for_tasks(self, db, runner):
+        await runner.start_consuming()
+        db.listen.assert_called_with(taskrunner.TASKS_CHANNEL, runner.notify)
+        assert runner.listening
+        await runner.stop_consuming()
+        db.listen.return_value.close.assert_called()
+        assert not runner.listening
+
+    async def test_notify_wakes_up_runner(self, db, runner):
+        runner.listen_check_interval = 60
+        await runner.start_consuming()
+        await asyncio.sleep(0.01)
+        db.claim_task.reset_mock()
+        runner.notify()
+        await asyncio.sleep(0.01)
+        db.claim_task.assert_called()
+        await runner.stop_consuming()
+
+    async def test_polls_without_listener(self, db, runner):
+        db.listen.side_effect = Exception()
+        runner.check_interval = 0.01
+        await runner.start_consuming()
+        assert not runner.listening
+        await asyncio.sleep(0.05)
+        await runner.stop_consuming()
+        assert db.claim_task.call_count > 1
+
+    async def test_reconnects_listener(self, db, runner):
+        runner.listen_retry_interval = 0
+        runner.check_interval = 0.01
+        db.listen.return_value.is_closed.return_value = True
+        await runner.start_consuming()
+        await asyncio.sleep(0.05)
+        await runner.stop_consuming()
+        assert db.listen.call_count > 1
+
+    async def test_runs_queued_tasks_without_waiting(self, db, runner, settings):
+        settings.task_concurrency = 1
+        runner.listen_check_interval = 60
+        db.claim_task.side_effect = [Mock(), Mock(), None]
+        with patch.object(runner, "run_task") as run_task:
+            await runner.start_consuming()
+            await asyncio.sleep(0.01)
+            await runner.stop_consuming()
+            assert run_task.call_count == 2
+
+    async def test_runs_tasks_concurrently(self, db, runner, settings):
+        settings.task_concurrency = 3
+        running = 0
+        max_running = 0
+
+        async def run_task(task):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(running, max_running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        db.claim_task.side_effect = [Mock() for _ in range(6)] + [None] * 100
+        with patch.object(runner, "run_task", side_effect=run_task):
+            await runner.start_consuming()
+            assert len(runner.consume_tasks) == 3
+            await asyncio.sleep(0.05)
+            await runner.stop_consuming()
+        assert max_running == 3
+        assert db.remove_task.call_count == 6
+
+    async def test_task_timeout(self, db, runner, settings):
+        settings.task_timeout = 0.01
+        task = Mock()
+        db.claim_task.return_value = task
+
+        async def run_task(task):
+            await asyncio.sleep(1)
+
+        with patch.object(runner, "run_task", side_effect=run_task):
+            await runner._run_tasks()
+        assert task.status == "error"
+        db.update_task.assert_called_with(task)
+        db.remove_task.assert_not_called()
 
     async def test_stop_consuming_without_start(self, db, runner):
         await runner.stop_consuming()
-        assert runner.consume_task is None
+        assert runner.consume_tasks == []
 
     async def test_run_tasks_retries_on_error(self, runner):
         with patch("opencoverage.taskrunner.logger") as logger, patch.object(
@@ -81,7 +185,7 @@ class TestConsume:
 
     async def test_run_tasks_handles_exceptions(self, runner, db):
         task = Mock()
-        db.get_task.return_value = task
+        db.claim_task.return_value = task
         with patch.object(runner, "run_task", side_effect=Exception()):
             await runner.start_consuming()
             await asyncio.sleep(0.01)
@@ -101,3 +205,33 @@ class TestConsume:
         ):
             await runner.run_task(task)
             task_func.assert_called_with(runner, ANY)
+
+
+class TestCollectGarbage:
+    async def test_collect_garbage(self, runner, db, settings, tmp_path):
+        settings.storage_path = str(tmp_path)
+        settings.storage_gc_grace_period = -10
+        (tmp_path / "referenced").write_bytes(b"data")
+        (tmp_path / "unreferenced").write_bytes(b"data")
+        db.get_referenced_blobs.return_value = {"referenced"}
+        await runner.collect_garbage()
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["referenced"]
+
+    async def test_run_tasks_collects_garbage(self, runner, settings):
+        settings.storage_gc_interval = -1
+        with patch.object(runner, "collect_garbage") as collect_garbage:
+            await runner.start_consuming()
+            await asyncio.sleep(0.01)
+            await runner.stop_consuming()
+            collect_garbage.assert_called()
+
+    async def test_run_tasks_continues_after_gc_error(self, runner, db, settings):
+        settings.storage_gc_interval = -1
+        with patch.object(
+            runner, "collect_garbage", side_effect=RuntimeError()
+        ) as collect_garbage:
+            await runner.start_consuming()
+            await asyncio.sleep(0.05)
+            assert not any(task.done() for task in runner.consume_tasks)
+            await runner.stop_consuming()
+            assert collect_garbage.call_count > 1
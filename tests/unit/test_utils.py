@@ -0,0 +1,10 @@
+from opencoverage import utils
+
+
+def test_process_pool():
+    pool = utils.get_process_pool()
+    assert utils.get_process_pool() is pool
+    utils.shutdown_process_pool()
+    assert utils._process_pool is None
+    # noop when not started
+    utils.shutdown_process_pool()